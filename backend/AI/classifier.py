@@ -0,0 +1,267 @@
+import json
+import math
+import os
+import re
+import sys
+import threading
+import zlib
+from collections import Counter
+
+try:
+    import numpy as np
+except ImportError:  # numpy is optional, without it batches are scored text by text
+    np = None
+
+
+'''
+CPU-only hazard classifier for report descriptions and social posts.
+
+Texts are turned into hashed word and word-pair counts (no vocabulary to keep
+in memory) and scored by a multinomial naive Bayes model, which is a linear
+model over those counts. The model is loaded once per process. Without a
+trained model file it starts from the seed phrases below; 'train' refits it
+on reports moderators have categorised.
+
+With numpy a batch is scored with array operations. Every feature the model
+knows gets one row in a (features x categories) matrix, holding how far its
+log probability is above the unseen-feature default. The hashed tokens of
+the whole batch are looked up in that matrix at once, and the rows are summed
+per text on top of bias + default * token count.
+'''
+
+CATEGORIES = ['Flooding', 'Tsunami', 'High Waves', 'Coastal Damage', 'Other']
+N_FEATURES = 1 << 18
+MODEL_PATH = os.getenv('HAZARD_MODEL_PATH', os.path.join(os.path.dirname(__file__), 'hazard_model.json'))
+
+SEED_EXAMPLES = {
+    'Flooding': [
+        'flood water entering houses', 'streets flooded after heavy rain', 'waterlogging in the colony',
+        'river overflowing its banks', 'flash flood in the village', 'knee deep water on the road',
+        'drains overflowing and roads under water', 'inundated low lying area', 'heavy rainfall flooding',
+    ],
+    'Tsunami': [
+        'tsunami warning issued', 'sea water receding suddenly after earthquake', 'tsunami waves hit the coast',
+        'earthquake felt near the coast tsunami alert', 'giant wave after undersea quake', 'tsunami evacuation',
+    ],
+    'High Waves': [
+        'high waves crashing on the beach', 'rough sea and big waves', 'huge swells near the shore',
+        'strong waves and storm surge', 'sea is very rough today waves over the wall', 'high tide waves',
+        'cyclone causing high waves', 'swell surge warning for fishermen',
+    ],
+    'Coastal Damage': [
+        'coastal erosion damaged the road', 'sea wall collapsed', 'beach eroded and houses damaged',
+        'boats damaged at the harbour', 'bridge collapsed near the coast', 'jetty broken by the sea',
+        'fishing huts destroyed on the shore', 'embankment breached damage to coastline',
+    ],
+    'Other': [
+        'nice weather today', 'traffic jam on the highway', 'power cut in the area',
+        'garbage not collected', 'street light not working', 'please share this video',
+    ],
+}
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+# to turn one text into {feature index: count} using words and word pairs
+def featurize(text):
+    words = _TOKEN.findall((text or '').lower())
+    tokens = words + [a + ' ' + b for a, b in zip(words, words[1:])]
+    return Counter(zlib.crc32(token.encode()) % N_FEATURES for token in tokens)
+
+
+class HazardClassifier:
+    def __init__(self, weights, bias, default):
+        self.weights = weights  # {category: {feature: log probability}}
+        self.bias = bias  # {category: log prior}
+        self.default = default  # {category: log probability of an unseen feature}
+        if np is not None:
+            known = set().union(*(w.keys() for w in weights.values()))
+            self._features = np.array(sorted(known), dtype=np.int64)  # sorted, for searchsorted
+            self._bias = np.array([bias[c] for c in CATEGORIES])
+            self._default = np.array([default[c] for c in CATEGORIES])
+            self._deltas = np.array([
+                [weights[c].get(int(feature), default[c]) - default[c] for c in CATEGORIES]
+                for feature in self._features
+            ]).reshape(len(self._features), len(CATEGORIES))
+
+    # to fit multinomial naive Bayes on (text, category) pairs
+    @classmethod
+    def train(cls, examples, alpha=1.0):
+        counts = {category: Counter() for category in CATEGORIES}
+        docs = Counter()
+        for text, category in examples:
+            if category not in counts:
+                continue
+            counts[category].update(featurize(text))
+            docs[category] += 1
+
+        total_docs = sum(docs.values())
+        weights, bias, default = {}, {}, {}
+        for category in CATEGORIES:
+            total = sum(counts[category].values()) + alpha * N_FEATURES
+            bias[category] = math.log((docs[category] + 1) / (total_docs + len(CATEGORIES)))
+            default[category] = math.log(alpha / total)
+            weights[category] = {
+                feature: math.log((count + alpha) / total)
+                for feature, count in counts[category].items()
+            }
+        return cls(weights, bias, default)
+
+    # to score a whole batch, returns one category per text
+    # texts with no known word at all fall back to 'Other'
+    def predict_batch(self, texts):
+        if np is None or not texts:
+            return self.predict_each(texts)
+        hashes, owners = [], []
+        for n, text in enumerate(texts):
+            words = _TOKEN.findall((text or '').lower())
+            tokens = words + [a + ' ' + b for a, b in zip(words, words[1:])]
+            hashes.extend(map(zlib.crc32, map(str.encode, tokens)))
+            owners.extend([n] * len(tokens))
+        hashes = np.array(hashes, dtype=np.int64) % N_FEATURES
+        owners = np.array(owners, dtype=np.int64)
+
+        rows = np.searchsorted(self._features, hashes)
+        rows[rows == len(self._features)] = 0
+        known = self._features[rows] == hashes if len(self._features) else np.zeros(len(hashes), dtype=bool)
+        rows, known_owners = rows[known], owners[known]
+
+        tokens_per_text = np.bincount(owners, minlength=len(texts))
+        scores = self._bias + np.outer(tokens_per_text, self._default)
+        for c in range(len(CATEGORIES)):
+            scores[:, c] += np.bincount(known_owners, weights=self._deltas[rows, c], minlength=len(texts))
+        best = np.argmax(scores, axis=1)  # ties go to the earlier category, as in predict_each
+        has_known = np.bincount(known_owners, minlength=len(texts)) > 0
+        return [CATEGORIES[b] if ok else 'Other' for b, ok in zip(best, has_known)]
+
+    # to score texts one at a time with dict lookups, the path without numpy
+    def predict_each(self, texts):
+        predictions = []
+        for text in texts:
+            features = featurize(text)
+            if not any(feature in w for w in self.weights.values() for feature in features):
+                predictions.append('Other')
+                continue
+            best, best_score = 'Other', None
+            for category in CATEGORIES:
+                weights = self.weights[category]
+                default = self.default[category]
+                score = self.bias[category]
+                for feature, count in features.items():
+                    score += count * weights.get(feature, default)
+                if best_score is None or score > best_score:
+                    best, best_score = category, score
+            predictions.append(best)
+        return predictions
+
+    def save(self, path=MODEL_PATH):
+        with open(path, 'w') as f:
+            json.dump({'weights': self.weights, 'bias': self.bias, 'default': self.default}, f)
+
+    @classmethod
+    def load(cls, path=MODEL_PATH):
+        with open(path) as f:
+            data = json.load(f)
+        weights = {category: {int(k): v for k, v in w.items()} for category, w in data['weights'].items()}
+        return cls(weights, data['bias'], data['default'])
+
+
+def _seed_examples():
+    return [(text, category) for category, texts in SEED_EXAMPLES.items() for text in texts]
+
+_model = None
+_model_lock = threading.Lock()
+
+# to get the process-wide model, loaded on first use
+def get_model():
+    global _model
+    with _model_lock:
+        if _model is None:
+            if os.path.exists(MODEL_PATH):
+                _model = HazardClassifier.load(MODEL_PATH)
+            else:
+                _model = HazardClassifier.train(_seed_examples())
+        return _model
+
+def classify_batch(texts):
+    return get_model().predict_batch(texts)
+
+def classify(text):
+    return classify_batch([text])[0]
+
+
+
+'''TRAINING AND BACKFILL'''
+
+# to refit the model on categorised reports plus the seed phrases and save it
+def train_from_reports():
+    from database.db_models import Mongo_Uploads
+
+    examples = _seed_examples()
+    for doc in Mongo_Uploads.objects(issue_category__in=CATEGORIES, description__ne=None).only('description', 'issue_category'):
+        examples.append((doc.description, doc.issue_category))
+    model = HazardClassifier.train(examples)
+    model.save(MODEL_PATH)
+    return len(examples)
+
+# to fill predictions on reports still marked 'manual' and unclassified social posts
+def backfill(batch_size=2000):
+    from pymongo import UpdateOne
+    from database.connect import SessionLocal
+    from database.counters import bump_version
+    from database.db_models import Mongo_Uploads, SocialPost
+    from database import search
+
+    reports = 0
+    collection = Mongo_Uploads._get_collection()
+    while True:
+        docs = list(collection.find({'issue_predicted_category': ['manual']}, {'description': 1}).limit(batch_size))
+        if not docs:
+            break
+        predictions = classify_batch([doc.get('description') for doc in docs])
+        collection.bulk_write([
+            UpdateOne({'_id': doc['_id']}, {'$set': {'issue_predicted_category': [prediction]}})
+            for doc, prediction in zip(docs, predictions)
+        ], ordered=False)
+        reports += len(docs)
+
+    posts = 0
+    session = SessionLocal()
+    try:
+        while True:
+            rows = (
+                session.query(SocialPost.id, SocialPost.content)
+                .filter(SocialPost.predicted_category.is_(None))
+                .limit(batch_size)
+                .all()
+            )
+            if not rows:
+                break
+            predictions = classify_batch([content for _, content in rows])
+            session.bulk_update_mappings(SocialPost, [
+                {'id': post_id, 'predicted_category': prediction}
+                for (post_id, _), prediction in zip(rows, predictions)
+            ])
+            session.commit()
+            search.index_posts(session.query(SocialPost).filter(SocialPost.id.in_([post_id for post_id, _ in rows])))
+            posts += len(rows)
+    finally:
+        session.close()
+    if posts:
+        bump_version('social_posts')
+    return reports, posts
+
+
+# usage: python -m AI.classifier train|backfill|predict "some text"
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'backfill'
+    if command == 'train':
+        print(f"Trained on {train_from_reports()} examples, saved to {MODEL_PATH}.")
+    elif command == 'backfill':
+        reports, posts = backfill()
+        print(f"Classified {reports} reports and {posts} social posts.")
+    elif command == 'predict':
+        print(classify(' '.join(sys.argv[2:])))
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
@@ -0,0 +1,230 @@
+import re
+import sys
+import threading
+import zlib
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from database import geo, leases
+from database.db_models import Mongo_ClusterItems
+from database.ids import IdAllocator
+
+
+'''
+Incremental near-duplicate clustering of reports and social posts.
+
+Each text gets a MinHash signature over its word pairs. Signatures are split
+into LSH bands, so an incoming item is only compared with the few items that
+share a band with it instead of with everything. A candidate joins the
+cluster when the estimated Jaccard similarity is at least SIMILARITY and, for
+two reports, when they are within RADIUS_KM and WINDOW_HOURS of each other.
+
+The items of the last WINDOW_HOURS live in Mongo_ClusterItems, shared by
+every worker: candidates are one find on the multikey `bands` index and a
+TTL index drops items once they leave the window. Looking for a cluster and
+adding the item happen under the 'cluster-assign' lease, so two
+near-duplicates arriving at two workers at once still share a cluster.
+Every clustered item stores its cluster_id so moderators can act on a whole
+cluster. `python -m AI.clustering backfill` loads the recent items of a
+database that was clustered before the collection existed.
+'''
+
+NUM_PERM = 64
+BANDS = 16  # 16 bands of 4 rows: pairs above ~0.5 similarity nearly always collide
+ROWS = NUM_PERM // BANDS
+SIMILARITY = 0.5
+RADIUS_KM = 5.0
+WINDOW_HOURS = 48
+MAX_ITEMS = 200000  # most recent posts backfill loads
+MAX_CANDIDATES = 500  # items compared per assignment, boilerplate text can share bands with many
+ASSIGN_LEASE = 'cluster-assign'
+
+_PRIME = (1 << 61) - 1
+_MASK = (1 << 32) - 1
+_PERMUTATIONS = [((i * 0x9E3779B97F4A7C15 + 1) % _PRIME | 1, (i * 0xBF58476D1CE4E5B9 + 7) % _PRIME) for i in range(NUM_PERM)]
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+cluster_ids = IdAllocator('clusters')
+
+
+# to get the MinHash signature of a text, None when it has no words
+def signature(text):
+    words = _TOKEN.findall((text or '').lower())
+    shingles = {a + ' ' + b for a, b in zip(words, words[1:])} or set(words)
+    if not shingles:
+        return None
+    hashes = [zlib.crc32(s.encode()) for s in shingles]
+    return tuple(
+        min(((a * h + b) % _PRIME) & _MASK for h in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+def similarity(sig_a, sig_b):
+    return sum(1 for a, b in zip(sig_a, sig_b) if a == b) / NUM_PERM
+
+
+# to get the LSH bucket keys of a signature, '<band>:<hash of its rows>'
+def _bands(sig):
+    return [f"{band}:{zlib.crc32(repr(sig[band * ROWS:(band + 1) * ROWS]).encode()):08x}" for band in range(BANDS)]
+
+def _item_id(key):
+    return ':'.join(str(part) for part in key)
+
+
+class ClusterIndex:
+    def __init__(self):
+        self._lock = threading.Lock()  # the lease is per process, this orders its threads
+
+    def _matches(self, sig, lat, lon, when, candidate):
+        if lat is not None and candidate.get('latitude') is not None:
+            if geo.haversine_km(lat, lon, candidate['latitude'], candidate['longitude']) > RADIUS_KM:
+                return 0
+        if when and candidate.get('when') and abs(when - candidate['when']) > timedelta(hours=WINDOW_HOURS):
+            return 0
+        score = similarity(sig, candidate['signature'])
+        return score if score >= SIMILARITY else 0
+
+    # to find the cluster of one item and store it, the caller holds the locks
+    def _assign_locked(self, collection, key, sig, lat, lon, when):
+        item_id = _item_id(key)
+        now = datetime.utcnow()
+        candidates = collection.find(
+            {'bands': {'$in': _bands(sig)}, 'expires_at': {'$gt': now}},
+            {'signature': 1, 'cluster_id': 1, 'latitude': 1, 'longitude': 1, 'when': 1},
+        ).limit(MAX_CANDIDATES)
+        best, best_score = None, 0
+        for candidate in candidates:
+            if candidate['_id'] == item_id:
+                return candidate['cluster_id']
+            score = self._matches(sig, lat, lon, when, candidate)
+            if score > best_score:
+                best, best_score = candidate, score
+
+        cluster_id = best['cluster_id'] if best else cluster_ids.next_id()
+        try:
+            collection.insert_one({
+                '_id': item_id, 'signature': list(sig), 'bands': _bands(sig), 'cluster_id': cluster_id,
+                'latitude': lat, 'longitude': lon, 'when': when,
+                'expires_at': (when or now) + timedelta(hours=WINDOW_HOURS),
+            })
+        except DuplicateKeyError:
+            return collection.find_one({'_id': item_id}, {'cluster_id': 1})['cluster_id']
+        return cluster_id
+
+    # to put items in clusters, [(key, text, lat, lon, when)] -> [cluster id or None]
+    # key is ('report', id) or ('post', platform key); adding a key twice is a no-op
+    # clustering is best effort, None when the text has no words or the store is unavailable
+    def assign_many(self, items):
+        prepared = []
+        for key, text, lat, lon, when in items:
+            lat = float(lat) if lat not in (None, '') else None
+            lon = float(lon) if lon not in (None, '') else None
+            prepared.append((key, signature(text), lat, lon, when))
+        if not any(sig for _, sig, _, _, _ in prepared):
+            return [None] * len(prepared)
+        collection = Mongo_ClusterItems._get_collection()
+        try:
+            with self._lock, leases.held(ASSIGN_LEASE, seconds=30):
+                return [
+                    self._assign_locked(collection, key, sig, lat, lon, when) if sig else None
+                    for key, sig, lat, lon, when in prepared
+                ]
+        except Exception as e:
+            print(f"ClusterIndex.assign_many caused problem: {e}")
+            return [None] * len(prepared)
+
+    def assign(self, key, text, lat=None, lon=None, when=None):
+        return self.assign_many([(key, text, lat, lon, when)])[0]
+
+    # to drop items whose report or post was never stored, e.g. after a failed commit
+    def forget(self, keys):
+        try:
+            Mongo_ClusterItems._get_collection().delete_many({'_id': {'$in': [_item_id(key) for key in keys]}})
+        except Exception as e:
+            print(f"ClusterIndex.forget caused problem: {e}")
+
+    # to store the clustered items of the last WINDOW_HOURS from the database, returns how many
+    # items already stored are left as they are
+    def backfill(self, batch_size=1000):
+        from pymongo import UpdateOne
+        from database.connect import SessionLocal
+        from database.db_models import Uploads, SocialPost, Mongo_Uploads
+
+        since = datetime.utcnow() - timedelta(hours=WINDOW_HOURS)
+        collection = Mongo_ClusterItems._get_collection()
+        session = SessionLocal()
+        stored = 0
+
+        def write(items):
+            operations = []
+            for key, text, cluster_id, lat, lon, when in items:
+                sig = signature(text)
+                if sig:
+                    operations.append(UpdateOne({'_id': _item_id(key)}, {'$setOnInsert': {
+                        'signature': list(sig), 'bands': _bands(sig), 'cluster_id': cluster_id,
+                        'latitude': lat, 'longitude': lon, 'when': when,
+                        'expires_at': (when or datetime.utcnow()) + timedelta(hours=WINDOW_HOURS),
+                    }}, upsert=True))
+            if operations:
+                collection.bulk_write(operations, ordered=False)
+            return len(operations)
+
+        try:
+            uploads = {
+                u.id: u for u in
+                session.query(Uploads.id, Uploads.issue_latitude, Uploads.issue_longitude, Uploads.issue_date)
+                .filter(Uploads.issue_date >= since.date())
+            }
+            docs = Mongo_Uploads.objects(id__in=list(uploads), cluster_id__ne=None).only('id', 'description', 'cluster_id')
+            items = []
+            for doc in docs:
+                u = uploads[doc.id]
+                items.append((
+                    ('report', doc.id), doc.description, doc.cluster_id,
+                    float(u.issue_latitude) if u.issue_latitude is not None else None,
+                    float(u.issue_longitude) if u.issue_longitude is not None else None,
+                    datetime.combine(u.issue_date, datetime.min.time()) if u.issue_date else None,
+                ))
+                if len(items) == batch_size:
+                    stored += write(items)
+                    items = []
+            stored += write(items)
+
+            posts = (
+                session.query(SocialPost.platform, SocialPost.external_id, SocialPost.content, SocialPost.cluster_id)
+                .filter(SocialPost.cluster_id.isnot(None))
+                .order_by(SocialPost.id.desc())
+                .limit(MAX_ITEMS // 2)
+                .yield_per(batch_size)
+            )
+            items = []
+            for platform, external_id, content, cluster_id in posts:
+                items.append((('post', f"{platform}:{external_id}"), content, cluster_id, None, None, None))
+                if len(items) == batch_size:
+                    stored += write(items)
+                    items = []
+            stored += write(items)
+            return stored
+
+        finally:
+            session.close()
+
+
+cluster_index = ClusterIndex()
+
+
+def assign_report(report_id, text, lat=None, lon=None, when=None):
+    return cluster_index.assign(('report', int(report_id)), text, lat, lon, when or datetime.utcnow())
+
+# to cluster several posts under one lease, [(platform, external_id, text)] -> [cluster id]
+def assign_posts(posts):
+    return cluster_index.assign_many([(('post', f"{platform}:{external_id}"), text, None, None, None) for platform, external_id, text in posts])
+
+
+# usage: python -m AI.clustering backfill
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'backfill'
+    if command == 'backfill':
+        print(f"Stored {cluster_index.backfill()} recent clustered items.")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
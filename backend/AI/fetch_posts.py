@@ -1,29 +1,146 @@
 
-import requests
+import hashlib
 import os
+import threading
+import time
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from sqlalchemy import insert, tuple_
 from database.connect import SessionLocal
 from database.db_models import SocialPost
+from AI.classifier import classify_batch
+from AI.clustering import assign_posts, cluster_index
+from database.counters import bump_version
+from database.events import publish
+from database import search
+
+
+TWITTER_BEARER_TOKEN = os.getenv('TWITTER_BEARER_TOKEN', '')
+YOUTUBE_API_KEY = os.getenv('YOUTUBE_API_KEY', '')
+
+# Point these at a local stub server to run the pipeline without the real APIs
+TWITTER_API_URL = os.getenv('TWITTER_API_URL', 'https://api.twitter.com/2')
+YOUTUBE_API_URL = os.getenv('YOUTUBE_API_URL', 'https://www.googleapis.com/youtube/v3')
+
+MAX_WORKERS = int(os.getenv('SOCIAL_FETCH_WORKERS', '8'))
+MAX_PAGES = int(os.getenv('SOCIAL_FETCH_MAX_PAGES', '3'))
+REQUEST_TIMEOUT = 10
+
+
+# -------------------------
+# HTTP plumbing
+# -------------------------
+# token bucket: at most `rate` requests per second, bursts of up to `burst`
+class RateLimiter:
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+def _make_session():
+    retry = Retry(
+        total=3,
+        backoff_factor=0.5,
+        status_forcelist=[429, 500, 502, 503, 504],
+        allowed_methods=['GET'],
+        respect_retry_after_header=True,
+    )
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=MAX_WORKERS, max_retries=retry)
+    session = requests.Session()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+_sources = {
+    'twitter': {'session': _make_session(), 'limiter': RateLimiter(float(os.getenv('TWITTER_RATE', '1')), burst=3)},
+    'youtube': {'session': _make_session(), 'limiter': RateLimiter(float(os.getenv('YOUTUBE_RATE', '10')), burst=10)},
+}
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='social-fetch')
+        return _pool
+
+def _reset_after_fork():
+    global _pool
+    _pool = None
+    for source in _sources.values():
+        source['session'] = _make_session()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# to GET a JSON document from a source, returns None on failure
+def _get_json(source, url, params=None, headers=None):
+    client = _sources[source]
+    client['limiter'].acquire()
+    try:
+        response = client['session'].get(url, params=params, headers=headers, timeout=REQUEST_TIMEOUT)
+        if response.status_code != 200:
+            print(f"{source} error {response.status_code}:", response.text)
+            return None
+        data = response.json()
+        if not isinstance(data, dict):
+            raise ValueError(f"expected a JSON object, got {type(data).__name__}")
+        return data
+    except (requests.RequestException, ValueError) as e:  # ValueError: the body is not a JSON object
+        print(f"{source} request failed: {e}")
+        return None
 
 
 # -------------------------
 # Fetch Twitter Posts
 # -------------------------
-def fetch_twitter_posts():
-    url = "https://api.twitter.com/2/tweets/search/recent"
+# since_id only returns tweets newer than the last one seen
+def fetch_twitter_posts(max_pages=MAX_PAGES, since_id=None):
+    url = f"{TWITTER_API_URL}/tweets/search/recent"
     query = "flood OR tsunami OR 'high waves' OR 'coastal damage' lang:en"
     headers = {"Authorization": f"Bearer {TWITTER_BEARER_TOKEN}"}
     params = {"query": query, "max_results": 10, "tweet.fields": "created_at,author_id,text"}
-    response = requests.get(url, headers=headers, params=params)
-    if response.status_code != 200:
-        print("Twitter Error:", response.text)
-        return []
-    return response.json().get("data", [])
+    if since_id:
+        params["since_id"] = since_id
+    tweets = []
+    for _ in range(max_pages):
+        data = _get_json('twitter', url, params=params, headers=headers)
+        if not data:
+            break
+        tweets.extend(data.get("data", []))
+        next_token = data.get("meta", {}).get("next_token")
+        if not next_token:
+            break
+        params = {**params, "next_token": next_token}
+    return tweets
 
 # -------------------------
 # Fetch YouTube Comments
 # -------------------------
-def fetch_youtube_comments():
-    search_url = "https://www.googleapis.com/youtube/v3/search"
+# published_after (RFC 3339) only returns videos uploaded since the last run
+def search_youtube_videos(max_pages=1, published_after=None):
+    search_url = f"{YOUTUBE_API_URL}/search"
     params = {
         "part": "snippet",
         "q": "flood OR tsunami OR high waves OR coastal damage",
@@ -31,40 +148,154 @@ def fetch_youtube_comments():
         "maxResults": 5,
         "key": YOUTUBE_API_KEY
     }
-    search_res = requests.get(search_url, params=params).json()
+    if published_after:
+        params["publishedAfter"] = published_after
+    video_ids = []
+    for _ in range(max_pages):
+        search_res = _get_json('youtube', search_url, params=params)
+        if not search_res:
+            break
+        video_ids.extend(item["id"]["videoId"] for item in search_res.get("items", []))
+        page_token = search_res.get("nextPageToken")
+        if not page_token:
+            break
+        params = {**params, "pageToken": page_token}
+    return video_ids
+
+def fetch_video_comments(video_id, max_pages=1):
+    comment_url = f"{YOUTUBE_API_URL}/commentThreads"
+    c_params = {"part": "snippet", "videoId": video_id, "maxResults": 5, "key": YOUTUBE_API_KEY}
     comments = []
-    for item in search_res.get("items", []):
-        video_id = item["id"]["videoId"]
-        comment_url = "https://www.googleapis.com/youtube/v3/commentThreads"
-        c_params = {"part": "snippet", "videoId": video_id, "maxResults": 5, "key": YOUTUBE_API_KEY}
-        c_res = requests.get(comment_url, params=c_params).json()
+    for _ in range(max_pages):
+        c_res = _get_json('youtube', comment_url, params=c_params)
+        if not c_res:
+            break
         for c in c_res.get("items", []):
             comment = c["snippet"]["topLevelComment"]["snippet"]
             comments.append({
+                "id": c.get("id"),
                 "text": comment["textDisplay"],
                 "author": comment["authorDisplayName"],
                 "time": comment["publishedAt"]
             })
+        page_token = c_res.get("nextPageToken")
+        if not page_token:
+            break
+        c_params = {**c_params, "pageToken": page_token}
     return comments
 
+# to fetch comment threads of several videos at once
+def _fetch_comments_concurrently(pool, video_ids):
+    futures = [pool.submit(fetch_video_comments, video_id) for video_id in video_ids]
+    comments = []
+    for future in futures:
+        comments.extend(future.result())
+    return comments
+
+def fetch_youtube_comments():
+    return _fetch_comments_concurrently(_get_pool(), search_youtube_videos())
+
+# -------------------------
+# Fetch every source concurrently
+# -------------------------
+def fetch_all(since_id=None, published_after=None):
+    pool = _get_pool()
+    tweets_future = pool.submit(fetch_twitter_posts, since_id=since_id)
+    video_ids = pool.submit(search_youtube_videos, published_after=published_after).result()
+    yt_comments = _fetch_comments_concurrently(pool, video_ids)
+    return tweets_future.result(), yt_comments
+
 # -------------------------
 # Store Data in SQLAlchemy
 # -------------------------
-def store_post(platform, content, username, timestamp):
+# to identify a post across fetches, the platform id when there is one
+def post_key(platform, external_id, content, username):
+    if external_id:
+        return str(external_id)
+    return hashlib.sha256(f"{platform}\n{username}\n{content}".encode()).hexdigest()
+
+# to store a whole fetch cycle in one INSERT IGNORE, posts already stored are skipped
+# by the unique (platform, external_id) index; returns how many rows were new and
+# raises when the rows could not be stored, so the caller does not move its cursors past them
+def store_posts(posts):
+    rows = {}
+    for p in posts:
+        content = (p.get("content") or "")[:1000]
+        key = post_key(p["platform"], p.get("external_id"), content, p.get("username"))
+        rows[(p["platform"], key)] = {
+            "platform": p["platform"],
+            "external_id": key,
+            "content": content,
+            "username": p.get("username"),
+            "timestamp": p.get("timestamp"),
+        }
+    if not rows:
+        return 0
+    for row, category in zip(rows.values(), classify_batch([row["content"] for row in rows.values()])):
+        row["predicted_category"] = category
+    cluster_ids = assign_posts([(row["platform"], row["external_id"], row["content"]) for row in rows.values()])
+    for row, cluster_id in zip(rows.values(), cluster_ids):
+        row["cluster_id"] = cluster_id
+
+    stmt = (
+        insert(SocialPost)
+        .prefix_with("IGNORE", dialect="mysql")
+        .prefix_with("IGNORE", dialect="mariadb")
+        .prefix_with("OR IGNORE", dialect="sqlite")
+    )
     session = SessionLocal()
-    post = SocialPost(platform=platform, content=content, username=username, timestamp=timestamp)
-    session.add(post)
-    session.commit()
-    session.close()
+    stored = False
+    try:
+        result = session.connection().execute(stmt, list(rows.values()))
+        session.commit()
+        stored = True
+        if result.rowcount:
+            bump_version('social_posts')
+            search.index_posts(
+                session.query(SocialPost).filter(tuple_(SocialPost.platform, SocialPost.external_id).in_(list(rows)))
+            )
+            publish('social.stored', {'count': result.rowcount})
+        return result.rowcount
+
+    except Exception as e:
+        if stored:
+            # the posts are stored and keep their clusters, only the version, index or event is behind
+            print(f"store_posts caused problem after storing: {e}")
+            return result.rowcount
+        session.rollback()
+        cluster_index.forget([("post", f"{platform}:{key}") for platform, key in rows])
+        print(f"store_posts caused problem: {e}")
+        raise
+
+    finally:
+        session.close()
+
+def store_post(platform, content, username, timestamp, external_id=None):
+    return store_posts([{"platform": platform, "content": content, "username": username, "timestamp": timestamp, "external_id": external_id}])
 
 # -------------------------
 # Utility: Fetch and store all social posts
 # -------------------------
-def fetch_and_store_all():
-    tweets = fetch_twitter_posts()
-    for t in tweets:
-        store_post("Twitter", t.get("text", ""), t.get("author_id", ""), t.get("created_at", ""))
-    yt_comments = fetch_youtube_comments()
-    for c in yt_comments:
-        store_post("YouTube", c.get("text", ""), c.get("author", ""), c.get("time", ""))
-    return {"message": "Data fetched and stored!", "tweets": len(tweets), "youtube_comments": len(yt_comments)}
+# cursors is {'twitter_since_id': ..., 'youtube_published_after': ...} from the last run,
+# the result carries the cursors to use next time
+def fetch_and_store_all(cursors=None):
+    cursors = cursors or {}
+    started = datetime.now(timezone.utc).strftime('%Y-%m-%dT%H:%M:%SZ')
+    tweets, yt_comments = fetch_all(
+        since_id=cursors.get("twitter_since_id"),
+        published_after=cursors.get("youtube_published_after"),
+    )
+    posts = [
+        {"platform": "Twitter", "external_id": t.get("id"), "content": t.get("text", ""), "username": t.get("author_id", ""), "timestamp": t.get("created_at", "")}
+        for t in tweets
+    ] + [
+        {"platform": "YouTube", "external_id": c.get("id"), "content": c.get("text", ""), "username": c.get("author", ""), "timestamp": c.get("time", "")}
+        for c in yt_comments
+    ]
+    stored = store_posts(posts)
+    tweet_ids = [int(t["id"]) for t in tweets if str(t.get("id", "")).isdigit()]
+    next_cursors = {
+        "twitter_since_id": str(max(tweet_ids)) if tweet_ids else cursors.get("twitter_since_id"),
+        "youtube_published_after": started if yt_comments else cursors.get("youtube_published_after"),
+    }
+    return {"message": "Data fetched and stored!", "tweets": len(tweets), "youtube_comments": len(yt_comments), "stored": stored, "cursors": next_cursors}
@@ -0,0 +1,190 @@
+import os
+import threading
+from datetime import datetime, timedelta
+from database import leases
+from database.connect import SessionLocal
+from database.db_models import IngestJobs, IngestCursors
+from AI.fetch_posts import fetch_and_store_all
+
+
+'''
+Background social-media ingestion.
+
+Runs are rows in ingest_jobs. /api/fetch_socialmedia only inserts a queued row;
+a worker thread in each server process claims queued rows with a conditional
+UPDATE (so only one process runs a given job), fetches from where the last run
+stopped using the cursors in ingest_cursors, and records the outcome. The same
+thread queues a scheduled run every SOCIAL_FETCH_INTERVAL seconds (0 disables).
+
+Only the process holding the 'ingest-schedule' lease (database.leases) queues
+scheduled runs, so workers checking at the same moment do not queue one each.
+A run whose posts could not be stored is marked failed and keeps the old
+cursors, so the next run fetches those posts again. A run still 'running'
+JOB_TIMEOUT seconds after it started belonged to a worker that died or was
+recycled; it is marked failed so it stops looking busy, and the next
+scheduled run fetches from the saved cursors.
+'''
+
+INTERVAL = int(os.getenv('SOCIAL_FETCH_INTERVAL', '300'))
+JOB_TIMEOUT = int(os.getenv('SOCIAL_FETCH_JOB_TIMEOUT', '900'))
+SCHEDULE_LEASE = 'ingest-schedule'
+
+_wake = threading.Event()
+_stop = threading.Event()
+_worker_thread = None
+
+
+def _job_dict(job):
+    return {
+        'id': job.id,
+        'status': job.status,
+        'trigger': job.trigger,
+        'created_at': job.created_at.isoformat() if job.created_at else None,
+        'started_at': job.started_at.isoformat() if job.started_at else None,
+        'finished_at': job.finished_at.isoformat() if job.finished_at else None,
+        'tweets': job.tweets,
+        'youtube_comments': job.youtube_comments,
+        'stored': job.stored,
+        'error': job.error,
+    }
+
+# to queue a fetch run, reuses the run already waiting if there is one
+def enqueue_run(trigger='manual'):
+    session = SessionLocal()
+    try:
+        job = session.query(IngestJobs).filter(IngestJobs.status == 'queued').order_by(IngestJobs.id).first()
+        if not job:
+            job = IngestJobs(status='queued', trigger=trigger)
+            session.add(job)
+            session.commit()
+        job_id = job.id
+    finally:
+        session.close()
+    _wake.set()
+    return job_id
+
+# to get the progress of a run, None when it does not exist
+def get_job(job_id):
+    session = SessionLocal()
+    try:
+        job = session.get(IngestJobs, job_id)
+        return _job_dict(job) if job else None
+    finally:
+        session.close()
+
+# to claim the oldest queued run for this process, None when there is nothing to do
+def _claim_job(session):
+    job = session.query(IngestJobs).filter(IngestJobs.status == 'queued').order_by(IngestJobs.id).first()
+    if not job:
+        return None
+    claimed = (
+        session.query(IngestJobs)
+        .filter(IngestJobs.id == job.id, IngestJobs.status == 'queued')
+        .update({'status': 'running', 'started_at': datetime.utcnow()}, synchronize_session=False)
+    )
+    session.commit()
+    return job.id if claimed else None
+
+# to fail runs left 'running' by a worker that is gone, returns how many
+def _fail_abandoned():
+    session = SessionLocal()
+    try:
+        failed = (
+            session.query(IngestJobs)
+            .filter(IngestJobs.status == 'running', IngestJobs.started_at < datetime.utcnow() - timedelta(seconds=JOB_TIMEOUT))
+            .update({
+                'status': 'failed',
+                'error': f"abandoned: still running after {JOB_TIMEOUT} s",
+                'finished_at': datetime.utcnow(),
+            }, synchronize_session=False)
+        )
+        session.commit()
+        return failed
+    finally:
+        session.close()
+
+def _load_cursors(session):
+    return {c.source: c.value for c in session.query(IngestCursors)}
+
+def _save_cursors(session, cursors):
+    for source, value in cursors.items():
+        cursor = session.get(IngestCursors, source)
+        if cursor:
+            cursor.value = value
+        else:
+            session.add(IngestCursors(source=source, value=value))
+
+# to run one queued job if there is one, returns its id
+def run_pending():
+    session = SessionLocal()
+    try:
+        job_id = _claim_job(session)
+        if job_id is None:
+            return None
+        try:
+            result = fetch_and_store_all(_load_cursors(session))
+            _save_cursors(session, result['cursors'])
+            update = {
+                'status': 'done',
+                'tweets': result['tweets'],
+                'youtube_comments': result['youtube_comments'],
+                'stored': result['stored'],
+            }
+        except Exception as e:
+            session.rollback()
+            print(f"run_pending caused error: {e}")
+            update = {'status': 'failed', 'error': str(e)}
+        update['finished_at'] = datetime.utcnow()
+        session.query(IngestJobs).filter(IngestJobs.id == job_id).update(update, synchronize_session=False)
+        session.commit()
+        return job_id
+
+    finally:
+        session.close()
+
+# to queue a scheduled run when the last one is older than the interval
+# the check and the insert are only made by the holder of the schedule lease
+def _schedule_due():
+    if not leases.acquire(SCHEDULE_LEASE, 2 * INTERVAL + 60):
+        return
+    session = SessionLocal()
+    try:
+        last = session.query(IngestJobs.created_at).order_by(IngestJobs.id.desc()).first()
+    finally:
+        session.close()
+    if not last or last.created_at <= datetime.utcnow() - timedelta(seconds=INTERVAL):
+        enqueue_run(trigger='schedule')
+
+def _run_worker():
+    while not _stop.is_set():
+        try:
+            _fail_abandoned()
+            if INTERVAL:
+                _schedule_due()
+            while run_pending() is not None:
+                pass
+        except Exception as e:
+            print(f"ingest worker caused error: {e}")
+        _wake.wait(min(INTERVAL, JOB_TIMEOUT) or JOB_TIMEOUT)
+        _wake.clear()
+
+# to start the ingestion worker thread once per process
+def start():
+    global _worker_thread
+    if _worker_thread and _worker_thread.is_alive():
+        return _worker_thread
+    _stop.clear()
+    _worker_thread = threading.Thread(target=_run_worker, name='social-ingest', daemon=True)
+    _worker_thread.start()
+    return _worker_thread
+
+# to stop the worker after the run it is on
+def stop(timeout=5):
+    _stop.set()
+    _wake.set()
+    if _worker_thread:
+        _worker_thread.join(timeout)
+    try:
+        leases.release(SCHEDULE_LEASE)
+    except Exception as e:
+        print(f"scheduler stop caused problem: {e}")
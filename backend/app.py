@@ -1,36 +1,115 @@
 
 # --- Begin: Logic from yash/app.py ---
 
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, stream_with_context
 import os
-from werkzeug.utils import secure_filename
+import json
+import re
+from datetime import date
 from database.db_models import Mongo_Uploads
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.security import safe_join
 import sys
-from database.crud import check_user, verify_user, add_new_user
-from database.connect import SessionLocal, init_db, Base, engine
+import threading
+from database.crud import check_user, authenticate_user, authenticate_employee, authenticate_volunteer, add_new_user, get_uploads, get_uploads_page, iter_uploads, decode_cursor, get_uploads_in_bbox, get_uploads_near, approve_uploads, reject_uploads, get_clusters, get_cluster, get_cluster_report_ids
+from database.connect import SessionLocal, get_engine
 from database.db_models import Citizens
 from database.db_models import SocialPost
-from AI.fetch_posts import fetch_and_store_all
+from database.ids import report_ids
+from database.tokens import issue_token, verify_token, revoke_token
+from database import outbox, geo, cache, metrics, search
+from database.counters import read_overview
+from database.assign import ngo_index, nearest_ngo
+from AI import scheduler
+from AI.classifier import classify
+from AI.clustering import assign_report, cluster_index
+from media import storage, derivatives
+from web.conditional import versioned, compress
+from web import live
 
 app = Flask(__name__)
-CORS(app)
-
-Base.metadata.create_all(engine)
-init_db()
+# uploads stream into hashing temp files and anything above the limit gets 413
+app.request_class = storage.StreamingRequest
+app.config['MAX_CONTENT_LENGTH'] = storage.MAX_CONTENT_LENGTH
+CORS(app, expose_headers=['X-Next-Cursor', 'ETag'])
+app.after_request(compress)
+
+BULK_LIMIT = 5000
+# with this set, report submission and moderation only accept requests carrying a token
+REQUIRE_TOKENS = os.getenv('HARBORNET_REQUIRE_TOKENS') == '1'
+MODERATOR_ROLES = ('employee', 'volunteer')
+AUTHENTICATORS = {'citizen': authenticate_user, 'employee': authenticate_employee, 'volunteer': authenticate_volunteer}
+
+# background workers are off with HARBORNET_BACKGROUND=0 (tests, one-off scripts)
+BACKGROUND = os.getenv('HARBORNET_BACKGROUND', '1') == '1'
+
+_started = False
+_start_lock = threading.Lock()
+
+# to start this process's background workers once: outbox relay, NGO index, ingestion scheduler
+# importing this module starts nothing; tables and indexes come from python -m database.migrate
+def start_background():
+    global _started
+    with _start_lock:
+        if _started:
+            return
+        _started = True
+    outbox.start_relay()
+    ngo_index.refresh(full=True)
+    scheduler.start()
+
+# to stop the background workers after the run they are on, for graceful shutdown
+def stop_background(timeout=5):
+    global _started
+    with _start_lock:
+        if not _started:
+            return
+        _started = False
+    outbox.stop_relay(timeout)
+    scheduler.stop(timeout)
+
+# a worker forked by a pre-fork server starts its own threads on its first request
+@app.before_request
+def _start_background_once():
+    if BACKGROUND and not _started:
+        start_background()
+
+def _reset_after_fork():
+    global _started, _start_lock
+    _started = False
+    _start_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+# application factory, e.g. `flask --app app:create_app run`
+def create_app(background=BACKGROUND):
+    if background:
+        start_background()
+    return app
 
 # ...existing code...
 
 # Place these endpoints after app = Flask(__name__)
 
 # API endpoint to fetch and store social media posts
+# queues a run for the ingestion worker and returns its job id straight away
 @app.route('/api/fetch_socialmedia', methods=['POST'])
 def api_fetch_socialmedia():
-    result = fetch_and_store_all()
-    return jsonify(result)
+    job_id = scheduler.enqueue_run()
+    return jsonify({'success': True, 'job_id': job_id, 'status': 'queued'}), 202
+
+# API endpoint for the progress of a social media fetch run
+@app.route('/api/fetch_socialmedia/<int:job_id>', methods=['GET'])
+def api_fetch_socialmedia_status(job_id):
+    job = scheduler.get_job(job_id)
+    if not job:
+        return jsonify({'success': False, 'error': 'Job not found'}), 404
+    return jsonify(job)
 
 # API endpoint to get recent social media posts
 @app.route('/api/socialmedia_posts', methods=['GET'])
+@versioned('social_posts')
 def api_socialmedia_posts():
     session = SessionLocal()
     posts = session.query(SocialPost).order_by(SocialPost.id.desc()).limit(50).all()
@@ -40,7 +119,8 @@ def api_socialmedia_posts():
             'platform': p.platform,
             'content': p.content,
             'username': p.username,
-            'timestamp': p.timestamp
+            'timestamp': p.timestamp,
+            'predicted_category': p.predicted_category
         } for p in posts
     ]
     session.close()
@@ -50,10 +130,38 @@ def api_socialmedia_posts():
 
 from flask import send_from_directory
 # Serve uploaded files
+# ?size=thumb|medium serves a resized image (the poster frame for videos), as WebP when the
+# client accepts it or as ?format=webp|jpeg; content-addressed files are cached for good
 @app.route('/uploads/<path:filename>')
 def uploaded_file(filename):
-    upload_folder = os.path.join(os.getcwd(), 'uploads')
-    return send_from_directory(upload_folder, filename)
+    size = request.args.get('size')
+    served = filename
+    if size:
+        if size not in derivatives.SIZES:
+            return jsonify({'success': False, 'error': f"size must be one of {', '.join(derivatives.SIZES)}"}), 400
+        fmt = request.args.get('format') or ('webp' if request.accept_mimetypes['image/webp'] else 'jpeg')
+        if fmt not in derivatives.FORMATS:
+            return jsonify({'success': False, 'error': 'format must be webp or jpeg'}), 400
+        if safe_join(storage.MEDIA_ROOT, filename) is None:
+            return jsonify({'success': False, 'error': 'Not found'}), 404
+        served = derivatives.get(filename, size, fmt)
+        if served is None:
+            if derivatives.is_video(filename):
+                return jsonify({'success': False, 'error': 'No preview available'}), 404
+            served = filename  # cannot resize here, fall back to the original
+
+    if not storage.is_content_addressed(filename):
+        return send_from_directory(storage.MEDIA_ROOT, served)
+    # the name carries the content hash, so the bytes behind it never change
+    response = send_from_directory(storage.MEDIA_ROOT, served, etag=os.path.basename(served), max_age=31536000)
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    if size and not request.args.get('format'):
+        response.vary.add('Accept')
+    return response
+
+@app.errorhandler(413)
+def upload_too_large(e):
+    return jsonify({'success': False, 'error': f'Upload larger than {storage.MAX_CONTENT_LENGTH // (1024 * 1024)} MB'}), 413
 
 
 # (Moved) API endpoint to reject (delete) a report
@@ -62,26 +170,37 @@ def uploaded_file(filename):
 
 # Place this after app = Flask(__name__)
 
+# to read the Bearer token of the request, returns (claims, error response)
+# verification is a signature check only, no database lookup; a request without
+# a token, or with a token of a role not in `roles`, passes with no claims unless
+# HARBORNET_REQUIRE_TOKENS is set
+def _token_claims(*roles):
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer '):
+        if REQUIRE_TOKENS:
+            return None, (jsonify({'success': False, 'error': 'Login required'}), 401)
+        return None, None
+    claims = verify_token(header[len('Bearer '):])
+    if not claims:
+        return None, (jsonify({'success': False, 'error': 'Invalid or expired token'}), 401)
+    if roles and claims['role'] not in roles:
+        if REQUIRE_TOKENS:
+            return None, (jsonify({'success': False, 'error': 'Not allowed for this account'}), 403)
+        return None, None  # tokens are optional, so a token of another role counts as no token
+    return claims, None
+
 @app.route('/api/report/reject', methods=['POST'])
 def reject_report():
+    _, error = _token_claims(*MODERATOR_ROLES)
+    if error:
+        return error
     try:
-        from database.db_models import Uploads, Mongo_Uploads
-        session = SessionLocal()
         data = request.get_json()
         report_id = data.get('id')
         if not report_id:
-            session.close()
             return jsonify({'success': False, 'error': 'Missing report id'}), 400
-        # Delete from SQL
-        upload = session.query(Uploads).filter_by(id=str(report_id)).first()
-        if upload:
-            session.delete(upload)
-            session.commit()
-        # Delete from MongoDB
-        mongo = Mongo_Uploads.objects(id=int(report_id)).first()
-        if mongo:
-            mongo.delete()
-        session.close()
+        # Delete from SQL and queue the MongoDB delete in the same transaction
+        reject_uploads([report_id])
         return jsonify({'success': True, 'message': 'Report rejected and deleted.'}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
@@ -91,94 +210,271 @@ def reject_report():
 # API endpoint to approve (verify) a report
 @app.route('/api/report/approve', methods=['POST'])
 def approve_report():
+    _, error = _token_claims(*MODERATOR_ROLES)
+    if error:
+        return error
     try:
-        from database.db_models import Uploads
-        session = SessionLocal()
         data = request.get_json()
         report_id = data.get('id')
         if not report_id:
-            session.close()
             return jsonify({'success': False, 'error': 'Missing report id'}), 400
-        upload = session.query(Uploads).filter_by(id=str(report_id)).first()
-        if not upload:
-            session.close()
+        if approve_uploads([report_id])[str(report_id)] == 'not_found':
             return jsonify({'success': False, 'error': 'Report not found'}), 404
-        upload.issue_nearby_uploader = True
-        session.commit()
-        session.close()
         return jsonify({'success': True, 'message': 'Report approved (verified).'}), 200
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
 
+# API endpoint to approve or reject many reports in one request
+# body: {"action": "approve" | "reject", "ids": [...]}, answers with a result per id
+@app.route('/api/reports/bulk', methods=['POST'])
+def bulk_reports():
+    _, error = _token_claims(*MODERATOR_ROLES)
+    if error:
+        return error
+    try:
+        data = request.get_json() or {}
+        action = data.get('action')
+        ids = data.get('ids')
+        if action not in ('approve', 'reject'):
+            return jsonify({'success': False, 'error': 'action must be approve or reject'}), 400
+        if not isinstance(ids, list) or not ids:
+            return jsonify({'success': False, 'error': 'Missing report ids'}), 400
+        if len(ids) > BULK_LIMIT:
+            return jsonify({'success': False, 'error': f'At most {BULK_LIMIT} ids per request'}), 400
+        results = approve_uploads(ids) if action == 'approve' else reject_uploads(ids)
+        return jsonify({'success': True, 'action': action, 'results': results}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+
 
 
+# to read the ?verified=true|false filter, None when absent
+def _verified_arg():
+    verified = request.args.get('verified')
+    if verified == 'false':
+        return False
+    if verified == 'true':
+        return True
+    return None
+
+# to check a latitude and longitude are numbers on the globe (NaN fails every comparison)
+def _valid_point(lat, lon):
+    return lat is not None and lon is not None and -90 <= lat <= 90 and -180 <= lon <= 180
+
 # API endpoint for fetching reports (join SQL and MongoDB by id)
+# ?limit= pages with a keyset cursor (next one in the X-Next-Cursor header),
+# ?stream=ndjson|json streams every matching report without buffering
 @app.route('/api/reports', methods=['GET'])
+@versioned('reports')
 def get_reports():
-    from database.db_models import Uploads, Mongo_Uploads, Citizens
-    session = SessionLocal()
-    verified = request.args.get('verified')
-    uploader_id = request.args.get('uploader_id')
-    query = session.query(Uploads)
-    if verified == 'false':
-        query = query.filter_by(issue_nearby_uploader=False)
-    elif verified == 'true':
-        query = query.filter_by(issue_nearby_uploader=True)
-    if uploader_id:
-        query = query.filter_by(uploader_id=int(uploader_id))
-    uploads = query.all()
-    result = []
-    for u in uploads:
-        mongo = Mongo_Uploads.objects(id=int(u.id)).first()
-        citizen = session.query(Citizens).filter_by(id=u.uploader_id).first()
-        result.append({
-            'id': u.id,
-            'uploader_id': u.uploader_id,
-            'uploader': citizen.email if citizen else None,
-            'category': getattr(mongo, 'issue_category', None) if mongo else None,
-            'status': 'verified' if u.issue_nearby_uploader else 'unverified',
-            'description': getattr(mongo, 'description', None) if mongo else None,
-            'image_path': getattr(mongo, 'image_path', None) if mongo else None,
-            'video_path': getattr(mongo, 'video_path', None) if mongo else None,
-            'latitude': float(u.issue_latitude) if u.issue_latitude is not None else None,
-            'longitude': float(u.issue_longitude) if u.issue_longitude is not None else None
-        })
-    session.close()
-    return jsonify(result)
+    try:
+        filters = {
+            'location': request.args.get('location'),
+            'issue': request.args.get('issue'),
+            'source': request.args.get('source'),
+            'verified': _verified_arg(),
+            'uploader_id': request.args.get('uploader_id', type=int),
+        }
+        for key in ('date', 'date_from', 'date_to'):
+            value = request.args.get(key)
+            filters[key] = date.fromisoformat(value) if value else None
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    stream = request.args.get('stream')
+    if stream == 'ndjson':
+        lines = (json.dumps(report) + '\n' for report in iter_uploads(**filters))
+        return Response(stream_with_context(lines), mimetype='application/x-ndjson')
+    if stream == 'json':
+        return Response(stream_with_context(_json_array(iter_uploads(**filters))), mimetype='application/json')
+
+    limit = request.args.get('limit', type=int)
+    if limit or after:
+        reports, next_cursor = get_uploads_page(limit=min(limit or 50, 1000), after=after, **filters)
+        response = jsonify(reports)
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        return response
+    return jsonify(get_uploads(**filters))
+
+# to write a streamed JSON array one element at a time
+def _json_array(items):
+    yield '['
+    for i, item in enumerate(items):
+        yield (',' if i else '') + json.dumps(item)
+    yield ']'
+
+
+
+# API endpoint for reports within radius_km of a point, nearest first
+@app.route('/api/reports/near', methods=['GET'])
+@versioned('reports')
+def get_reports_near():
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    radius_km = request.args.get('radius_km', 10.0, type=float)
+    if not _valid_point(lat, lon) or not radius_km > 0:
+        return jsonify({'success': False, 'error': 'Provide valid lat, lon and radius_km'}), 400
+    limit = max(1, min(request.args.get('limit', 500, type=int), 5000))
+    return jsonify(get_uploads_near(lat, lon, min(radius_km, 500.0), verified=_verified_arg(), limit=limit))
+
+# API endpoint for reports inside a map viewport
+@app.route('/api/reports/bbox', methods=['GET'])
+@versioned('reports')
+def get_reports_bbox():
+    bounds = [request.args.get(key, type=float) for key in ('min_lat', 'min_lon', 'max_lat', 'max_lon')]
+    if not _valid_point(*bounds[:2]) or not _valid_point(*bounds[2:]) or bounds[0] > bounds[2] or bounds[1] > bounds[3]:
+        return jsonify({'success': False, 'error': 'Provide valid min_lat, min_lon, max_lat and max_lon'}), 400
+    limit = max(1, min(request.args.get('limit', 500, type=int), 5000))
+    return jsonify(get_uploads_in_bbox(*bounds, verified=_verified_arg(), limit=limit))
+
+
+
+# API endpoint for the k NGOs closest to a point
+@app.route('/api/ngos/nearest', methods=['GET'])
+def get_nearest_ngos():
+    lat = request.args.get('lat', type=float)
+    lon = request.args.get('lon', type=float)
+    if not _valid_point(lat, lon):
+        return jsonify({'success': False, 'error': 'Provide valid lat and lon'}), 400
+    k = max(1, min(request.args.get('k', 5, type=int), 50))
+    return jsonify([
+        {'id': ngo_id, 'distance_km': round(distance, 3), 'pincode': pincode}
+        for ngo_id, distance, pincode in ngo_index.nearest(lat, lon, k=k)
+    ])
+
+
+
+# API endpoint for incident clusters with the most unverified reports
+@app.route('/api/clusters', methods=['GET'])
+def api_clusters():
+    limit = min(request.args.get('limit', 50, type=int), 500)
+    return jsonify(get_clusters(limit=limit))
+
+# API endpoint for the reports and social posts in one cluster
+@app.route('/api/clusters/<int:cluster_id>', methods=['GET'])
+def api_cluster(cluster_id):
+    return jsonify(get_cluster(cluster_id))
+
+# API endpoint to approve or reject every report in a cluster at once, reject leaves verified reports
+@app.route('/api/clusters/<int:cluster_id>/<action>', methods=['POST'])
+def api_cluster_action(cluster_id, action):
+    if action not in ('approve', 'reject'):
+        return jsonify({'success': False, 'error': 'Unknown action'}), 404
+    _, error = _token_claims(*MODERATOR_ROLES)
+    if error:
+        return error
+    try:
+        ids = get_cluster_report_ids(cluster_id)
+        results = approve_uploads(ids) if action == 'approve' else reject_uploads(ids, keep_verified=True)
+        return jsonify({'success': True, 'cluster_id': cluster_id, 'action': action, 'results': results}), 200
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+
+
+# Prometheus metrics of this process: SQL and MongoDB pool usage, wait times and cache counters
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.render(get_engine(), cache.stats()), mimetype='text/plain; version=0.0.4')
 
 
 
+# API endpoint for the hit and miss counters of this process's lookup caches
+@app.route('/api/cache/stats', methods=['GET'])
+def api_cache_stats():
+    return jsonify(cache.stats())
+
+
+
+# API endpoint for full-text search over report descriptions and social posts
+# ?q= words that must all appear, best matches first; filters: kind (report|post),
+# category, platform, date_from, date_to; ?limit= pages, next page in X-Next-Cursor
+@app.route('/api/search', methods=['GET'])
+def api_search():
+    text = request.args.get('q', '').strip()
+    if not text:
+        return jsonify({'success': False, 'error': 'Missing q'}), 400
+    kind = request.args.get('kind')
+    if kind not in (None, 'report', 'post'):
+        return jsonify({'success': False, 'error': 'kind must be report or post'}), 400
+    try:
+        dates = {key: date.fromisoformat(request.args[key]) if request.args.get(key) else None for key in ('date_from', 'date_to')}
+        cursor = request.args.get('cursor', '0')
+        if not cursor.isdigit():
+            raise ValueError("Invalid cursor")
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    limit = max(1, min(request.args.get('limit', 20, type=int), search.MAX_LIMIT))  # as search() clamps it, the cursor must advance
+    try:
+        results, more = search.search(
+            text, kind=kind, category=request.args.get('category'), platform=request.args.get('platform'),
+            limit=limit, offset=int(cursor), **dates,
+        )
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    response = jsonify(results)
+    if more and int(cursor) + limit <= search.MAX_OFFSET:
+        response.headers['X-Next-Cursor'] = str(int(cursor) + limit)
+    return response
+
+
+# API endpoint for live updates as server-sent events
+# events: report.created, report.approved, report.rejected, social.stored (and reset)
+# resumes after the Last-Event-ID header; ?types=report,social keeps only those
+@app.route('/api/live', methods=['GET'])
+def api_live():
+    last_id = request.headers.get('Last-Event-ID') or request.args.get('last_event_id')
+    try:
+        last_id = int(last_id) if last_id else None
+    except ValueError:
+        return jsonify({'success': False, 'error': 'Invalid Last-Event-ID'}), 400
+    types = {t.strip() for t in request.args.get('types', '').split(',') if t.strip()}
+    try:
+        live.feed.start()
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+    return Response(
+        live.feed.stream(last_id, types),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},  # no proxy buffering
+    )
+
+
 # API endpoint for overview panel stats
+# reads the counters kept up to date by the outbox relay
 @app.route('/api/overview', methods=['GET'])
+@versioned('reports')
 def api_overview():
-    # Count by category and verification status
-    categories = ['Flooding', 'Tsunami', 'High Waves', 'Coastal Damage', 'Other']
-    overview = {}
-    for cat in categories:
-        overview[cat.replace(' ', '').lower()] = Mongo_Uploads.objects(issue_category=cat).count()
-    overview['verified'] = Mongo_Uploads.objects(status='verified').count()
-    overview['unverified'] = Mongo_Uploads.objects(status='unverified').count()
-    return jsonify(overview)
+    return jsonify(read_overview())
 
 
 
 # API endpoint for login (refactored to use SIH logic)
+# optional "role": citizen (default), employee or volunteer; the user object carries a signed token
 @app.route('/api/login', methods=['POST'])
 def api_login():
     
     data = request.get_json()
     identifier = data.get('loginInput')
     password = data.get('password')
+    role = data.get('role') or 'citizen'
     
     if not identifier or not password:
         return jsonify({"success": False, "error": "Missing credentials"}), 400
+    if role not in AUTHENTICATORS:
+        return jsonify({"success": False, "error": "Unknown role"}), 400
     
-    from database.crud import check_user
-    if verify_user(identifier, password):
-        user_id = check_user(identifier)
-        return jsonify({"success": True, "user": {"id": user_id, "identifier": identifier}}), 200
+    user_id = AUTHENTICATORS[role](identifier, password)
+    if user_id is not None:
+        token = issue_token(user_id, role)
+        return jsonify({"success": True, "user": {"id": user_id, "identifier": identifier, "role": role, "token": token}}), 200
     
     return jsonify({"success": False, "error": "Invalid credentials"}), 401
 
@@ -207,73 +503,116 @@ def api_register():
             email = None
         add_new_user(phone=phone, email=email, password=password)
     user_id = check_user(identifier)
-    return jsonify({"success": True, "user": {"id": user_id, "identifier": identifier}}), 201
+    if not user_id:
+        return jsonify({"success": False, "error": "Registration failed"}), 500
+    token = issue_token(user_id, 'citizen')
+    return jsonify({"success": True, "user": {"id": user_id, "identifier": identifier, "role": "citizen", "token": token}}), 201
+
+
+
+# API endpoint for logout, revokes the token in the Authorization header
+@app.route('/api/logout', methods=['POST'])
+def api_logout():
+    header = request.headers.get('Authorization', '')
+    if not header.startswith('Bearer ') or not revoke_token(header[len('Bearer '):]):
+        return jsonify({"success": False, "error": "Invalid or expired token"}), 401
+    return jsonify({"success": True}), 200
 
 
 
 # API endpoint to submit hazard report
 @app.route('/api/report', methods=['POST'])
 def api_report():
+    claims, error = _token_claims('citizen')
+    if error:
+        return error
+    clustered = None
+    stored = False  # once the commit went through, a later error must not undo the report's cluster
     try:
         from database.db_models import Citizens, Uploads, Mongo_Uploads
         from datetime import date
         session = SessionLocal()
-        # Get uploader_id from form (must be citizens.id)
-        uploader_id = request.form.get('uploader_id')
-        if not uploader_id or not session.query(Citizens).filter_by(id=uploader_id).first():
-            session.close()
-            return jsonify({'success': False, 'error': 'Invalid uploader_id'}), 400
+        if claims:
+            # the signed token already proves who the citizen is
+            uploader_id = claims['sub']
+        else:
+            # Get uploader_id from form (must be citizens.id)
+            uploader_id = request.form.get('uploader_id')
+            if not uploader_id or not session.query(Citizens.id).filter_by(id=uploader_id).first():
+                session.close()
+                return jsonify({'success': False, 'error': 'Invalid uploader_id'}), 400
         category = request.form.get('category')
         description = request.form.get('description')
-        latitude = request.form.get('latitude')
-        longitude = request.form.get('longitude')
+        latitude = request.form.get('latitude', type=float)
+        longitude = request.form.get('longitude', type=float)
+        if (request.form.get('latitude') or request.form.get('longitude')) and not _valid_point(latitude, longitude):
+            session.close()
+            return jsonify({'success': False, 'error': 'Provide a valid latitude and longitude'}), 400
+        located = latitude is not None and longitude is not None
+        pincode = request.form.get('pincode') or '000000'
+        if not re.fullmatch(r'[0-9]{6}', pincode):
+            session.close()
+            return jsonify({'success': False, 'error': 'pincode must be 6 digits'}), 400
         media = request.files.get('media')
 
-        # Save media file if present
+        # Store media under its content hash, it is on disk before the report refers to it
         media_path = None
         if media:
-            upload_folder = os.path.join(os.getcwd(), 'uploads')
-            os.makedirs(upload_folder, exist_ok=True)
-            filename = secure_filename(media.filename)
-            media_path = filename  # Only store filename
-            media.save(os.path.join(upload_folder, filename))
+            media_path = storage.store(media)
+            derivatives.submit(media_path)  # thumbnails are made off the request
 
         # Generate a unique id for both SQL and MongoDB
-        last_report = Mongo_Uploads.objects.order_by('-id').first()
-        next_id = (last_report.id + 1) if last_report else 1
+        next_id = report_ids.next_id()
 
-        # Save to MongoDB
+        # Build the MongoDB document, the outbox relay writes it after the SQL commit
         mongo_report = Mongo_Uploads(
             id=next_id,
             image_path=f"/uploads/{media_path}" if media and media.mimetype.startswith('image') else None,
             video_path=f"/uploads/{media_path}" if media and media.mimetype.startswith('video') else None,
             description=description,
             issue_category=category,
-            issue_predicted_category=['manual'],
+            issue_predicted_category=[classify(description)],
+            cluster_id=assign_report(next_id, description, latitude, longitude),
         )
-        mongo_report.save()
+        clustered = ('report', next_id)
+        mongo_report.validate()
+        mongo_fields = mongo_report.to_mongo().to_dict()
+        mongo_fields.pop('_id')
 
         # Save to SQL
         upload = Uploads(
-            id=str(next_id),
+            id=next_id,
             uploader_id=int(uploader_id),
             issue_date=date.today(),
-            issue_latitude=float(latitude) if latitude else None,
-            issue_longitude=float(longitude) if longitude else None,
+            issue_latitude=latitude,
+            issue_longitude=longitude,
+            issue_geohash=geo.encode(latitude, longitude) if located else None,
             issue_nearby_uploader=False,  # Set as needed
             uploader_date=date.today(),
-            uploaders_pincode="000000",  # Set as needed
-            nearby_NGO=None
+            uploaders_pincode=pincode,
+            nearby_NGO=nearest_ngo(latitude, longitude, pincode)
         )
         session.add(upload)
+        outbox.enqueue(session, next_id, 'upsert', mongo_fields)
         session.commit()
+        stored = True
         session.close()
+        try:
+            outbox.notify()
+            search.index_reports([{'id': next_id, 'description': description, 'category': category, 'date': date.today()}])
+        except Exception as e:
+            # the report is stored; the relay and a search rebuild catch up with it
+            print(f"api_report caused problem after storing report {next_id}: {e}")
 
         return jsonify({'success': True, 'message': 'Report submitted successfully.'}), 201
+    except RequestEntityTooLarge:
+        raise  # answered by upload_too_large
     except Exception as e:
+        if clustered and not stored:
+            cluster_index.forget([clustered])  # the report was never stored, it must not join a cluster
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    create_app().run(debug=True)
@@ -0,0 +1,43 @@
+import json
+import statistics
+import subprocess
+import sys
+
+
+'''
+Worker boot cost: time and memory to import the app in a fresh interpreter,
+plus the threads and sockets it holds right after import. A pre-fork server
+pays this once per worker (or once in the master with preloading).
+
+usage: python -m bench.boot [runs] [module]
+'''
+
+PROBE = r'''
+import os, resource, sys, threading, time
+start = time.perf_counter()
+__import__(sys.argv[1])
+elapsed = time.perf_counter() - start
+sockets = 0
+for fd in os.listdir('/proc/self/fd') if os.path.isdir('/proc/self/fd') else []:
+    try:
+        sockets += os.readlink(f'/proc/self/fd/{fd}').startswith('socket:')
+    except OSError:
+        pass
+print({'seconds': elapsed, 'rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+       'threads': threading.active_count(), 'sockets': sockets})
+'''
+
+
+def boot(module):
+    output = subprocess.run([sys.executable, '-c', PROBE, module], capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1].replace("'", '"'))
+
+
+if __name__ == '__main__':
+    runs = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    module = sys.argv[2] if len(sys.argv) > 2 else 'app'
+    results = [boot(module) for _ in range(runs)]
+    print(f"import {module}, {runs} runs")
+    print(f"time: median {statistics.median(r['seconds'] for r in results) * 1000:.0f} ms, max {max(r['seconds'] for r in results) * 1000:.0f} ms")
+    print(f"peak RSS: {max(r['rss_mb'] for r in results):.1f} MB")
+    print(f"threads after import: {max(r['threads'] for r in results)}, open sockets: {max(r['sockets'] for r in results)}")
@@ -0,0 +1,41 @@
+import random
+import sys
+import time
+from AI.classifier import SEED_EXAMPLES, get_model
+
+
+'''
+Throughput of the hazard classifier, scoring text by text (predict_each)
+and as numpy arrays (predict_batch).
+
+usage: python -m bench.classifier [texts] [batch size]
+'''
+
+
+def make_texts(n, seed=42):
+    rng = random.Random(seed)
+    phrases = [text for texts in SEED_EXAMPLES.values() for text in texts]
+    filler = 'please help people near the harbour since this morning'.split()
+    texts = []
+    for _ in range(n):
+        words = rng.choice(phrases).split() + rng.sample(filler, 4)
+        rng.shuffle(words)
+        texts.append(' '.join(words))
+    return texts
+
+
+if __name__ == '__main__':
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    batch_size = int(sys.argv[2]) if len(sys.argv) > 2 else 2000
+    texts = make_texts(n)
+
+    start = time.perf_counter()
+    model = get_model()
+    print(f"model load: {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    for name, predict in (('per text', model.predict_each), ('batch', model.predict_batch)):
+        start = time.perf_counter()
+        for i in range(0, n, batch_size):
+            predict(texts[i:i + batch_size])
+        elapsed = time.perf_counter() - start
+        print(f"{name:>8}: {n} texts in {elapsed:.2f} s, {n / elapsed:,.0f} texts/s (batch size {batch_size})")
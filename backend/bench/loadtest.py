@@ -0,0 +1,88 @@
+import random
+import statistics
+import sys
+import threading
+import time
+import requests
+
+
+'''
+Load test against a running server: a fixed mix of report listing and
+overview reads (plus report submissions with --write), driven by a fixed
+number of client threads for a fixed time. Seeded, so runs are comparable.
+
+usage: python -m bench.loadtest [base url] [seconds] [concurrency] [--write]
+e.g.   python -m bench.loadtest http://127.0.0.1:8000 30 32
+'''
+
+# (name, weight, method, path, form fields)
+READS = [
+    ('reports page', 5, 'GET', '/api/reports?limit=50', None),
+    ('reports unverified', 2, 'GET', '/api/reports?verified=false&limit=50', None),
+    ('overview', 3, 'GET', '/api/overview', None),
+]
+WRITES = [
+    ('submit report', 1, 'POST', '/api/report', {
+        'uploader_id': '1', 'category': 'Flooding', 'description': 'water entering houses near the harbour',
+        'latitude': '13.0827', 'longitude': '80.2707',
+    }),
+]
+
+
+def worker(base_url, mix, deadline, seed, results, lock):
+    rng = random.Random(seed)
+    session = requests.Session()
+    weights = [weight for _, weight, _, _, _ in mix]
+    local = {}
+    while time.perf_counter() < deadline:
+        name, _, method, path, data = rng.choices(mix, weights)[0]
+        start = time.perf_counter()
+        try:
+            ok = session.request(method, base_url + path, data=data, timeout=30).status_code < 400
+        except requests.RequestException:
+            ok = False
+        latencies, errors = local.setdefault(name, ([], [0]))
+        latencies.append(time.perf_counter() - start)
+        errors[0] += not ok
+    with lock:
+        for name, (latencies, errors) in local.items():
+            total = results.setdefault(name, ([], [0]))
+            total[0].extend(latencies)
+            total[1][0] += errors[0]
+
+
+def percentile(values, q):
+    return statistics.quantiles(values, n=100)[q - 1] if len(values) > 1 else values[0]
+
+
+if __name__ == '__main__':
+    args = [a for a in sys.argv[1:] if not a.startswith('--')]
+    base_url = (args[0] if args else 'http://127.0.0.1:5000').rstrip('/')
+    seconds = float(args[1]) if len(args) > 1 else 20
+    concurrency = int(args[2]) if len(args) > 2 else 16
+    mix = READS + (WRITES if '--write' in sys.argv else [])
+
+    results, lock = {}, threading.Lock()
+    deadline = time.perf_counter() + seconds
+    threads = [
+        threading.Thread(target=worker, args=(base_url, mix, deadline, seed, results, lock))
+        for seed in range(concurrency)
+    ]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    print(f"{base_url}, {concurrency} clients, {elapsed:.1f} s")
+    print(f"{'endpoint':<20} {'requests':>9} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    total = 0
+    for name, (latencies, errors) in sorted(results.items()):
+        total += len(latencies)
+        print(
+            f"{name:<20} {len(latencies):>9} {len(latencies) / elapsed:>8.1f} "
+            f"{percentile(latencies, 50) * 1000:>8.1f} {percentile(latencies, 95) * 1000:>8.1f} "
+            f"{percentile(latencies, 99) * 1000:>8.1f} {errors[0]:>7}"
+        )
+    print(f"{'total':<20} {total:>9} {total / elapsed:>8.1f}")
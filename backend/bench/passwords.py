@@ -0,0 +1,38 @@
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from database.passwords import HASH_WORKERS, SCRYPT_N, SCRYPT_P, SCRYPT_R, hash_password, verify_password
+
+
+'''
+Login throughput at the configured scrypt cost.
+
+usage: python -m bench.passwords [seconds]
+'''
+
+
+def run(seconds, workers):
+    stored = hash_password('correct horse battery staple')
+    deadline = time.perf_counter() + seconds
+
+    def worker():
+        done = 0
+        while time.perf_counter() < deadline:
+            verify_password('correct horse battery staple', stored)
+            done += 1
+        return done
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        total = sum(pool.map(lambda _: worker(), range(workers)))
+    return total / (time.perf_counter() - start)
+
+
+if __name__ == '__main__':
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 3
+    print(f"scrypt N={SCRYPT_N} r={SCRYPT_R} p={SCRYPT_P}, {os.cpu_count()} CPUs")
+    single = run(seconds, 1)
+    print(f"1 thread: {single:,.1f} logins/s per core ({1000 / single:.1f} ms per verification)")
+    pooled = run(seconds, HASH_WORKERS)
+    print(f"{HASH_WORKERS} threads: {pooled:,.1f} logins/s in total")
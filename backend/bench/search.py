@@ -0,0 +1,83 @@
+import itertools
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from database import search
+
+
+'''
+Search latency on a synthetic index: N documents of 8-25 words drawn from a
+Zipf-like vocabulary plus hazard words, split between reports and posts with
+categories, platforms and dates. Seeded, so runs are comparable. The index
+is built in a temp file, the configured HARBORNET_SEARCH_DB is not touched.
+
+usage: python -m bench.search [documents] [runs per query]
+'''
+
+HAZARD_WORDS = ['flood', 'water', 'bridge', 'collapsed', 'wave', 'tsunami', 'storm', 'surge', 'road', 'jetty', 'boat', 'rain']
+CATEGORIES = ['Flooding', 'Tsunami', 'High Waves', 'Coastal Damage', 'Other']
+PLATFORMS = ['Twitter', 'YouTube']
+
+QUERIES = [
+    ('common word', {'text': 'water'}),
+    ('two common words', {'text': 'bridge collapsed'}),
+    ('rare word', {'text': 'w19000'}),
+    ('common word, category', {'text': 'water', 'category': 'Tsunami'}),
+    ('common word, posts on one platform', {'text': 'storm', 'kind': 'post', 'platform': 'YouTube'}),
+    ('common word, date range', {'text': 'flood', 'date_from': '2025-03-01', 'date_to': '2025-03-07'}),
+    ('common word, page 10', {'text': 'water', 'offset': 180}),
+]
+
+
+def documents(count, rng):
+    vocabulary = [f"w{i}" for i in range(20000)]
+    cum_weights = list(itertools.accumulate(1 / (rank + 1) for rank in range(len(vocabulary))))
+    for ref_id in range(1, count + 1):
+        words = rng.choices(vocabulary, cum_weights=cum_weights, k=rng.randint(6, 20)) + rng.sample(HAZARD_WORDS, rng.randint(1, 4))
+        rng.shuffle(words)
+        kind = 'report' if ref_id % 3 else 'post'
+        day = f"2025-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"
+        platform = rng.choice(PLATFORMS) if kind == 'post' else None
+        yield search._row(kind, ref_id, ' '.join(words), rng.choice(CATEGORIES), platform, day)
+
+
+def build(count):
+    rng = random.Random(0)
+    batch = []
+    with search._connection() as conn:
+        for row in documents(count, rng):
+            batch.append(row)
+            if len(batch) == 10000:
+                with conn:
+                    search._write(conn, batch)
+                batch = []
+        with conn:
+            search._write(conn, batch)
+            conn.execute("INSERT INTO docs (docs) VALUES ('optimize')")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 20
+
+    directory = tempfile.mkdtemp(prefix='search-bench-')
+    search.SEARCH_DB = os.path.join(directory, 'search.db')
+    started = time.perf_counter()
+    build(count)
+    print(f"indexed {count} documents in {time.perf_counter() - started:.1f} s, "
+          f"{os.path.getsize(search.SEARCH_DB) / 1024 / 1024:.0f} MB")
+
+    print(f"{'query':<36} {'p50 ms':>8} {'p95 ms':>8} {'results':>8}")
+    for name, query in QUERIES:
+        timings = []
+        for _ in range(runs):
+            start = time.perf_counter()
+            results, _ = search.search(**query)
+            timings.append(time.perf_counter() - start)
+        p95 = statistics.quantiles(timings, n=20)[-1] if runs > 1 else timings[0]
+        print(f"{name:<36} {statistics.median(timings) * 1000:>8.1f} {p95 * 1000:>8.1f} {len(results):>8}")
+    shutil.rmtree(directory)
@@ -0,0 +1,243 @@
+import math
+import sys
+import threading
+import time
+from database import geo
+from database.connect import SessionLocal
+from sqlalchemy import func
+from database.db_models import NGO, Uploads
+
+
+'''
+Nearest-NGO assignment for reports.
+
+NGOs with coordinates are kept in memory in a grid of CELL_DEG degree cells.
+A lookup scans rings of cells outwards from the report's cell and stops as
+soon as the k-th closest NGO found is nearer than anything an unscanned ring
+could hold, so it only touches a few cells however many NGOs there are.
+Grid columns wrap at the antimeridian, and no lookup scans more rings than
+the grid has, so even a point with no NGO anywhere near ends.
+
+NGOs registered before the coordinate columns existed only have a pincode.
+They are placed at the centroid of the located reports sent from that
+pincode, and tried again on every refresh until such reports exist. A
+report without coordinates goes to an NGO of its own pincode.
+'''
+
+CELL_DEG = 0.5
+REFRESH_SECONDS = 60  # how often a worker picks up NGOs added by other workers
+
+
+class NGOIndex:
+    def __init__(self, cell_deg=CELL_DEG):
+        self.cell_deg = cell_deg
+        self._columns = round(360 / cell_deg)  # cells around a circle of latitude
+        self._lock = threading.Lock()
+        self._cells = {}
+        self._where = {}  # ngo id -> cell key
+        self._bounds = None  # (min_i, min_j, max_i, max_j) of occupied cells
+        self._max_id = 0
+        self._unplaced = {}  # ngo id -> pincode, NGOs with no coordinates and no centroid yet
+        self._by_pincode = {}  # pincode -> ngo ids, every NGO
+        self._loaded_at = None
+
+    def _cell(self, lat, lon):
+        return math.floor(lat / self.cell_deg), math.floor(lon / self.cell_deg) % self._columns
+
+    # to add or move one NGO in the index
+    def add(self, ngo_id, lat, lon, pincode=None):
+        if lat is None or lon is None:
+            return
+        lat, lon = float(lat), float(lon)
+        with self._lock:
+            self._remove(ngo_id)
+            i, j = self._cell(lat, lon)
+            self._cells.setdefault((i, j), []).append((ngo_id, lat, lon, pincode))
+            self._where[ngo_id] = (i, j)
+            if self._bounds is None:
+                self._bounds = (i, j, i, j)
+            else:
+                min_i, min_j, max_i, max_j = self._bounds
+                self._bounds = (min(min_i, i), min(min_j, j), max(max_i, i), max(max_j, j))
+            self._max_id = max(self._max_id, ngo_id)
+
+    def _remove(self, ngo_id):
+        key = self._where.pop(ngo_id, None)
+        if key is None:
+            return
+        kept = [entry for entry in self._cells[key] if entry[0] != ngo_id]
+        if kept:
+            self._cells[key] = kept
+        else:
+            del self._cells[key]
+
+    # to load NGOs from the ngo table, only those newer than the last load unless full
+    # NGOs without coordinates are placed at their pincode's centroid when it is known
+    def refresh(self, full=False):
+        session = SessionLocal()
+        try:
+            query = session.query(NGO.id, NGO.latitude, NGO.longitude, NGO.pincode)
+            if full:
+                with self._lock:
+                    self._cells = {}
+                    self._where = {}
+                    self._bounds = None
+                    self._max_id = 0
+                    self._unplaced = {}
+                    self._by_pincode = {}
+            else:
+                query = query.filter(NGO.id > self._max_id)
+            for ngo_id, lat, lon, pincode in query:
+                self.register(ngo_id, lat, lon, pincode)
+
+            if self._unplaced:
+                centroids = _pincode_centroids(session, set(self._unplaced.values()))
+                for ngo_id, pincode in list(self._unplaced.items()):
+                    if pincode in centroids:
+                        self.add(ngo_id, *centroids[pincode], pincode)
+                        del self._unplaced[ngo_id]
+            self._loaded_at = time.monotonic()
+
+        except Exception as e:
+            print(f"NGOIndex.refresh caused error: {e}")
+
+        finally:
+            session.close()
+
+    # to index a new or loaded NGO, one without coordinates waits for its pincode's centroid
+    def register(self, ngo_id, lat, lon, pincode):
+        with self._lock:
+            self._max_id = max(self._max_id, ngo_id)
+            ngo_ids = self._by_pincode.setdefault(pincode, [])
+            if ngo_id not in ngo_ids:
+                ngo_ids.append(ngo_id)
+            if lat is None or lon is None:
+                self._unplaced[ngo_id] = pincode
+                return
+        self.add(ngo_id, lat, lon, pincode)
+
+    # to get an NGO of a pincode, for reports without coordinates
+    def for_pincode(self, pincode):
+        if self._loaded_at is None:
+            self.refresh(full=True)
+        with self._lock:
+            ngo_ids = self._by_pincode.get(pincode)
+            return ngo_ids[0] if ngo_ids else None
+
+    # to get the k nearest NGOs as [(ngo_id, distance_km, pincode)], nearest first
+    # a point off the globe (or NaN) has no nearest NGOs
+    def nearest(self, lat, lon, k=1):
+        lat, lon = float(lat), float(lon)
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            return []
+        if self._loaded_at is None:
+            self.refresh(full=True)
+        elif time.monotonic() - self._loaded_at > REFRESH_SECONDS:
+            self.refresh()
+
+        with self._lock:
+            if not self._bounds:
+                return []
+            ci, cj = self._cell(lat, lon)
+            min_i, min_j, max_i, max_j = self._bounds
+            # columns wrap, so no occupied column is more than half the grid away
+            max_ring = max(abs(ci - min_i), abs(ci - max_i), min(max(abs(cj - min_j), abs(cj - max_j)), self._columns // 2))
+
+            found = []
+            looked_at = 0
+            for ring in range(max_ring + 1):
+                keys = self._ring(ci, cj, ring)
+                looked_at += len(keys)
+                if looked_at > len(self._cells):
+                    keys = self._cells  # mostly empty rings, reading every occupied cell is cheaper
+                    found = []
+                for key in keys:
+                    for ngo_id, nlat, nlon, pincode in self._cells.get(key, ()):
+                        found.append((ngo_id, geo.haversine_km(lat, lon, nlat, nlon), pincode))
+                if keys is self._cells:
+                    break
+                if len(found) >= k:
+                    found.sort(key=lambda entry: entry[1])
+                    if found[k - 1][1] <= self._ring_min_km(lat, ring):
+                        break
+            found.sort(key=lambda entry: entry[1])
+            return found[:k]
+
+    def _ring(self, ci, cj, ring):
+        if ring == 0:
+            return [(ci, cj)]
+        keys = []
+        for d in range(-ring, ring + 1):
+            keys.extend([(ci - ring, cj + d), (ci + ring, cj + d)])
+        for d in range(-ring + 1, ring):
+            keys.extend([(ci + d, cj - ring), (ci + d, cj + ring)])
+        # a ring half the grid wide meets itself across the antimeridian
+        return list(dict.fromkeys((i, j % self._columns) for i, j in keys))
+
+    # to get a lower bound on the distance to any NGO outside the scanned rings
+    def _ring_min_km(self, lat, ring):
+        degrees = ring * self.cell_deg
+        widest_lat = min(89.9, abs(lat) + degrees + self.cell_deg)
+        km_per_deg = math.radians(1) * geo.EARTH_RADIUS_KM
+        return degrees * km_per_deg * math.cos(math.radians(widest_lat))
+
+
+# to get {pincode: (lat, lon)} of the located reports sent from the given pincodes
+def _pincode_centroids(session, pincodes):
+    rows = (
+        session.query(Uploads.uploaders_pincode, func.avg(Uploads.issue_latitude), func.avg(Uploads.issue_longitude))
+        .filter(Uploads.uploaders_pincode.in_(pincodes), Uploads.issue_latitude.isnot(None), Uploads.issue_longitude.isnot(None))
+        .group_by(Uploads.uploaders_pincode)
+    )
+    return {pincode: (float(lat), float(lon)) for pincode, lat, lon in rows}
+
+
+ngo_index = NGOIndex()
+
+
+# to pick the NGO for a report, the nearest one to its location or, without a
+# location, one of its pincode; None when there is none
+def nearest_ngo(lat, lon, pincode=None):
+    if lat is None or lon is None:
+        return ngo_index.for_pincode(pincode) if pincode else None
+    nearest = ngo_index.nearest(lat, lon, k=1)
+    return nearest[0][0] if nearest else None
+
+# to (re)assign nearby_NGO on stored uploads, only unassigned ones unless everything=True
+def reassign(everything=False, chunk_size=1000):
+    ngo_index.refresh(full=True)
+    session = SessionLocal()
+    updated = 0
+    last_id = None
+    try:
+        while True:
+            query = session.query(Uploads.id, Uploads.issue_latitude, Uploads.issue_longitude, Uploads.uploaders_pincode)
+            if not everything:
+                query = query.filter(Uploads.nearby_NGO.is_(None))
+            if last_id is not None:
+                query = query.filter(Uploads.id > last_id)
+            rows = query.order_by(Uploads.id).limit(chunk_size).all()
+            if not rows:
+                break
+            last_id = rows[-1].id
+            mappings = []
+            for upload_id, lat, lon, pincode in rows:
+                ngo_id = nearest_ngo(lat, lon, pincode)
+                if ngo_id is not None:
+                    mappings.append({'id': upload_id, 'nearby_NGO': ngo_id})
+            session.bulk_update_mappings(Uploads, mappings)
+            session.commit()
+            updated += len(mappings)
+        return updated
+    finally:
+        session.close()
+
+
+# usage: python -m database.assign reassign [--all]
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'reassign'
+    if command == 'reassign':
+        print(f"Assigned an NGO to {reassign(everything='--all' in sys.argv)} uploads.")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
@@ -0,0 +1,197 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+
+'''
+Read-through caches for identity and reference lookups.
+
+Each cache is a per-process LRU whose entries expire after `ttl` seconds.
+A lookup that misses calls the loader, stores what it returns and counts the
+hit or miss. Functions that change the underlying rows call invalidate().
+
+A None result (an unknown email, say) is kept for `negative_ttl` seconds
+only, long enough to absorb a burst of requests for it. invalidate() runs in
+the process that created the row, and another worker holding a None for it
+would otherwise miss the new row for the full ttl.
+
+With HARBORNET_CACHE_BACKEND=mongo a miss in process memory is looked up in
+a shared Mongo_Cache collection before the loader runs, so workers share
+what any of them loaded. Invalidation removes the shared entry as well.
+None results are then kept in the shared entry only, not in process memory,
+so removing it reaches every worker at once; other processes may keep an
+in-memory copy of a found value until its ttl runs out.
+'''
+
+BACKEND = os.getenv('HARBORNET_CACHE_BACKEND', 'local')
+DEFAULT_TTL = float(os.getenv('HARBORNET_CACHE_TTL', '300'))
+NEGATIVE_TTL = float(os.getenv('HARBORNET_CACHE_NEGATIVE_TTL', '5'))  # for None results, 0 does not cache them
+
+_MISSING = object()
+
+
+# shared second level on a MongoDB collection with a TTL index
+class MongoBackend:
+    def get(self, key):
+        from database.db_models import Mongo_Cache
+
+        doc = Mongo_Cache._get_collection().find_one({'_id': key})
+        if doc is None or doc['expires_at'] < datetime.utcnow():
+            return _MISSING
+        return doc.get('value')
+
+    def set(self, key, value, ttl):
+        from database.db_models import Mongo_Cache
+
+        Mongo_Cache._get_collection().replace_one(
+            {'_id': key},
+            {'_id': key, 'value': value, 'expires_at': datetime.utcnow() + timedelta(seconds=ttl)},
+            upsert=True,
+        )
+
+    def delete(self, key):
+        from database.db_models import Mongo_Cache
+
+        Mongo_Cache._get_collection().delete_one({'_id': key})
+
+
+class TTLCache:
+    def __init__(self, name, maxsize=10000, ttl=DEFAULT_TTL, shared=None, negative_ttl=NEGATIVE_TTL):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.negative_ttl = min(negative_ttl, ttl)
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key -> (expires at, value), least recently used first
+
+    def _get_local(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                return _MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def _ttl(self, value):
+        return self.ttl if value is not None else self.negative_ttl
+
+    def _set_local(self, key, value):
+        if value is None and (self.shared or self.negative_ttl <= 0):
+            return  # a shared None is read from the backend, where invalidate() reaches it
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self._ttl(value), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _count(self, hit):
+        with self._lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _shared_key(self, key):
+        return f"{self.name}:{key}"
+
+    # to get the cached value of key, calling loader(key) on a miss
+    # the loader can return a `Skip` to pass a value through without caching it (e.g. on errors)
+    def get(self, key, loader):
+        value = self._get_local(key)
+        if value is not _MISSING:
+            self._count(True)
+            return value
+        if self.shared:
+            try:
+                value = self.shared.get(self._shared_key(key))
+            except Exception as e:
+                print(f"{self.name} cache backend caused error: {e}")
+                value = _MISSING
+            if value is not _MISSING:
+                self._count(True)
+                self._set_local(key, value)
+                return value
+
+        self._count(False)
+        value = loader(key)
+        if isinstance(value, Skip):
+            return value.value
+        self._set_local(key, value)
+        if self.shared and self._ttl(value) > 0:
+            try:
+                self.shared.set(self._shared_key(key), value, self._ttl(value))
+            except Exception as e:
+                print(f"{self.name} cache backend caused error: {e}")
+        return value
+
+    # to get several keys at once, load_many(missing keys) returns {key: value} for those found
+    # keys it leaves out are None, cached for negative_ttl
+    def get_many(self, keys, load_many):
+        found, missing = {}, []
+        for key in set(keys):
+            value = self._get_local(key)
+            if value is _MISSING:
+                missing.append(key)
+            else:
+                found[key] = value
+        with self._lock:
+            self.hits += len(found)
+            self.misses += len(missing)
+        if missing:
+            loaded = load_many(missing)
+            for key in missing:
+                found[key] = loaded.get(key)
+                self._set_local(key, found[key])
+        return found
+
+    def invalidate(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+        if self.shared:
+            for key in keys:
+                try:
+                    self.shared.delete(self._shared_key(key))
+                except Exception as e:
+                    print(f"{self.name} cache backend caused error: {e}")
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': round(self.hits / total, 4) if total else None,
+            }
+
+
+# wraps a loader result that must be returned but not cached
+class Skip:
+    def __init__(self, value):
+        self.value = value
+
+
+_shared = MongoBackend() if BACKEND == 'mongo' else None
+
+citizen_ids = TTLCache('citizen_ids', shared=_shared)  # email or mobile -> citizens.id
+employee_ids = TTLCache('employee_ids', shared=_shared)  # email -> employees.id
+volunteer_ids = TTLCache('volunteer_ids', shared=_shared)  # email -> volunteers.id
+ngo_ids = TTLCache('ngo_ids', shared=_shared)  # name -> ngo.id
+citizen_emails = TTLCache('citizen_emails', maxsize=50000)  # citizens.id -> email
+
+CACHES = [citizen_ids, employee_ids, volunteer_ids, ngo_ids, citizen_emails]
+
+
+# to get the counters of every cache, keyed by cache name
+def stats():
+    return {cache.name: cache.stats() for cache in CACHES}
@@ -1,17 +1,40 @@
+import os
+import threading
 from sqlalchemy import create_engine
-from sqlalchemy.orm import declarative_base, sessionmaker
-from mongoengine import connect
+from sqlalchemy.orm import Session, declarative_base, sessionmaker
+from mongoengine import register_connection, disconnect, DEFAULT_CONNECTION_NAME
+from mongoengine import connection as mongo_connection
+from database import metrics
 
 
 
-USERNAME = 'harbornet_user'
-PASSWORD = 'your_secure_password'
-HOST = 'localhost'
-DB_NAME = 'harbornet'
+USERNAME = os.getenv('HARBORNET_DB_USER', 'harbornet_user')
+PASSWORD = os.getenv('HARBORNET_DB_PASSWORD', 'your_secure_password')
+HOST = os.getenv('HARBORNET_DB_HOST', 'localhost')
+DB_NAME = os.getenv('HARBORNET_DB_NAME', 'harbornet')
+
+# SQL pool, size it against workers x threads per worker (see /metrics for contention)
+POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '10'))
+MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '20'))
+POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # seconds, keep below the server's wait_timeout
+POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', '1') == '1'  # test connections on checkout after idle periods
+
+# MongoDB client
+MONGO_URI = os.getenv('MONGO_URI')  # overrides host and port when set
+MONGO_HOST = os.getenv('MONGO_HOST', 'localhost')
+MONGO_PORT = int(os.getenv('MONGO_PORT', '27017'))
+MONGO_DB = os.getenv('MONGO_DB', 'harbornet')
+MONGO_MAX_POOL_SIZE = int(os.getenv('MONGO_MAX_POOL_SIZE', '100'))
+MONGO_MIN_POOL_SIZE = int(os.getenv('MONGO_MIN_POOL_SIZE', '0'))
+MONGO_MAX_IDLE_MS = int(os.getenv('MONGO_MAX_IDLE_MS', '300000'))
+MONGO_TIMEOUT_MS = int(os.getenv('MONGO_TIMEOUT_MS', '5000'))
 
 
 # Detect Fedora and use MariaDB, else use MySQL
 def get_sqlalchemy_url():
+    if os.getenv('DATABASE_URL'):
+        return os.getenv('DATABASE_URL')
     try:
         with open('/etc/os-release') as f:
             os_release = f.read().lower()
@@ -23,31 +46,79 @@ def get_sqlalchemy_url():
     # Default to MySQL
     return f'mysql+mysqlconnector://{USERNAME}:{PASSWORD}@{HOST}/{DB_NAME}'
 
-engine = create_engine(
-    get_sqlalchemy_url(),
-    pool_size=10,           # Increase the pool size
-    max_overflow=20,        # Allow up to 20 additional connections
-    pool_timeout=30,        # Keep the timeout at 30 seconds or adjust as needed
-)
+_engine = None
+_engine_lock = threading.Lock()
+
+# to get the SQL engine, created on first use so importing this module opens nothing
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = create_engine(
+                    get_sqlalchemy_url(),
+                    poolclass=metrics.TimedQueuePool,
+                    pool_size=POOL_SIZE,
+                    max_overflow=MAX_OVERFLOW,
+                    pool_timeout=POOL_TIMEOUT,
+                    pool_recycle=POOL_RECYCLE,
+                    pool_pre_ping=POOL_PRE_PING,
+                )
+                metrics.instrument_engine(_engine)
+    return _engine
+
+# `from database.connect import engine` still works, it builds the engine then
+def __getattr__(name):
+    if name == 'engine':
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+# sessions bind to the engine when they first run a statement, not when the module loads
+class LazySession(Session):
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and self.bind is None:
+            return get_engine()
+        return super().get_bind(mapper, clause=clause, bind=bind, **kwargs)
 
 
 Base = declarative_base()
-SessionLocal = sessionmaker(bind=engine)
+SessionLocal = sessionmaker(class_=LazySession)
 
 
 
 ''' for mongodb '''
 def init_db():
     """
-    Initialize connection to MongoDB.
-    Change db name, host, port, and authentication as needed.
+    Register the MongoDB connection settings.
+    Settings come from the MONGO_* environment variables. The client (and its
+    monitor threads) is only created when a document is first used.
     """
-    connect(
-        db="harbornet",       # database name
-        host="localhost",    # MongoDB server
-        port=27017         # default MongoDB port
+    register_connection(
+        DEFAULT_CONNECTION_NAME,
+        db=MONGO_DB,
+        host=MONGO_URI or MONGO_HOST,
+        port=MONGO_PORT,
+        maxPoolSize=MONGO_MAX_POOL_SIZE,
+        minPoolSize=MONGO_MIN_POOL_SIZE,
+        maxIdleTimeMS=MONGO_MAX_IDLE_MS,
+        serverSelectionTimeoutMS=MONGO_TIMEOUT_MS,
+        event_listeners=[metrics.mongo_listener],
         # username="your_username",  # uncomment when set authentication
         # password="your_password",
     )
 
 init_db()
+
+
+# a forked worker must not reuse the parent's sockets: drop the inherited SQL
+# pool without closing it, forget the parent's MongoClient the same way and
+# register the settings again so the child creates its own clients on first use
+def _reset_after_fork():
+    if _engine is not None:
+        _engine.dispose(close=False)
+    mongo_connection._connections.pop(DEFAULT_CONNECTION_NAME, None)
+    disconnect(DEFAULT_CONNECTION_NAME)
+    init_db()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,136 @@
+import sys
+from collections import Counter
+from pymongo import UpdateOne
+from database.connect import SessionLocal
+from database.db_models import Uploads, Mongo_Uploads, Mongo_Overview, Mongo_Counters
+
+
+'''
+Materialized counters behind /api/overview.
+
+Mongo_Overview holds one document per category and per verification status.
+The outbox relay adjusts them with $inc whenever it changes Mongo_Uploads, so
+the overview is a single read of a handful of documents. rebuild() recomputes
+everything from Mongo_Uploads with one aggregation pipeline.
+
+The relay records what each outbox event changes in the counters before it
+first writes the event to MongoDB, and every counter document keeps the id
+of the last event it counted (`last_event`). A batch that is retried after a
+partial failure is therefore counted once, whatever it had already written.
+
+Version counters ('version:<name>' in Mongo_Counters) go up on every write
+that changes what a read endpoint returns; responses use them as ETags.
+'''
+
+CATEGORIES = ['Flooding', 'Tsunami', 'High Waves', 'Coastal Damage', 'Other']
+STATUSES = ['verified', 'unverified']
+
+
+# to get the counter keys a report document contributes to
+def _keys(doc):
+    keys = ['status:' + (doc.get('status') or 'unverified')]
+    if doc.get('issue_category'):
+        keys.append('category:' + doc['issue_category'])
+    return keys
+
+# to get what a report moving from `old` to `new` changes in the counters
+# either is a {'issue_category': ..., 'status': ...} document, or None when the report does not exist
+def change(old, new):
+    delta = Counter(_keys(new) if new is not None else [])
+    delta.subtract(_keys(old) if old is not None else [])
+    return {key: value for key, value in delta.items() if value}
+
+# to add the changes of relayed outbox events, [(event id, {key: change})] in id order
+# events at or below a counter's last_event are already in it and are skipped, this
+# relies on the single outbox relay applying events in id order
+def apply_changes(changes):
+    keys = {key for _, delta in changes for key in delta}
+    if not keys:
+        return
+    collection = Mongo_Overview._get_collection()
+    counted = {doc['_id']: doc.get('last_event') for doc in collection.find({'_id': {'$in': list(keys)}}, {'last_event': 1})}
+    newest = changes[-1][0]
+    operations = []
+    for key in keys:
+        last = counted.get(key)
+        if (last or 0) >= newest:
+            continue
+        value = sum(delta.get(key, 0) for event_id, delta in changes if event_id > (last or 0))
+        operations.append(UpdateOne(
+            {'_id': key, 'last_event': last},  # unchanged since it was read
+            {'$inc': {'value': value}, '$set': {'last_event': newest}},
+            upsert=key not in counted,
+        ))
+    if operations:
+        collection.bulk_write(operations, ordered=False)
+
+# to get the overview panel numbers in one read
+def read_overview():
+    values = {doc['_id']: doc.get('value', 0) for doc in Mongo_Overview._get_collection().find()}
+    overview = {}
+    for cat in CATEGORIES:
+        overview[cat.replace(' ', '').lower()] = values.get('category:' + cat, 0)
+    for status in STATUSES:
+        overview[status] = values.get('status:' + status, 0)
+    return overview
+
+# to copy verification status from sql onto the mongo documents
+def sync_status(chunk_size=1000):
+    session = SessionLocal()
+    try:
+        verified = [i for (i,) in session.query(Uploads.id).filter(Uploads.issue_nearby_uploader == True)]
+    finally:
+        session.close()
+
+    collection = Mongo_Uploads._get_collection()
+    collection.update_many({'status': {'$exists': False}}, {'$set': {'status': 'unverified'}})
+    for start in range(0, len(verified), chunk_size):
+        chunk = verified[start:start + chunk_size]
+        collection.update_many({'_id': {'$in': chunk}}, {'$set': {'status': 'verified'}})
+
+# to recompute every counter from Mongo_Uploads, used for backfill and after drift
+def rebuild():
+    pipeline = [{'$facet': {
+        'category': [{'$group': {'_id': '$issue_category', 'count': {'$sum': 1}}}],
+        'status': [{'$group': {'_id': {'$ifNull': ['$status', 'unverified']}, 'count': {'$sum': 1}}}],
+    }}]
+    result = next(Mongo_Uploads._get_collection().aggregate(pipeline))
+
+    values = {}
+    for facet in ('category', 'status'):
+        for row in result[facet]:
+            if row['_id']:
+                values[f"{facet}:{row['_id']}"] = row['count']
+
+    collection = Mongo_Overview._get_collection()
+    collection.delete_many({'_id': {'$nin': list(values)}})
+    if values:
+        collection.bulk_write(
+            [UpdateOne({'_id': key}, {'$set': {'value': value}}, upsert=True) for key, value in values.items()],
+            ordered=False,
+        )
+    bump_version('reports')
+    return values
+
+
+# to mark that the data behind `name` (reports, social_posts) changed
+def bump_version(name):
+    Mongo_Counters._get_collection().update_one({'_id': 'version:' + name}, {'$inc': {'value': 1}}, upsert=True)
+
+# to get the current version of `name`, one primary key read
+def read_version(name):
+    doc = Mongo_Counters._get_collection().find_one({'_id': 'version:' + name}, {'value': 1})
+    return doc['value'] if doc else 0
+
+
+# usage: python -m database.counters rebuild [--sync-status]
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rebuild'
+    if command == 'rebuild':
+        if '--sync-status' in sys.argv:
+            sync_status()
+        for key, value in sorted(rebuild().items()):
+            print(f"{key}: {value}")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
@@ -1,7 +1,16 @@
-from sqlalchemy import and_, or_
+import base64
+import datetime
+import heapq
+import itertools
+from sqlalchemy import and_, or_, func
+from database import geo, outbox, search
+from database.assign import ngo_index
 from database.connect import SessionLocal
-from database.db_models import Citizens, Employees, Volunteers, NGO, Uploads, Mongo_Uploads
+from database.passwords import hash_in_pool, verify_in_pool
+from database.cache import Skip, citizen_ids, employee_ids, volunteer_ids, ngo_ids, citizen_emails
+from database.db_models import Citizens, Employees, Volunteers, NGO, Uploads, SocialPost, Mongo_Uploads
 
+NEAR_CELL_ROWS = 1000  # most rows one geohash cell query of get_uploads_near reads
 
 
 
@@ -13,61 +22,79 @@ def check_user(identifier=None):
         print("check_user caused error: Provide email or phone to login.")
         return None
 
+    return citizen_ids.get(identifier, _load_citizen_id)
+
+# to query citizen columns by email or mobile, one unique index lookup per column
+# (an OR across the two columns can make MySQL scan the whole table)
+def citizen_query(session, identifier, *columns):
+    return (
+        session.query(*columns).filter(Citizens.email == identifier)
+        .union_all(session.query(*columns).filter(Citizens.mobile == identifier))
+    )
+
+# to query the citizen id of an email or mobile, bypassing the cache
+def _load_citizen_id(identifier):
     session = SessionLocal()
     try:
-        # Check if identifier is email or phone
-        user = session.query(Citizens).filter(
-            (Citizens.email == identifier) | (Citizens.mobile == identifier)
-        ).first()
-
-        if user:
-            return user.id
-        else:
-            return None
+        user = citizen_query(session, identifier, Citizens.id).first()
+        return user.id if user else None
 
     except Exception as e:
         print(f"check_user caused error: {e}\n")
-        return False
+        return Skip(False)
 
     finally:
         session.close()
 
-# to verify the citizen and password
-def verify_user(identifier=None, password=None):
+# to check a password against the stored hash, upgrading the hash when it is
+# plaintext or made with an older cost (caller's session is committed)
+def _password_matches(session, model, user_id, stored, password):
+    matches, needs_rehash = verify_in_pool(password, stored)
+    if matches and needs_rehash:
+        session.query(model).filter(model.id == user_id).update(
+            {model.password: hash_in_pool(password)}, synchronize_session=False
+        )
+        session.commit()
+    return matches
+
+# to log a citizen in, returns the citizen id or None
+# one query fetches the id and the hash together
+def authenticate_user(identifier=None, password=None):
     if not identifier:
-        print("verify_user caused error: Provide email or phone to login.")
-        return False
+        print("authenticate_user caused error: Provide email or phone to login.")
+        return None
 
     if not password:
-        print("verify_user caused error: Password is required.")
-        return False
+        print("authenticate_user caused error: Password is required.")
+        return None
 
     session = SessionLocal()
     try:
         # Check if identifier is email or phone
-        user = session.query(Citizens).filter(
-            (Citizens.email == identifier) | (Citizens.mobile == identifier)
-        ).first()
+        user = citizen_query(session, identifier, Citizens.id, Citizens.password).first()
 
         if not user:
-            print("verify_user caused error: User not found.")
-            return False
+            print("authenticate_user caused error: User not found.")
+            return None
 
-        # Verify password
-        if user.password != password:
-            print("verify_user caused error: Incorrect password.")
-            return False
+        if not _password_matches(session, Citizens, user.id, user.password, password):
+            print("authenticate_user caused error: Incorrect password.")
+            return None
 
-        print("Login successful!")
-        return True
+        return user.id
 
     except Exception as e:
-        print(f"verify_user caused error: {e}")
-        return False
+        session.rollback()
+        print(f"authenticate_user caused error: {e}")
+        return None
 
     finally:
         session.close()
 
+# to verify the citizen and password
+def verify_user(identifier=None, password=None):
+    return authenticate_user(identifier, password) is not None
+
 # to add new user
 def add_new_user(phone=None, email=None, password=None):
     if not (phone or email):
@@ -92,9 +119,10 @@ def add_new_user(phone=None, email=None, password=None):
                 return
 
         # Create new account
-        user = Citizens(mobile=phone, email=email, password=password)
+        user = Citizens(mobile=phone, email=email, password=hash_in_pool(password))
         session.add(user)
         session.commit()
+        citizen_ids.invalidate(*[key for key in (phone, email) if key])
         print("User created successfully!")
 
     except Exception as e:
@@ -120,61 +148,63 @@ def check_employee(email=None):
         print("check_employee caused error: Provide email to login.")
         return None
 
+    return employee_ids.get(email, _load_employee_id)
+
+# to query the employee id of an email, bypassing the cache
+def _load_employee_id(email):
     session = SessionLocal()
     try:
-        # Check if identifier is email or phone
-        user = session.query(Employees).filter(
+        user = session.query(Employees.id).filter(
             (Employees.email == email)
         ).first()
-
-        if user:
-            return user.id
-        else:
-            return None
+        return user.id if user else None
 
     except Exception as e:
         print(f"check_employee caused error: {e}\n")
-        return False
+        return Skip(False)
 
     finally:
         session.close()
 
-# to verify the user and password
-def verify_employee(email=None, password=None):
+# to log an employee in, returns the employee id or None
+def authenticate_employee(email=None, password=None):
     if not email:
-        print("verify_employee caused error: Provide email or phone to login.")
-        return False
+        print("authenticate_employee caused error: Provide email or phone to login.")
+        return None
 
     if not password:
-        print("verify_employee caused error: Password is required.")
-        return False
+        print("authenticate_employee caused error: Password is required.")
+        return None
 
     session = SessionLocal()
     try:
         # Check if identifier is email or phone
-        user = session.query(Employees).filter(
+        user = session.query(Employees.id, Employees.password).filter(
             (Employees.email == email)
         ).first()
 
         if not user:
-            print("verify_employee caused error: User not found.")
-            return False
+            print("authenticate_employee caused error: User not found.")
+            return None
 
         # Verify password
-        if user.password != password:
-            print("verify_employee caused error: Incorrect password.")
-            return False
+        if not _password_matches(session, Employees, user.id, user.password, password):
+            print("authenticate_employee caused error: Incorrect password.")
+            return None
 
-        print("Login successful!")
-        return True
+        return user.id
 
     except Exception as e:
-        print(f"verify_employee caused error: {e}")
-        return False
+        print(f"authenticate_employee caused error: {e}")
+        return None
 
     finally:
         session.close()
 
+# to verify the user and password
+def verify_employee(email=None, password=None):
+    return authenticate_employee(email, password) is not None
+
 # to add new employee details
 def add_new_employee(email=None, password=None):
     if not email:
@@ -195,9 +225,10 @@ def add_new_employee(email=None, password=None):
                 return
 
         # Create new account
-        user = Employees(email=email, password=password)
+        user = Employees(email=email, password=hash_in_pool(password))
         session.add(user)
         session.commit()
+        employee_ids.invalidate(email)
 
     except Exception as e:
         session.rollback()
@@ -222,61 +253,63 @@ def check_volunteer(email=None, contact=None):
         print("check_volunteer caused error: Provide email or phone to login.")
         return None
 
+    return volunteer_ids.get(email, _load_volunteer_id)
+
+# to query the volunteer id of an email, bypassing the cache
+def _load_volunteer_id(email):
     session = SessionLocal()
     try:
-        # Check if identifier is email or phone
-        user = session.query(Volunteers).filter(
+        user = session.query(Volunteers.id).filter(
             (Volunteers.email == email)
         ).first()
-
-        if user:
-            return user.id
-        else:
-            return None
+        return user.id if user else None
 
     except Exception as e:
         print(f"check_volunteer caused error: {e}\n")
-        return False
+        return Skip(False)
 
     finally:
         session.close()
 
-# to verify the user and password
-def verify_volunteer(email=None, password=None):
+# to log a volunteer in, returns the volunteer id or None
+def authenticate_volunteer(email=None, password=None):
     if not email:
-        print("verify_volunteer caused error: Provide email or phone to login.")
-        return False
+        print("authenticate_volunteer caused error: Provide email or phone to login.")
+        return None
 
     if not password:
-        print("verify_volunteer caused error: Password is required.")
-        return False
+        print("authenticate_volunteer caused error: Password is required.")
+        return None
 
     session = SessionLocal()
     try:
         # Check if identifier is email or phone
-        user = session.query(Volunteers).filter(
-            (Citizens.email == email)
+        user = session.query(Volunteers.id, Volunteers.password).filter(
+            (Volunteers.email == email)
         ).first()
 
         if not user:
-            print("verify_volunteer caused error: User not found.")
-            return False
+            print("authenticate_volunteer caused error: User not found.")
+            return None
 
         # Verify password
-        if user.password != password:
-            print("verify_volunteer caused error: Incorrect password.")
-            return False
+        if not _password_matches(session, Volunteers, user.id, user.password, password):
+            print("authenticate_volunteer caused error: Incorrect password.")
+            return None
 
-        print("Login successful!")
-        return True
+        return user.id
 
     except Exception as e:
-        print(f"verify_volunteer caused error: {e}")
-        return False
+        print(f"authenticate_volunteer caused error: {e}")
+        return None
 
     finally:
         session.close()
 
+# to verify the user and password
+def verify_volunteer(email=None, password=None):
+    return authenticate_volunteer(email, password) is not None
+
 # to add new volunteer details
 def add_new_volunteer(email=None, password=None, contact=None, at_NGO=None):
     if not email:
@@ -301,9 +334,10 @@ def add_new_volunteer(email=None, password=None, contact=None, at_NGO=None):
                 return
 
         # Create new account
-        user = Employees(email=email, password=password, contact=contact, at_NGO=at_NGO)
+        user = Volunteers(email=email, password=hash_in_pool(password), contact=contact, at_NGO=at_NGO)
         session.add(user)
         session.commit()
+        volunteer_ids.invalidate(email)
 
     except Exception as e:
         session.rollback()
@@ -327,29 +361,27 @@ def check_ngo(name=None):
     if not name:
         print("check_ngo caused error: Provide email or phone to login.")
         return None
-    
+
+    return ngo_ids.get(name, _load_ngo_id)
+
+# to query the ngo id of a name, bypassing the cache
+def _load_ngo_id(name):
     session = SessionLocal()
-    
     try:
-        # Check if identifier is email or phone
-        user = session.query(NGO).filter(
+        user = session.query(NGO.id).filter(
             (NGO.name == name)
         ).first()
-
-        if user:
-            return user.id
-        else:
-            return None
+        return user.id if user else None
 
     except Exception as e:
         print(f"check_ngo caused error: {e}\n")
-        return False
+        return Skip(False)
 
     finally:
         session.close()
 
 # to add new ngo
-def add_new_ngo(name=None, email=None, pincode=None, contact_1=None):
+def add_new_ngo(name=None, email=None, pincode=None, contact_1=None, latitude=None, longitude=None):
     
     if not name:
         print("add_new_ngo caused problem: Name is required.")
@@ -372,9 +404,11 @@ def add_new_ngo(name=None, email=None, pincode=None, contact_1=None):
                 return
 
         # Create new account
-        user = NGO(name=name, email=email, pincode=pincode, contact_1=contact_1)
+        user = NGO(name=name, email=email, pincode=pincode, contact_1=contact_1, latitude=latitude, longitude=longitude)
         session.add(user)
         session.commit()
+        ngo_ids.invalidate(name)
+        ngo_index.register(user.id, latitude, longitude, pincode)
 
     except Exception as e:
         session.rollback()
@@ -395,20 +429,365 @@ def delete_ngo(name=None, password=None):
 
 # to get the id of complaint based on filters
 def get_id(location=None, issue=None, date=None, source=None):
-    pass
+    return [report['id'] for report in iter_uploads(location=location, issue=issue, date=date, source=source)]
+
+# to merge sql rows with their mongo documents and uploader emails
+# costs one mongo query and one citizens query no matter how many rows
+def build_reports(session, uploads):
+    if not uploads:
+        return []
+
+    mongo_ids = [u.id for u in uploads]
+    mongo_docs = {m.id: m for m in Mongo_Uploads.objects(id__in=mongo_ids)}
+
+    # uploader emails come from the cache, only the ones not seen recently are queried
+    emails = citizen_emails.get_many(
+        [u.uploader_id for u in uploads],
+        lambda ids: dict(session.query(Citizens.id, Citizens.email).filter(Citizens.id.in_(ids)).all()),
+    )
+
+    reports = []
+    for u in uploads:
+        mongo = mongo_docs.get(u.id)
+        reports.append({
+            'id': u.id,
+            'uploader_id': u.uploader_id,
+            'uploader': emails.get(u.uploader_id),
+            'category': mongo.issue_category if mongo else None,
+            'status': 'verified' if u.issue_nearby_uploader else 'unverified',
+            'description': mongo.description if mongo else None,
+            'image_path': mongo.image_path if mongo else None,
+            'video_path': mongo.video_path if mongo else None,
+            'latitude': float(u.issue_latitude) if u.issue_latitude is not None else None,
+            'longitude': float(u.issue_longitude) if u.issue_longitude is not None else None
+        })
+    return reports
+
+# to turn the last row of a page into an opaque keyset cursor
+def encode_cursor(upload):
+    issue_date = upload.issue_date.isoformat() if upload.issue_date else ''
+    raw = f"{issue_date}|{upload.id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+# to read a cursor back into (issue_date, id), raises ValueError when malformed
+def decode_cursor(cursor):
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        issue_date, upload_id = raw.split('|', 1)
+    except Exception:
+        raise ValueError("Invalid cursor")
+    if not upload_id.isdigit():
+        raise ValueError("Invalid cursor")
+    return (datetime.date.fromisoformat(issue_date) if issue_date else None, int(upload_id))
+
+# to build the filtered uploads query, newest first
+# rows are ordered by (issue_date, id) descending so a cursor can seek past them,
+# null issue dates sort after every real date
+def filter_uploads(session, location=None, date=None, date_from=None, date_to=None, source=None, verified=None, uploader_id=None, after=None):
+    query = session.query(Uploads)
+    if location:
+        query = query.filter(Uploads.uploaders_pincode == location)
+    if date:
+        query = query.filter(Uploads.issue_date == date)
+    if date_from:
+        query = query.filter(Uploads.issue_date >= date_from)
+    if date_to:
+        query = query.filter(Uploads.issue_date <= date_to)
+    if source:
+        # resolve the uploader first (cached) so the index on uploader_id is used,
+        # an unknown source becomes uploader_id IS NULL and matches nothing
+        query = query.filter(Uploads.uploader_id == (check_user(source) or None))
+    if verified is not None:
+        query = query.filter(Uploads.issue_nearby_uploader == verified)
+    if uploader_id is not None:
+        query = query.filter(Uploads.uploader_id == int(uploader_id))
+
+    if after:
+        after_date, after_id = after
+        if after_date is None:
+            query = query.filter(Uploads.issue_date.is_(None), Uploads.id < after_id)
+        else:
+            query = query.filter(or_(
+                Uploads.issue_date < after_date,
+                and_(Uploads.issue_date == after_date, Uploads.id < after_id),
+                Uploads.issue_date.is_(None),
+            ))
+
+    return query.order_by(Uploads.issue_date.desc(), Uploads.id.desc())
+
+# to build the query for complaints inside a bounding box
+# scans one geohash prefix range per covering cell, then trims to the exact box;
+# the ranges are written as >= / < ('~' sorts after every geohash character)
+# because LIKE 'prefix%' cannot use the index on every database
+def filter_bbox(session, min_lat, min_lon, max_lat, max_lon, verified=None):
+    prefixes = geo.cover(min_lat, min_lon, max_lat, max_lon)
+    query = session.query(Uploads).filter(
+        or_(*[and_(Uploads.issue_geohash >= prefix, Uploads.issue_geohash < prefix + '~') for prefix in prefixes]),
+        Uploads.issue_latitude.between(min_lat, max_lat),
+        Uploads.issue_longitude.between(min_lon, max_lon),
+    )
+    if verified is not None:
+        query = query.filter(Uploads.issue_nearby_uploader == verified)
+    return query
+
+# to get complaints inside a bounding box, at most limit of them
+def get_uploads_in_bbox(min_lat, min_lon, max_lat, max_lon, verified=None, limit=500):
+    session = SessionLocal()
+    try:
+        query = filter_bbox(session, min_lat, min_lon, max_lat, max_lon, verified=verified)
+        return build_reports(session, query.limit(limit).all())
+
+    finally:
+        session.close()
+
+# to get complaints within radius_km of a point, nearest first
+# geohash cells are read nearest first, ids and coordinates only and at most
+# NEAR_CELL_ROWS per query (a denser cell is split into its 32 children), and
+# the walk stops once the next cell is farther than the limit-th closest report,
+# so the work follows `limit`, not how many reports the radius holds
+def get_uploads_near(lat, lon, radius_km, verified=None, limit=500):
+    session = SessionLocal()
+    try:
+        cells = [
+            (geo.distance_to_cell_km(lat, lon, prefix), prefix)
+            for prefix in geo.cover(*geo.bbox_around(lat, lon, radius_km))
+        ]
+        heapq.heapify(cells)
+        nearest = []  # max-heap of (-distance, id), the limit closest so far
+        while cells:
+            cell_distance, prefix = heapq.heappop(cells)
+            if cell_distance > radius_km or (len(nearest) == limit and cell_distance > -nearest[0][0]):
+                break
+            query = session.query(Uploads.id, Uploads.issue_latitude, Uploads.issue_longitude).filter(
+                Uploads.issue_geohash >= prefix, Uploads.issue_geohash < prefix + '~',
+            )
+            if verified is not None:
+                query = query.filter(Uploads.issue_nearby_uploader == verified)
+            rows = query.limit(NEAR_CELL_ROWS + 1).all()
+            if len(rows) > NEAR_CELL_ROWS and len(prefix) < geo.PRECISION:
+                for child in geo.children(prefix):
+                    heapq.heappush(cells, (geo.distance_to_cell_km(lat, lon, child), child))
+                continue
+            for upload_id, upload_lat, upload_lon in rows:
+                distance = geo.haversine_km(lat, lon, float(upload_lat), float(upload_lon))
+                if distance > radius_km:
+                    continue
+                if len(nearest) < limit:
+                    heapq.heappush(nearest, (-distance, upload_id))
+                elif distance < -nearest[0][0]:
+                    heapq.heapreplace(nearest, (-distance, upload_id))
+
+        distances = {upload_id: -negative for negative, upload_id in nearest}
+        uploads = session.query(Uploads).filter(Uploads.id.in_(list(distances))).all() if distances else []
+        reports = build_reports(session, uploads)
+        for report in reports:
+            report['distance_km'] = round(distances[report['id']], 3)
+        reports.sort(key=lambda report: report['distance_km'])
+        return reports
+
+    finally:
+        session.close()
+
+# to read report ids sent as numbers or strings, returns {id as sent: int id or None}
+# in request order without duplicates; ids that are not numbers can never be found
+def _parse_report_ids(ids):
+    parsed = {}
+    for report_id in ids:
+        key = str(report_id)
+        parsed[key] = int(key) if key.isdigit() else None
+    return parsed
+
+# to verify several complaints at once, returns {id: 'approved' | 'already_verified' | 'not_found'}
+# one UPDATE ... WHERE id IN (...) plus one batch of outbox rows, in a single transaction
+def approve_uploads(ids):
+    parsed = _parse_report_ids(ids)
+    ids = [i for i in dict.fromkeys(parsed.values()) if i is not None]
+    session = SessionLocal()
+    try:
+        current = dict(
+            session.query(Uploads.id, Uploads.issue_nearby_uploader).filter(Uploads.id.in_(ids)).all()
+        ) if ids else {}
+        to_approve = [upload_id for upload_id, verified in current.items() if not verified]
+        if to_approve:
+            session.query(Uploads).filter(Uploads.id.in_(to_approve)).update(
+                {Uploads.issue_nearby_uploader: True}, synchronize_session=False
+            )
+            outbox.enqueue_many(session, to_approve, 'update', {'status': 'verified'})
+        session.commit()
+        outbox.notify()
+
+        results = {}
+        for key, upload_id in parsed.items():
+            if upload_id not in current:
+                results[key] = 'not_found'
+            elif current[upload_id]:
+                results[key] = 'already_verified'
+            else:
+                results[key] = 'approved'
+        return results
+
+    except Exception as e:
+        session.rollback()
+        print(f"approve_uploads caused problem: {e}")
+        raise
+
+    finally:
+        session.close()
+
+# to reject (delete) several complaints at once, returns {id: 'rejected' | 'kept_verified' | 'not_found'}
+# one DELETE ... WHERE id IN (...) plus one batch of outbox rows, in a single transaction;
+# the mongo delete is queued even for ids missing in sql so stray documents go too.
+# keep_verified leaves verified reports alone, a cluster reject must not undo an approval
+def reject_uploads(ids, keep_verified=False):
+    parsed = _parse_report_ids(ids)
+    ids = [i for i in dict.fromkeys(parsed.values()) if i is not None]
+    session = SessionLocal()
+    try:
+        # the rows stay locked until the commit, so a report approved meanwhile is not deleted
+        current = dict(
+            session.query(Uploads.id, Uploads.issue_nearby_uploader).filter(Uploads.id.in_(ids)).with_for_update()
+        ) if ids else {}
+        kept = {upload_id for upload_id, verified in current.items() if verified} if keep_verified else set()
+        found = set(current) - kept
+        if found:
+            session.query(Uploads).filter(Uploads.id.in_(found)).delete(synchronize_session=False)
+        outbox.enqueue_many(session, [i for i in ids if i not in kept], 'delete')
+        session.commit()
+        outbox.notify()
+        if found:
+            search.remove_reports(found)
+        return {
+            key: 'kept_verified' if upload_id in kept else 'rejected' if upload_id in found else 'not_found'
+            for key, upload_id in parsed.items()
+        }
+
+    except Exception as e:
+        session.rollback()
+        print(f"reject_uploads caused problem: {e}")
+        raise
+
+    finally:
+        session.close()
+
+# to get the incident clusters with the most unverified reports
+def get_clusters(limit=50):
+    pipeline = [
+        {'$match': {'cluster_id': {'$ne': None}, 'status': {'$ne': 'verified'}}},
+        {'$group': {
+            '_id': '$cluster_id',
+            'reports': {'$sum': 1},
+            'category': {'$first': '$issue_category'},
+            'description': {'$first': '$description'},
+        }},
+        {'$sort': {'reports': -1}},
+        {'$limit': limit},
+    ]
+    clusters = list(Mongo_Uploads._get_collection().aggregate(pipeline))
+    session = SessionLocal()
+    try:
+        posts = dict(
+            session.query(SocialPost.cluster_id, func.count(SocialPost.id))
+            .filter(SocialPost.cluster_id.in_([c['_id'] for c in clusters]))
+            .group_by(SocialPost.cluster_id)
+            .all()
+        )
+    finally:
+        session.close()
+    return [
+        {
+            'id': c['_id'],
+            'reports': c['reports'],
+            'social_posts': posts.get(c['_id'], 0),
+            'category': c['category'],
+            'description': c['description'],
+        }
+        for c in clusters
+    ]
+
+# to get the ids of the reports in a cluster
+def get_cluster_report_ids(cluster_id):
+    return list(Mongo_Uploads.objects(cluster_id=cluster_id).scalar('id'))
+
+# to get the reports and social posts in a cluster
+def get_cluster(cluster_id, post_limit=100):
+    session = SessionLocal()
+    try:
+        ids = get_cluster_report_ids(cluster_id)
+        uploads = session.query(Uploads).filter(Uploads.id.in_(ids)).all() if ids else []
+        posts = (
+            session.query(SocialPost)
+            .filter(SocialPost.cluster_id == cluster_id)
+            .order_by(SocialPost.id.desc())
+            .limit(post_limit)
+            .all()
+        )
+        return {
+            'id': cluster_id,
+            'reports': build_reports(session, uploads),
+            'social_posts': [
+                {'id': p.id, 'platform': p.platform, 'content': p.content, 'username': p.username, 'timestamp': p.timestamp}
+                for p in posts
+            ],
+        }
+
+    finally:
+        session.close()
 
 # to get all complaints
 def get_all_uploads():
     '''
     this will return sql and mongo objects
     '''
-    pass
+    return get_uploads()
 
 # to get specified complaints
-def get_uploads(location=None, issue=None, date=None, source=None):
+# issue is matched against the mongo category, everything else is filtered in sql
+def get_uploads(location=None, issue=None, date=None, source=None, verified=None, uploader_id=None, date_from=None, date_to=None):
     '''
     this will return sql and mongo objects'''
-    pass
+    return list(iter_uploads(location=location, issue=issue, date=date, source=source, verified=verified, uploader_id=uploader_id, date_from=date_from, date_to=date_to))
+
+# to get one page of complaints after a cursor, returns (reports, next_cursor)
+# next_cursor is None once the last page has been read
+def get_uploads_page(limit=50, after=None, issue=None, **filters):
+    session = SessionLocal()
+    try:
+        reports = []
+        while True:
+            rows = filter_uploads(session, after=after, **filters).limit(limit).all()
+            for row, report in zip(rows, build_reports(session, rows)):
+                if issue and report['category'] != issue:
+                    continue
+                reports.append(report)
+                if len(reports) == limit:
+                    return reports, encode_cursor(row)
+            if len(rows) < limit:
+                return reports, None
+            after = (rows[-1].issue_date, rows[-1].id)
+
+    finally:
+        session.close()
+
+# to stream complaints off a server-side cursor in batches of batch_size
+# only one batch of rows and documents is held in memory at a time
+def iter_uploads(issue=None, batch_size=500, **filters):
+    session = SessionLocal()
+    lookup_session = SessionLocal()
+    try:
+        query = filter_uploads(session, **filters).execution_options(stream_results=True).yield_per(batch_size)
+        rows = iter(query)
+        while True:
+            batch = list(itertools.islice(rows, batch_size))
+            if not batch:
+                break
+            for report in build_reports(lookup_session, batch):
+                if issue and report['category'] != issue:
+                    continue
+                yield report
+
+    finally:
+        lookup_session.close()
+        session.close()
 
 def new_uploads(id=None, uploader=None, issue_date=None, issue_location=None, issue_longitude=None, issue_nearby_uploader=None, nearby_NGO=None, image_path=None, video_path=None, issue_category=None, issue_predicted_category=None, uploader_date=None, uploader_pincode=None):
     
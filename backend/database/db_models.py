@@ -1,7 +1,8 @@
-from sqlalchemy import Column, Integer, String, Numeric, Boolean, Date, ForeignKey
+from datetime import datetime
+from sqlalchemy import Column, Integer, String, Numeric, Boolean, Date, DateTime, Text, ForeignKey, Index
 from sqlalchemy.orm import relationship
 from database.connect import Base
-from mongoengine import Document, StringField, ListField, IntField
+from mongoengine import Document, StringField, ListField, IntField, FloatField, DateTimeField, DynamicField
 
 # ------------------ SQL ------------------
 
@@ -43,6 +44,8 @@ class NGO(Base):
     email = Column(String(30), nullable=True)
     pincode = Column(String(6), nullable=False)
     contact_1 = Column(String(14), nullable=False)
+    latitude = Column(Numeric(10, 8), nullable=True)
+    longitude = Column(Numeric(11, 8), nullable=True)
 
     # Relationships
     volunteers = relationship('Volunteers', back_populates='ngo')
@@ -52,11 +55,12 @@ class NGO(Base):
 class Uploads(Base):
     __tablename__ = 'uploads'
 
-    id = Column(String(10), primary_key=True)
+    id = Column(Integer, primary_key=True, autoincrement=False)  # Same as Mongo_Uploads.id, from database.ids
     uploader_id = Column(Integer, ForeignKey('citizens.id'), nullable=False)  # Reference Citizens
     issue_date = Column(Date, nullable=True)
     issue_latitude = Column(Numeric(10, 8), nullable=True)
     issue_longitude = Column(Numeric(11, 8), nullable=True)
+    issue_geohash = Column(String(9), nullable=True, index=True)  # Geohash of the location, for area queries
     issue_nearby_uploader = Column(Boolean, nullable=False)
     uploader_date = Column(Date, nullable=False)
     uploaders_pincode = Column(String(6), nullable=False)
@@ -67,6 +71,15 @@ class Uploads(Base):
     ngo = relationship('NGO', back_populates='uploads')
     uploader = relationship('Citizens')
 
+    # listings filter on one of these columns and order by (issue_date, id) desc,
+    # so each index serves both the filter and the order (see database.explain)
+    __table_args__ = (
+        Index('ix_uploads_date', 'issue_date', 'id'),
+        Index('ix_uploads_verified_date', 'issue_nearby_uploader', 'issue_date', 'id'),
+        Index('ix_uploads_uploader_date', 'uploader_id', 'issue_date', 'id'),
+        Index('ix_uploads_pincode_date', 'uploaders_pincode', 'issue_date', 'id'),
+    )
+
 
 # ------------------ Social Media Posts (SQL) ------------------
 
@@ -77,6 +90,61 @@ class SocialPost(Base):
     content = Column(String(1000), nullable=False)
     username = Column(String(255), nullable=True)
     timestamp = Column(String(100), nullable=True)
+    external_id = Column(String(100), nullable=True)  # Id on the platform, or a content hash when it has none
+    predicted_category = Column(String(20), nullable=True)  # Set by AI.classifier
+    cluster_id = Column(Integer, nullable=True, index=True)  # Incident cluster from AI.clustering
+
+    __table_args__ = (
+        Index('ux_social_posts_platform_external', 'platform', 'external_id', unique=True),
+    )
+
+# ------------------ Social ingestion jobs (SQL) ------------------
+
+class IngestJobs(Base):
+    __tablename__ = 'ingest_jobs'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    status = Column(String(10), nullable=False, default='queued')  # queued, running, done, failed
+    trigger = Column(String(10), nullable=False, default='manual')  # manual or schedule
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+    tweets = Column(Integer, nullable=True)
+    youtube_comments = Column(Integer, nullable=True)
+    stored = Column(Integer, nullable=True)
+    error = Column(Text, nullable=True)
+
+    __table_args__ = (
+        Index('ix_ingest_jobs_status', 'status', 'id'),
+    )
+
+
+class IngestCursors(Base):
+    __tablename__ = 'ingest_cursors'
+
+    source = Column(String(50), primary_key=True)  # e.g. 'twitter_since_id'
+    value = Column(String(100), nullable=True)
+    updated_at = Column(DateTime, nullable=False, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+# ------------------ Outbox (SQL) ------------------
+
+class Outbox(Base):
+    __tablename__ = 'outbox'
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    report_id = Column(Integer, nullable=False)  # Same as Uploads.id / Mongo_Uploads.id
+    action = Column(String(10), nullable=False)  # 'upsert', 'update' (existing documents only) or 'delete'
+    payload = Column(Text, nullable=True)  # JSON of the Mongo_Uploads fields to set
+    created_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    processed_at = Column(DateTime, nullable=True)  # Set once the relay applied it to MongoDB
+    attempts = Column(Integer, nullable=False, default=0)
+    counter_change = Column(Text, nullable=True)  # JSON of the overview counter changes, recorded before the first Mongo write
+    failed_at = Column(DateTime, nullable=True)  # Set when the relay gave up on it after MAX_ATTEMPTS (dead letter)
+
+    __table_args__ = (
+        Index('ix_outbox_pending', 'processed_at', 'id'),
+        Index('ix_outbox_report', 'report_id', 'id'),
+    )
 
 # ------------------ MongoDB ------------------
 
@@ -87,3 +155,57 @@ class Mongo_Uploads(Document):
     description = StringField(max_length=600)
     issue_category = StringField(required=False)
     issue_predicted_category = ListField(StringField(), required=True)
+    status = StringField(default='unverified')  # Mirrors Uploads.issue_nearby_uploader
+    cluster_id = IntField()  # Incident cluster from AI.clustering
+
+    meta = {'indexes': ['cluster_id', 'issue_category'], 'auto_create_index': False}  # created by python -m database.migrate
+
+
+class Mongo_ClusterItems(Document):
+    id = StringField(primary_key=True)  # 'report:<id>' or 'post:<platform>:<external_id>'
+    signature = ListField(IntField())  # MinHash signature from AI.clustering
+    bands = ListField(StringField())  # '<band>:<hash>' LSH buckets, items sharing one are compared
+    cluster_id = IntField()
+    latitude = FloatField()
+    longitude = FloatField()
+    when = DateTimeField()
+    expires_at = DateTimeField()  # End of the clustering window, MongoDB's TTL monitor deletes the item after this
+
+    meta = {
+        'indexes': ['bands', {'fields': ['expires_at'], 'expireAfterSeconds': 0}],
+        'auto_create_index': False,
+    }
+
+
+class Mongo_Counters(Document):
+    id = StringField(primary_key=True)  # Counter name, e.g. 'uploads'
+    value = IntField(default=0)  # Highest value handed out so far
+
+
+class Mongo_Leases(Document):
+    id = StringField(primary_key=True)  # Name of the work, e.g. 'outbox-relay'
+    owner = StringField()  # host:pid:token of the process holding it
+    expires_at = DateTimeField()  # Anyone may take it over after this
+
+
+class Mongo_Overview(Document):
+    id = StringField(primary_key=True)  # 'category:<issue_category>' or 'status:<status>'
+    value = IntField(default=0)  # Number of reports in that bucket
+
+
+class Mongo_Cache(Document):
+    id = StringField(primary_key=True)  # '<cache name>:<key>'
+    value = DynamicField()  # Cached lookup result, None for a cached miss
+    expires_at = DateTimeField()  # MongoDB's TTL monitor deletes the entry after this
+
+    meta = {'indexes': [{'fields': ['expires_at'], 'expireAfterSeconds': 0}], 'auto_create_index': False}
+
+
+class Mongo_Events(Document):
+    id = IntField(primary_key=True)  # Sequence number from Mongo_Counters 'events', also the SSE event id
+    type = StringField(required=True)  # e.g. 'report.created', 'social.stored'
+    data = DynamicField()  # Small payload; clients refetch the details they need
+    created_at = DateTimeField(default=datetime.utcnow)
+
+    # capped: old events fall off on their own, clients further behind get a reset
+    meta = {'max_documents': 10000, 'max_size': 8 * 1024 * 1024}
@@ -0,0 +1,71 @@
+import sys
+from datetime import datetime
+from pymongo import ReturnDocument
+from database.db_models import Mongo_Counters, Mongo_Events
+
+
+'''
+Change events for live clients (see web.live).
+
+Writers call publish() once readers can see the change; report events come
+from the outbox relay after MongoDB and the 'reports' version show them.
+Every event gets the next number of one global sequence ('events' in
+Mongo_Counters) and is appended to Mongo_Events, a capped collection, so all
+server processes see the same ordered stream and a client can resume from
+the last id it saw. Publishing is best effort: a failure is logged and never
+undoes the write it describes.
+'''
+
+READ_LIMIT = 500
+
+# in-process callbacks run after each publish, web.live uses one to wake its tailer
+_listeners = []
+
+
+# to append an event, returns its id (None when it could not be stored)
+def publish(type, data=None):
+    try:
+        seq = Mongo_Counters._get_collection().find_one_and_update(
+            {'_id': 'events'}, {'$inc': {'value': 1}}, upsert=True, return_document=ReturnDocument.AFTER,
+        )['value']
+        Mongo_Events._get_collection().insert_one(
+            {'_id': seq, 'type': type, 'data': data, 'created_at': datetime.utcnow()}
+        )
+    except Exception as e:
+        print(f"publish caused problem: {e}")
+        return None
+    for listener in _listeners:
+        listener()
+    return seq
+
+# to get the events after `after` in id order, as dicts with _id, type and data
+def read_since(after, limit=READ_LIMIT):
+    return list(
+        Mongo_Events._get_collection().find({'_id': {'$gt': after}}, {'created_at': 0}).sort('_id', 1).limit(limit)
+    )
+
+# to get the id of the newest stored event, 0 when there is none
+def latest_id():
+    doc = Mongo_Events._get_collection().find_one({}, {'_id': 1}, sort=[('_id', -1)])
+    return doc['_id'] if doc else 0
+
+# to get the id of the oldest event still kept by the capped collection
+def oldest_id():
+    doc = Mongo_Events._get_collection().find_one({}, {'_id': 1}, sort=[('_id', 1)])
+    return doc['_id'] if doc else None
+
+def add_listener(callback):
+    if callback not in _listeners:
+        _listeners.append(callback)
+
+
+# usage: python -m database.events tail [after id]
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'tail'
+    if command == 'tail':
+        after = int(sys.argv[2]) if len(sys.argv) > 2 else max(latest_id() - 20, 0)
+        for event in read_since(after):
+            print(f"{event['_id']} {event['type']} {event.get('data')}")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
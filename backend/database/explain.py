@@ -0,0 +1,189 @@
+import datetime
+import re
+import sys
+from sqlalchemy import Table
+from sqlalchemy.sql import visitors
+from sqlalchemy.sql.expression import ColumnClause
+from database.connect import Base, SessionLocal
+from database.crud import filter_uploads, filter_bbox, citizen_query
+from database.db_models import Citizens, Uploads, Outbox, SocialPost, Mongo_Uploads, Mongo_Events, Mongo_ClusterItems
+
+
+'''
+Query plan check for the hot queries.
+
+Runs EXPLAIN on the SQL the endpoints actually send (built with the same
+query functions) and on the main MongoDB finds, and fails when any of them
+reads a whole table or collection. Run it against a migrated database after
+changing a query or an index:
+
+    python -m database.explain
+
+Small tables make planners prefer scans even when an index exists, so the
+check first tells the planner to favour indexes (enable_seqscan = off on
+PostgreSQL, max_seeks_for_key = 1 on MySQL). What is left as a scan has no
+usable index. A full read of an index (MySQL type=index, SQLite SCAN ...
+USING INDEX) passes only where it can stop early: on a filtered table the
+index must start with a filtered column, and an unfiltered listing must read
+it in ORDER BY order up to its LIMIT without a sort step. A pincode filter
+that walks ix_uploads_date and throws rows away is a full scan. Mongo finds
+that cannot be explained (e.g. on a mock server) are reported as skipped.
+'''
+
+PAGE = 50
+
+
+# (name, function of a session returning a Query), mirrors crud and app
+def _sql_queries():
+    day = datetime.date(2025, 1, 1)
+    return [
+        ('reports page', lambda s: filter_uploads(s).limit(PAGE)),
+        ('reports next page', lambda s: filter_uploads(s, after=(day, 1000)).limit(PAGE)),
+        ('reports by status', lambda s: filter_uploads(s, verified=False).limit(PAGE)),
+        ('reports by status, next page', lambda s: filter_uploads(s, verified=False, after=(day, 1000)).limit(PAGE)),
+        ('reports by uploader', lambda s: filter_uploads(s, uploader_id=1).limit(PAGE)),
+        ('reports by date range', lambda s: filter_uploads(s, date_from=day, date_to=day).limit(PAGE)),
+        ('reports by pincode', lambda s: filter_uploads(s, location='600001').limit(PAGE)),
+        ('reports by ids', lambda s: s.query(Uploads.id, Uploads.issue_nearby_uploader).filter(Uploads.id.in_([1, 2, 3]))),
+        ('reports in map viewport', lambda s: filter_bbox(s, 13.0, 80.2, 13.1, 80.3).limit(500)),
+        ('citizen login', lambda s: citizen_query(s, 'a@b.c', Citizens.id, Citizens.password)),
+        ('citizen emails', lambda s: s.query(Citizens.id, Citizens.email).filter(Citizens.id.in_([1, 2, 3]))),
+        ('outbox pending', lambda s: s.query(Outbox).filter(Outbox.processed_at.is_(None), Outbox.failed_at.is_(None)).order_by(Outbox.id).limit(200)),
+        ('social posts', lambda s: s.query(SocialPost).order_by(SocialPost.id.desc()).limit(PAGE)),
+    ]
+
+# (name, collection, filter) for the MongoDB reads
+def _mongo_queries():
+    return [
+        ('report documents', Mongo_Uploads, {'_id': {'$in': [1, 2, 3]}}),
+        ('reports by category', Mongo_Uploads, {'issue_category': 'Flooding'}),
+        ('reports in cluster', Mongo_Uploads, {'cluster_id': 1}),
+        ('live events', Mongo_Events, {'_id': {'$gt': 0}}),
+        ('cluster candidates', Mongo_ClusterItems, {'bands': {'$in': ['0:00000000', '1:00000000']}}),
+    ]
+
+
+# to get the leading column of every index, {(table, index name): column}
+def _leading_columns():
+    leading = {}
+    for table in Base.metadata.tables.values():
+        for index in table.indexes:
+            leading[(table.name, index.name)] = list(index.columns)[0].name
+        for column in table.columns:
+            leading[(table.name, column.name)] = column.name  # mysql names an unnamed unique key after its column
+        primary = list(table.primary_key.columns)
+        if primary:
+            leading[(table.name, 'PRIMARY')] = leading[(table.name, None)] = primary[0].name
+    return leading
+
+# to get the columns the WHERE clause filters each table on, {table: {columns}}
+def _filtered_columns(statement):
+    filtered = {}
+    for select in getattr(statement, 'selects', [statement]):
+        if select.whereclause is None:
+            continue
+        for element in visitors.iterate(select.whereclause):
+            if isinstance(element, ColumnClause) and isinstance(element.table, Table):
+                filtered.setdefault(element.table.name, set()).add(element.name)
+    return filtered
+
+# to tell whether reading all of `table` (through `index`, None for table order) is a full scan:
+# a filtered table must be read through an index that starts with a filtered column, an
+# unfiltered one only in index order up to a LIMIT, with no sort step
+def _is_full_scan(table, index, filtered, listing, leading):
+    if table in filtered:
+        return index is None or leading.get((table, index)) not in filtered[table]
+    return not listing
+
+# to get the plan of one statement as text lines, and the lines that are full scans
+def _plan(conn, statement):
+    dialect = conn.dialect.name
+    compiled = statement.compile(dialect=conn.dialect, compile_kwargs={'render_postcompile': True})
+    params = compiled.params
+    if compiled.positional:
+        params = tuple(params[name] for name in compiled.positiontup)
+    tables = set(Base.metadata.tables)
+    filtered = _filtered_columns(statement)
+    sql = str(compiled)
+    ordered_limit = ' ORDER BY ' in sql and ' LIMIT ' in sql
+
+    if dialect == 'sqlite':
+        rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).all()
+        lines = [row[3] for row in rows]
+        listing = ordered_limit and not any('TEMP B-TREE' in line for line in lines)
+        reads = [
+            (line, match.group(1), match.group(2)) for line in lines
+            for match in [re.fullmatch(r'SCAN (?:TABLE )?(\w+)(?: USING (?:COVERING )?INDEX (\w+))?', line)] if match
+        ]
+    elif dialect in ('mysql', 'mariadb'):
+        rows = conn.exec_driver_sql(f"EXPLAIN {compiled}", params).mappings().all()
+        lines = [f"{row['table']}: {row['type']} key={row['key']} {row['Extra'] or ''}" for row in rows]
+        listing = ordered_limit and not any('filesort' in (row['Extra'] or '') for row in rows)
+        reads = [
+            (line, row['table'], row['key'] if row['type'] == 'index' else None)
+            for line, row in zip(lines, rows) if row['type'] in ('ALL', 'index')
+        ]
+    elif dialect == 'postgresql':
+        lines = [row[0] for row in conn.exec_driver_sql(f"EXPLAIN {compiled}", params).all()]
+        listing = ordered_limit and not any(re.search(r'\bSort\b', line) for line in lines)
+        reads = [
+            (line, match.group(2), match.group(1)) for line in lines
+            for match in [re.search(r'(?:Seq Scan|Index (?:Only )?Scan(?: Backward)? using (\w+)) on (\w+)', line)] if match
+        ]
+    else:
+        return [f"EXPLAIN is not supported for {dialect}"], []
+    leading = _leading_columns()
+    scans = [line for line, table, index in reads if table in tables and _is_full_scan(table, index, filtered, listing, leading)]
+    return lines, scans
+
+def _prefer_indexes(conn):
+    if conn.dialect.name in ('mysql', 'mariadb'):
+        conn.exec_driver_sql("SET SESSION max_seeks_for_key = 1")
+    elif conn.dialect.name == 'postgresql':
+        conn.exec_driver_sql("SET enable_seqscan = off")
+
+# to get the winning plan stages of a MongoDB find
+def _mongo_stages(document, query):
+    plan = document._get_collection().find(query).explain()['queryPlanner']['winningPlan']
+    stages = []
+    while plan:
+        stages.append(plan.get('stage'))
+        plan = plan.get('inputStage') or (plan.get('inputStages') or [None])[0]
+    return stages
+
+# to explain every hot query, returns [(name, plan lines, full scan lines)]
+# full scan lines is None when the query could not be explained;
+# bind checks another SQL engine, mongo=False leaves the MongoDB finds out
+def check(bind=None, mongo=True):
+    results = []
+    session = SessionLocal(bind=bind) if bind is not None else SessionLocal()
+    try:
+        conn = session.connection()
+        _prefer_indexes(conn)
+        for name, build in _sql_queries():
+            lines, scans = _plan(conn, build(session).statement)
+            results.append((name, lines, scans))
+    finally:
+        session.rollback()
+        session.close()
+
+    for name, document, query in (_mongo_queries() if mongo else []):
+        try:
+            stages = _mongo_stages(document, query)
+        except Exception as e:
+            results.append((name, [f"explain caused problem: {e}"], None))
+            continue
+        results.append((name, [' <- '.join(filter(None, stages))], [s for s in stages if s == 'COLLSCAN']))
+    return results
+
+
+# usage: python -m database.explain [-v]
+if __name__ == '__main__':
+    failed = 0
+    for name, lines, scans in check():
+        failed += bool(scans)
+        print(f"{'skipped' if scans is None else 'FULL SCAN' if scans else 'ok':<9} {name}")
+        for line in (lines if '-v' in sys.argv or scans is None else scans):
+            print(f"          {line}")
+    print(f"{failed} of the hot queries read a whole table" if failed else "No hot query reads a whole table")
+    sys.exit(1 if failed else 0)
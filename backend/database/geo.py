@@ -0,0 +1,162 @@
+import math
+import sys
+
+
+'''
+Geohash helpers for the spatial report queries.
+
+Every Uploads row stores the geohash of its location in issue_geohash, which
+has a plain B-tree index. A bounding box is covered by a handful of geohash
+cells, each cell becomes a 'prefix%' range scan on that index, and the few
+rows that fall inside a cell but outside the box are dropped afterwards.
+Radius queries walk the cells nearest first (see crud.get_uploads_near).
+'''
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+PRECISION = 9  # ~5m cells, what issue_geohash stores
+MAX_CELLS = 16  # most prefixes one query is allowed to scan
+EARTH_RADIUS_KM = 6371.0088
+
+
+# to encode a point as a geohash string
+def encode(lat, lon, precision=PRECISION):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    chars = []
+    bits = 0
+    value = 0
+    even = True
+    while len(chars) < precision:
+        rng, coord = (lon_range, lon) if even else (lat_range, lat)
+        mid = (rng[0] + rng[1]) / 2
+        if coord >= mid:
+            value = (value << 1) | 1
+            rng[0] = mid
+        else:
+            value <<= 1
+            rng[1] = mid
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits = 0
+            value = 0
+    return ''.join(chars)
+
+# to get the (min_lat, min_lon, max_lat, max_lon) of a geohash cell
+def bounds(prefix):
+    lat_range = [-90.0, 90.0]
+    lon_range = [-180.0, 180.0]
+    even = True
+    for char in prefix:
+        value = BASE32.index(char)
+        for shift in range(4, -1, -1):
+            rng = lon_range if even else lat_range
+            mid = (rng[0] + rng[1]) / 2
+            if value >> shift & 1:
+                rng[0] = mid
+            else:
+                rng[1] = mid
+            even = not even
+    return lat_range[0], lon_range[0], lat_range[1], lon_range[1]
+
+# to get the 32 cells one level below a geohash cell
+def children(prefix):
+    return [prefix + char for char in BASE32]
+
+# to get the distance in km from a point to the nearest point of a geohash cell, 0 inside it
+def distance_to_cell_km(lat, lon, prefix):
+    min_lat, min_lon, max_lat, max_lon = bounds(prefix)
+    return haversine_km(lat, lon, min(max(lat, min_lat), max_lat), min(max(lon, min_lon), max_lon))
+
+# to get the (height, width) in degrees of a cell at the given precision
+def cell_size(precision):
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 // 2
+    return 180.0 / (1 << lat_bits), 360.0 / (1 << lon_bits)
+
+# to get the geohash prefixes that together cover a bounding box
+def cover(min_lat, min_lon, max_lat, max_lon, max_cells=MAX_CELLS):
+    precision = 1
+    for p in range(PRECISION, 0, -1):
+        height, width = cell_size(p)
+        cells = (math.floor((max_lat - min_lat) / height) + 2) * (math.floor((max_lon - min_lon) / width) + 2)
+        if cells <= max_cells:
+            precision = p
+            break
+
+    height, width = cell_size(precision)
+    prefixes = set()
+    lat = min_lat
+    while True:
+        lon = min_lon
+        while True:
+            prefixes.add(encode(min(lat, max_lat), min(lon, max_lon), precision))
+            if lon >= max_lon:
+                break
+            lon += width
+        if lat >= max_lat:
+            break
+        lat += height
+    return sorted(prefixes)
+
+# to get the great-circle distance between two points in km
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlambda = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlambda / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+# to get the bounding box (min_lat, min_lon, max_lat, max_lon) around a circle
+def bbox_around(lat, lon, radius_km):
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    coslat = math.cos(math.radians(lat))
+    dlon = 180.0 if coslat < 1e-9 else min(180.0, dlat / coslat)
+    return (
+        max(-90.0, lat - dlat),
+        max(-180.0, lon - dlon),
+        min(90.0, lat + dlat),
+        min(180.0, lon + dlon),
+    )
+
+# to fill issue_geohash for uploads stored before the column existed
+def backfill(chunk_size=1000):
+    from database.connect import SessionLocal
+    from database.db_models import Uploads
+
+    session = SessionLocal()
+    updated = 0
+    try:
+        while True:
+            rows = (
+                session.query(Uploads.id, Uploads.issue_latitude, Uploads.issue_longitude)
+                .filter(
+                    Uploads.issue_geohash.is_(None),
+                    Uploads.issue_latitude.isnot(None),
+                    Uploads.issue_longitude.isnot(None),
+                )
+                .limit(chunk_size)
+                .all()
+            )
+            if not rows:
+                break
+            session.bulk_update_mappings(Uploads, [
+                {'id': upload_id, 'issue_geohash': encode(float(lat), float(lon))}
+                for upload_id, lat, lon in rows
+            ])
+            session.commit()
+            updated += len(rows)
+        return updated
+    finally:
+        session.close()
+
+
+# usage: python -m database.geo backfill
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'backfill'
+    if command == 'backfill':
+        print(f"Filled issue_geohash on {backfill()} uploads.")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
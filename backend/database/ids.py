@@ -0,0 +1,69 @@
+import os
+import threading
+from pymongo import ReturnDocument
+from database.db_models import Mongo_Counters, Mongo_Uploads
+
+
+'''
+Id allocation for reports.
+
+Every process reserves a block of ids at once with a single atomic $inc on a
+counters document, then hands them out from memory. Concurrent workers never
+see the same block, so there is no sort on Mongo_Uploads and no duplicate-key
+retry on submission. Ids left over in a block when a process exits are skipped.
+'''
+
+BLOCK_SIZE = int(os.getenv('HARBORNET_ID_BLOCK_SIZE', '50'))
+
+
+class IdAllocator:
+    def __init__(self, name, block_size=BLOCK_SIZE, seed=None):
+        self.name = name
+        self.block_size = block_size
+        self.seed = seed  # returns the highest id already in use, checked once per process
+        self._lock = threading.Lock()
+        self._next = 0
+        self._end = 0
+
+    # to get the next free id, only touches mongo when the local block runs out
+    def next_id(self):
+        with self._lock:
+            if self._next >= self._end:
+                self._reserve()
+            value = self._next
+            self._next += 1
+            return value
+
+    # to drop the local block, e.g. in a forked child that must not reuse the parent's ids
+    def reset(self):
+        with self._lock:
+            self._next = 0
+            self._end = 0
+
+    def _reserve(self):
+        counters = Mongo_Counters._get_collection()
+        if self.seed and not self._end:
+            counters.update_one({'_id': self.name}, {'$max': {'value': self.seed()}}, upsert=True)
+        counter = counters.find_one_and_update(
+            {'_id': self.name},
+            {'$inc': {'value': self.block_size}},
+            upsert=True,
+            return_document=ReturnDocument.AFTER,
+        )
+        self._end = counter['value'] + 1
+        self._next = self._end - self.block_size
+
+
+# to get the highest report id stored before the counter existed
+def _max_report_id():
+    last_report = Mongo_Uploads.objects.order_by('-id').only('id').first()
+    return last_report.id if last_report else 0
+
+
+report_ids = IdAllocator('uploads', seed=_max_report_id)
+
+
+def _reset_after_fork():
+    report_ids.reset()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
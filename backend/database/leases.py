@@ -0,0 +1,70 @@
+import os
+import socket
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from database.db_models import Mongo_Leases
+
+
+'''
+Leases for background work that only one process may do at a time.
+
+Every gunicorn worker starts the same background threads, so work that must
+run in order (the outbox relay) takes a lease first: a Mongo_Leases document
+naming its owner and an expiry, claimed with one conditional upsert. The
+owner renews it on every pass; when its process dies the lease expires and
+another worker takes over. Expiry uses the local clock of each host, keep
+lease times well above the clock skew between hosts.
+
+held() uses a short lease as a lock across processes around a few database
+calls. Threads of one process share its owner, so callers also take a local
+lock.
+'''
+
+
+def _new_owner():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+OWNER = _new_owner()
+
+
+# to take or renew the lease `name` for `seconds`, returns whether this process holds it
+def acquire(name, seconds):
+    now = datetime.utcnow()
+    try:
+        Mongo_Leases._get_collection().update_one(
+            {'_id': name, '$or': [{'owner': OWNER}, {'expires_at': {'$lt': now}}]},
+            {'$set': {'owner': OWNER, 'expires_at': now + timedelta(seconds=seconds)}},
+            upsert=True,
+        )
+        return True
+    except DuplicateKeyError:
+        return False  # the document exists and someone else holds it
+
+# to give the lease up early, e.g. on shutdown, so another process need not wait for it to expire
+def release(name):
+    Mongo_Leases._get_collection().delete_one({'_id': name, 'owner': OWNER})
+
+
+# to hold the lease `name` around a short critical section, waiting up to `wait` seconds
+# raises TimeoutError when another process keeps it that long
+@contextmanager
+def held(name, seconds=5, wait=2):
+    deadline = time.monotonic() + wait
+    while not acquire(name, seconds):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"lease {name} is held by another process")
+        time.sleep(0.005)
+    try:
+        yield
+    finally:
+        release(name)
+
+
+def _reset_after_fork():
+    global OWNER
+    OWNER = _new_owner()  # a forked worker is a different owner than its parent
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,163 @@
+import bisect
+import threading
+import time
+from sqlalchemy import event
+from sqlalchemy.exc import TimeoutError as PoolTimeout
+from sqlalchemy.pool import QueuePool
+from pymongo import monitoring
+
+
+'''
+Connection pool metrics in the Prometheus text format.
+
+The SQL pool is a QueuePool that times every connection request, so the
+histogram shows how long requests waited for a connection (including
+opening a new one). Pool events count checkouts, new connections and
+connections dropped by pre-ping or errors. The MongoDB client reports its
+own checkout durations through a pymongo pool listener.
+
+Gauges (pool size, checked out, overflow) are read from the pool when
+/metrics is scraped. Every value is per process, so a scraper should
+collect each worker.
+'''
+
+WAIT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+class Histogram:
+    def __init__(self, name, help, buckets=WAIT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = buckets
+        self._lock = threading.Lock()
+        self._counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self._sum = 0.0
+        self._count = 0
+
+    def observe(self, value):
+        with self._lock:
+            self._counts[bisect.bisect_left(self.buckets, value)] += 1
+            self._sum += value
+            self._count += 1
+
+    def render(self):
+        with self._lock:
+            counts, total, count = list(self._counts), self._sum, self._count
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        cumulative = 0
+        for bound, bucket in zip(self.buckets, counts):
+            cumulative += bucket
+            lines.append(f'{self.name}_bucket{{le="{bound}"}} {cumulative}')
+        lines.append(f'{self.name}_bucket{{le="+Inf"}} {count}')
+        lines.append(f"{self.name}_sum {total:.6f}")
+        lines.append(f"{self.name}_count {count}")
+        return lines
+
+
+class Counters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = {}  # name -> (help, value)
+
+    def inc(self, name, help, amount=1):
+        with self._lock:
+            _, value = self._values.get(name, (help, 0))
+            self._values[name] = (help, value + amount)
+
+    def render(self):
+        with self._lock:
+            values = dict(self._values)
+        lines = []
+        for name, (help, value) in sorted(values.items()):
+            lines += [f"# HELP {name} {help}", f"# TYPE {name} counter", f"{name} {value}"]
+        return lines
+
+
+sql_wait = Histogram('harbornet_sql_pool_wait_seconds', 'Time spent getting a connection from the SQL pool.')
+mongo_wait = Histogram('harbornet_mongo_pool_wait_seconds', 'Time spent checking a connection out of the MongoDB pool.')
+counters = Counters()
+
+
+# a QueuePool that records how long every connection request waited
+class TimedQueuePool(QueuePool):
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeout:
+            counters.inc('harbornet_sql_pool_timeouts_total', 'Connection requests that gave up after pool_timeout.')
+            raise
+        finally:
+            sql_wait.observe(time.perf_counter() - start)
+
+
+# to count checkouts, new connections and invalidations of an engine's pool
+def instrument_engine(engine):
+    @event.listens_for(engine, 'checkout')
+    def _checkout(dbapi_connection, connection_record, connection_proxy):
+        counters.inc('harbornet_sql_pool_checkouts_total', 'Connections handed out by the SQL pool.')
+
+    @event.listens_for(engine, 'connect')
+    def _connect(dbapi_connection, connection_record):
+        counters.inc('harbornet_sql_pool_connects_total', 'New connections opened to the SQL server.')
+
+    @event.listens_for(engine, 'invalidate')
+    def _invalidate(dbapi_connection, connection_record, exception):
+        counters.inc('harbornet_sql_pool_invalidations_total', 'SQL connections dropped as stale or broken.')
+
+
+class MongoPoolListener(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked_out = 0
+
+    def connection_checked_out(self, event):
+        with self._lock:
+            self.checked_out += 1
+        if getattr(event, 'duration', None) is not None:
+            mongo_wait.observe(event.duration)
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def connection_check_out_failed(self, event):
+        counters.inc('harbornet_mongo_pool_checkout_failures_total', 'MongoDB connection checkouts that failed.')
+
+    def connection_created(self, event):
+        counters.inc('harbornet_mongo_pool_connects_total', 'New connections opened to MongoDB.')
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+    def connection_check_out_started(self, event): pass
+
+
+mongo_listener = MongoPoolListener()
+
+
+def _gauge(name, help, value):
+    return [f"# HELP {name} {help}", f"# TYPE {name} gauge", f"{name} {value}"]
+
+# to render every metric of this process, engine gives the live SQL pool gauges
+def render(engine, caches=None):
+    lines = []
+    pool = engine.pool
+    if isinstance(pool, QueuePool):
+        lines += _gauge('harbornet_sql_pool_size', 'Configured SQL pool size.', pool.size())
+        lines += _gauge('harbornet_sql_pool_checked_out', 'SQL connections in use right now.', pool.checkedout())
+        lines += _gauge('harbornet_sql_pool_checked_in', 'Idle SQL connections in the pool.', pool.checkedin())
+        lines += _gauge('harbornet_sql_pool_overflow', 'SQL connections open beyond pool_size.', max(pool.overflow(), 0))
+    lines += _gauge('harbornet_mongo_pool_checked_out', 'MongoDB connections in use right now.', mongo_listener.checked_out)
+    lines += sql_wait.render()
+    lines += mongo_wait.render()
+    lines += counters.render()
+    if caches:
+        for kind in ('hits', 'misses'):
+            metric = f"harbornet_cache_{kind}_total"
+            lines += [f"# HELP {metric} Lookup cache {kind}.", f"# TYPE {metric} counter"]
+            lines += [f'{metric}{{cache="{name}"}} {stats[kind]}' for name, stats in caches.items()]
+    return '\n'.join(lines) + '\n'
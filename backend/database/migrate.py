@@ -0,0 +1,113 @@
+import sys
+from sqlalchemy import inspect, text
+from database.connect import Base, get_engine
+from database import db_models  # registers every table on Base.metadata
+
+
+'''
+Schema management for the SQL tables and MongoDB indexes.
+
+create_all only creates missing tables, so columns and indexes added to
+db_models later are applied here as additive ALTER TABLE / CREATE INDEX
+statements, and the few columns listed in TYPE_CHANGES are converted in
+place. Every step checks the live schema first and can be re-run.
+The server no longer creates tables or indexes on start, run this after
+each deploy that changes db_models.
+'''
+
+# (table, column) whose type changed in db_models after tables were created
+TYPE_CHANGES = [
+    ('uploads', 'id'),  # String(10) -> Integer, the same ids as Mongo_Uploads
+]
+
+
+# to add columns declared in db_models that the live table does not have yet
+def add_missing_columns(bind):
+    inspector = inspect(bind)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        if not inspector.has_table(table.name):
+            continue
+        existing = {column['name'] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name in existing:
+                continue
+            column_type = column.type.compile(dialect=bind.dialect)
+            with bind.begin() as conn:
+                conn.execute(text(f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type} NULL"))
+            added.append(f"{table.name}.{column.name}")
+    return added
+
+# to convert the TYPE_CHANGES columns that still have their old type
+# existing values must already fit the new type (report ids were always numbers)
+def convert_column_types(bind):
+    inspector = inspect(bind)
+    converted = []
+    for table_name, column_name in TYPE_CHANGES:
+        if not inspector.has_table(table_name):
+            continue
+        live = {column['name']: column for column in inspector.get_columns(table_name)}[column_name]
+        column = Base.metadata.tables[table_name].columns[column_name]
+        if live['type'].python_type is column.type.python_type:
+            continue
+        column_type = column.type.compile(dialect=bind.dialect)
+        null = 'NULL' if column.nullable else 'NOT NULL'
+        if bind.dialect.name in ('mysql', 'mariadb'):
+            statement = f"ALTER TABLE {table_name} MODIFY {column_name} {column_type} {null}"
+        elif bind.dialect.name == 'postgresql':
+            statement = f"ALTER TABLE {table_name} ALTER COLUMN {column_name} TYPE {column_type} USING {column_name}::{column_type}"
+        else:
+            print(f"convert_column_types: cannot change {table_name}.{column_name} to {column_type} on {bind.dialect.name}, recreate the table")
+            continue
+        with bind.begin() as conn:
+            conn.execute(text(statement))
+        converted.append(f"{table_name}.{column_name}")
+    return converted
+
+# to create indexes declared in db_models that the live table does not have yet
+def add_missing_indexes(bind):
+    inspector = inspect(bind)
+    added = []
+    for table in Base.metadata.sorted_tables:
+        existing = {index['name'] for index in inspector.get_indexes(table.name)}
+        for index in table.indexes:
+            if index.name in existing:
+                continue
+            index.create(bind)
+            added.append(index.name)
+    return added
+
+# to create the indexes declared in the meta of every MongoDB document
+def ensure_mongo_indexes():
+    documents = [
+        getattr(db_models, name) for name in dir(db_models)
+        if name.startswith('Mongo_') and isinstance(getattr(db_models, name), type)
+    ]
+    for document in documents:
+        document.ensure_indexes()
+    return [document.__name__ for document in documents]
+
+# to bring the database up to the schema in db_models
+def upgrade(bind=None):
+    bind = bind or get_engine()
+    Base.metadata.create_all(bind)
+    return {
+        'columns': add_missing_columns(bind),
+        'converted': convert_column_types(bind),
+        'indexes': add_missing_indexes(bind),
+        'mongo': ensure_mongo_indexes(),
+    }
+
+
+# usage: python -m database.migrate [upgrade]
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'upgrade'
+    if command == 'upgrade':
+        result = upgrade()
+        print(f"Added columns: {result['columns'] or 'none'}")
+        print(f"Converted columns: {result['converted'] or 'none'}")
+        print(f"Added indexes: {result['indexes'] or 'none'}")
+        print(f"Checked MongoDB indexes of: {', '.join(result['mongo'])}")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
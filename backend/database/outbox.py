@@ -0,0 +1,418 @@
+import itertools
+import json
+import sys
+import threading
+from datetime import datetime, timedelta
+from pymongo import DeleteMany, DeleteOne, UpdateMany, UpdateOne
+from pymongo.errors import ConnectionFailure
+from database import counters, leases
+from database.connect import SessionLocal
+from database.db_models import Outbox, Uploads, Mongo_Uploads
+from database.events import publish
+
+
+'''
+Transactional outbox for the MongoDB half of a report.
+
+Request handlers write the Uploads row and an Outbox row in the same SQL
+transaction and return. A background relay reads pending rows in id order,
+applies them to Mongo_Uploads as idempotent upserts/updates/deletes in one
+bulk_write, adjusts the overview counters, then marks them processed. A crash
+between the two stores only delays the Mongo write, it never loses it.
+
+Events for one report must be applied in order (an update or delete that
+overtakes its upsert is lost), so only one process relays at a time: every
+worker runs the relay thread, but a pass only does work while it holds the
+'outbox-relay' lease (database.leases). Another worker takes over within
+LEASE_SECONDS when the holder dies.
+
+A batch that fails for any reason other than MongoDB being unreachable
+counts an attempt on its events and is then retried one event at a time, so
+a bad event is found and, after MAX_ATTEMPTS, dead-lettered (failed_at set)
+instead of blocking every event behind it. Dead-lettered events are listed
+by `python -m database.outbox failed`; fix the cause, then reconcile.
+
+The live events of a report (report.created, report.approved,
+report.rejected) are published here, once MongoDB holds the batch and the
+'reports' version is bumped, so a client that reloads on an event sees the
+change.
+'''
+
+BATCH_SIZE = 200
+POLL_INTERVAL = 1.0
+MAX_ATTEMPTS = 5
+LEASE = 'outbox-relay'
+LEASE_SECONDS = 30
+
+_wake = threading.Event()
+_stop = threading.Event()
+_relay_thread = None
+
+
+# to queue a mongo write inside the caller's transaction (caller commits)
+def enqueue(session, report_id, action, fields=None):
+    session.add(Outbox(
+        report_id=int(report_id),
+        action=action,
+        payload=json.dumps(fields) if fields is not None else None,
+    ))
+
+# to queue the same mongo write for many reports with one executemany
+def enqueue_many(session, report_ids, action, fields=None):
+    payload = json.dumps(fields) if fields is not None else None
+    session.bulk_insert_mappings(Outbox, [
+        {'report_id': int(report_id), 'action': action, 'payload': payload, 'created_at': datetime.utcnow(), 'attempts': 0}
+        for report_id in report_ids
+    ])
+
+# to wake the relay right after a commit instead of waiting for the next poll
+def notify():
+    _wake.set()
+
+def _to_operation(event):
+    if event.action == 'delete':
+        return DeleteOne({'_id': event.report_id})
+    fields = json.loads(event.payload or '{}')
+    return UpdateOne({'_id': event.report_id}, {'$set': fields}, upsert=(event.action == 'upsert'))
+
+# to turn events into bulk_write operations, folding runs of identical
+# deletes/updates (e.g. from a bulk approve) into one delete_many/update_many
+def _to_operations(events):
+    operations = []
+    run = []
+
+    def flush():
+        if len(run) == 1:
+            operations.append(_to_operation(run[0]))
+        elif run:
+            ids = [event.report_id for event in run]
+            if run[0].action == 'delete':
+                operations.append(DeleteMany({'_id': {'$in': ids}}))
+            else:
+                operations.append(UpdateMany({'_id': {'$in': ids}}, {'$set': json.loads(run[0].payload or '{}')}))
+        run.clear()
+
+    for event in events:
+        foldable = event.action in ('delete', 'update')
+        if run and not (foldable and event.action == run[0].action and event.payload == run[0].payload):
+            flush()
+        if foldable:
+            run.append(event)
+        else:
+            operations.append(_to_operation(event))
+    flush()
+    return operations
+
+# to record on each event what it changes in the overview counters, replaying
+# the batch on top of the tracked fields the reports have in MongoDB now
+def _record_changes(events):
+    state = {
+        doc.pop('_id'): doc for doc in
+        Mongo_Uploads._get_collection().find({'_id': {'$in': list({e.report_id for e in events})}}, {'issue_category': 1, 'status': 1})
+    }
+    for event in events:
+        old = state.get(event.report_id)
+        if event.action == 'delete' or (event.action == 'update' and old is None):
+            new = None
+        else:
+            new = {**(old or {}), **json.loads(event.payload or '{}')}
+        state[event.report_id] = new
+        event.counter_change = json.dumps(counters.change(old, new))
+
+def _pending(session):
+    return session.query(Outbox).filter(Outbox.processed_at.is_(None), Outbox.failed_at.is_(None))
+
+# to apply one batch of pending events, returns how many were applied
+# does nothing (returns 0) while another process holds the relay lease
+def relay_once(batch_size=BATCH_SIZE):
+    if not leases.acquire(LEASE, LEASE_SECONDS):
+        return 0
+    session = SessionLocal()
+    try:
+        events = _pending(session).order_by(Outbox.id).limit(batch_size).with_for_update().all()
+        if not events:
+            session.rollback()
+            return 0
+        if events[0].attempts:
+            events = events[:1]  # the last batch failed, find the bad event one at a time
+        # events tried before carry the counter changes worked out before their first
+        # write; MongoDB may hold part of them now, so they are not worked out again
+        recorded = events[0].counter_change is not None
+        events = list(itertools.takewhile(lambda e: (e.counter_change is not None) == recorded, events))
+
+        ids = [event.id for event in events]
+
+        try:
+            if not recorded:
+                _record_changes(events)
+            operations = _to_operations(events)
+            changes = [(event.id, json.loads(event.counter_change)) for event in events]
+            if not recorded:
+                session.commit()  # stored before MongoDB holds any part of the batch
+            Mongo_Uploads._get_collection().bulk_write(operations, ordered=True)
+            counters.apply_changes(changes)
+            counters.bump_version('reports')
+            announcements = _announcements(events)
+        except ConnectionFailure as e:
+            session.rollback()  # mongodb is down, not the events' fault
+            print(f"relay_once caused error: {e}")
+            return 0
+        except Exception as e:
+            print(f"relay_once caused error: {e}")
+            for event in events:
+                event.attempts += 1
+                if len(events) == 1 and event.attempts >= MAX_ATTEMPTS:
+                    event.failed_at = datetime.utcnow()
+                    print(f"relay_once gave up on outbox event {event.id} for report {event.report_id}")
+            session.commit()
+            return 0
+
+        session.query(Outbox).filter(Outbox.id.in_(ids)).update({'processed_at': datetime.utcnow()}, synchronize_session=False)
+        session.commit()
+        for event_type, data in announcements:
+            publish(event_type, data)  # after bump_version, a client reloading on it sees the change
+        return len(events)
+
+    except Exception as e:
+        session.rollback()
+        print(f"relay_once caused error: {e}")
+        return 0
+
+    finally:
+        session.close()
+
+# to get the live events of an applied batch in outbox order, [(type, data)];
+# consecutive approvals or deletes go out as one event
+def _announcements(events):
+    announcements = []
+    for event in events:
+        payload = json.loads(event.payload or '{}')
+        if event.action == 'upsert':
+            announcements.append(('report.created', {'id': event.report_id, 'category': payload.get('issue_category')}))
+            continue
+        if event.action == 'delete':
+            event_type = 'report.rejected'
+        elif payload.get('status') == 'verified':
+            event_type = 'report.approved'
+        else:
+            continue
+        if announcements and announcements[-1][0] == event_type:
+            announcements[-1][1]['ids'].append(event.report_id)
+        else:
+            announcements.append((event_type, {'ids': [event.report_id]}))
+    return announcements
+
+def _run_relay(interval):
+    while not _stop.is_set():
+        try:
+            while relay_once() == BATCH_SIZE:
+                pass
+        except Exception as e:
+            print(f"outbox relay caused error: {e}")
+        _wake.wait(interval)
+        _wake.clear()
+
+# to start the background relay thread once per process
+def start_relay(interval=POLL_INTERVAL):
+    global _relay_thread
+    if _relay_thread and _relay_thread.is_alive():
+        return _relay_thread
+    _stop.clear()
+    _relay_thread = threading.Thread(target=_run_relay, args=(interval,), name='outbox-relay', daemon=True)
+    _relay_thread.start()
+    return _relay_thread
+
+# to stop the relay and let it finish the batch it is on
+def stop_relay(timeout=5):
+    _stop.set()
+    _wake.set()
+    if _relay_thread:
+        _relay_thread.join(timeout)
+    try:
+        leases.release(LEASE)
+    except Exception as e:
+        print(f"stop_relay caused problem: {e}")
+
+# to get the dead-lettered events, oldest first
+def failed_events(limit=100):
+    session = SessionLocal()
+    try:
+        return [
+            {'id': e.id, 'report_id': e.report_id, 'action': e.action, 'attempts': e.attempts, 'failed_at': e.failed_at}
+            for e in session.query(Outbox).filter(Outbox.failed_at.isnot(None)).order_by(Outbox.id).limit(limit)
+        ]
+    finally:
+        session.close()
+
+# to delete processed events older than the given number of days
+def purge(days=7):
+    session = SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=days)
+        deleted = session.query(Outbox).filter(Outbox.processed_at < cutoff).delete(synchronize_session=False)
+        session.commit()
+        return deleted
+    finally:
+        session.close()
+
+
+
+'''RECONCILIATION'''
+
+# to find reports that exist in only one of the two stores or whose status differs, and
+# optionally fix them. sql is the source of truth: a missing mongo document is rebuilt
+# with the status of its Uploads row, on top of its last upsert event when that is still
+# kept (the description and media only live in mongo); a document whose status differs
+# from issue_nearby_uploader gets the sql status; mongo documents without an Uploads row
+# are deleted
+def reconcile(repair=False, chunk_size=1000):
+    session = SessionLocal()
+    try:
+        pending = {report_id for (report_id,) in _pending(session).with_entities(Outbox.report_id).distinct()}
+
+        sql_ids = set()
+        missing_in_mongo = []
+        status_drift = []
+        query = session.query(Uploads.id, Uploads.issue_nearby_uploader).order_by(Uploads.id).yield_per(chunk_size)
+        for chunk in _chunks(query, chunk_size):
+            statuses = {upload_id: _status(verified) for upload_id, verified in chunk}
+            sql_ids.update(statuses)
+            in_mongo = _mongo_statuses(list(statuses))
+            for upload_id, status in statuses.items():
+                if upload_id in pending:
+                    continue
+                if upload_id not in in_mongo:
+                    missing_in_mongo.append(upload_id)
+                elif in_mongo[upload_id] != status:
+                    status_drift.append(upload_id)
+
+        orphaned_in_mongo = [
+            i for i in Mongo_Uploads.objects.scalar('id')
+            if i not in sql_ids and i not in pending
+        ]
+
+        repaired = 0
+        without_content = []
+        if repair:
+            # the lists above are a snapshot; reports created, written or rejected
+            # since then are checked again in a new transaction before touching them
+            session.rollback()
+            for chunk in _chunks(missing_in_mongo, chunk_size):
+                statuses = _still_missing(session, chunk)
+                last_upserts = _last_upserts(session, list(statuses))
+                for report_id, status in statuses.items():
+                    if report_id in last_upserts:
+                        fields = json.loads(last_upserts[report_id])
+                    else:
+                        fields = {'issue_predicted_category': []}  # the outbox was purged, only sql is left
+                        without_content.append(report_id)
+                    fields['status'] = status
+                    enqueue(session, report_id, 'upsert', fields)
+                    repaired += 1
+            for chunk in _chunks(status_drift, chunk_size):
+                for report_id, status in _still_drifted(session, chunk).items():
+                    enqueue(session, report_id, 'update', {'status': status})
+                    repaired += 1
+            for chunk in _chunks(orphaned_in_mongo, chunk_size):
+                for report_id in _still_orphaned(session, chunk):
+                    enqueue(session, report_id, 'delete')
+                    repaired += 1
+            session.commit()
+            notify()
+
+        return {
+            'missing_in_mongo': missing_in_mongo,
+            'status_drift': status_drift,
+            'orphaned_in_mongo': orphaned_in_mongo,
+            'repaired': repaired,
+            'without_content': without_content,
+        }
+
+    finally:
+        session.close()
+
+def _status(verified):
+    return 'verified' if verified else 'unverified'
+
+# to get {id: status} of the reports that have a Mongo document
+def _mongo_statuses(report_ids):
+    return {
+        doc['_id']: doc.get('status', 'unverified')
+        for doc in Mongo_Uploads._get_collection().find({'_id': {'$in': report_ids}}, {'status': 1})
+    }
+
+# to get {id: status} of the reports that have an Uploads row and no pending event
+def _sql_statuses(session, report_ids):
+    pending = {i for (i,) in _pending(session).filter(Outbox.report_id.in_(report_ids)).with_entities(Outbox.report_id)}
+    return {
+        upload_id: _status(verified)
+        for upload_id, verified in session.query(Uploads.id, Uploads.issue_nearby_uploader).filter(Uploads.id.in_(report_ids))
+        if upload_id not in pending
+    }
+
+# to keep {id: sql status} of the ids that still have an Uploads row and no Mongo document
+def _still_missing(session, report_ids):
+    present = _mongo_statuses(report_ids)
+    return {i: status for i, status in _sql_statuses(session, report_ids).items() if i not in present}
+
+# to keep {id: sql status} of the ids whose Mongo status still differs from sql
+def _still_drifted(session, report_ids):
+    present = _mongo_statuses(report_ids)
+    return {i: status for i, status in _sql_statuses(session, report_ids).items() if i in present and present[i] != status}
+
+# to keep the ids that still have no Uploads row and no pending event
+def _still_orphaned(session, report_ids):
+    in_sql = {i for (i,) in session.query(Uploads.id).filter(Uploads.id.in_(report_ids))}
+    pending = {i for (i,) in _pending(session).filter(Outbox.report_id.in_(report_ids)).with_entities(Outbox.report_id)}
+    return [i for i in report_ids if i not in in_sql and i not in pending]
+
+def _last_upserts(session, report_ids):
+    rows = (
+        session.query(Outbox.report_id, Outbox.payload)
+        .filter(Outbox.report_id.in_(report_ids), Outbox.action == 'upsert')
+        .order_by(Outbox.id)
+        .all()
+    )
+    return {report_id: payload for report_id, payload in rows}
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# usage: python -m database.outbox relay|reconcile [--repair]|purge [days]|failed
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'relay'
+    if command == 'relay':
+        if not leases.acquire(LEASE, LEASE_SECONDS):
+            print("Another process is relaying the outbox.")
+            sys.exit(1)
+        total = 0
+        while True:
+            applied = relay_once()
+            total += applied
+            if applied < BATCH_SIZE:
+                break
+        leases.release(LEASE)
+        print(f"Applied {total} outbox events.")
+    elif command == 'reconcile':
+        result = reconcile(repair='--repair' in sys.argv)
+        print(f"Missing in MongoDB: {len(result['missing_in_mongo'])}")
+        print(f"Status differs from MySQL: {len(result['status_drift'])}")
+        print(f"Orphaned in MongoDB: {len(result['orphaned_in_mongo'])}")
+        print(f"Repaired: {result['repaired']}, rebuilt without description or media: {result['without_content']}")
+    elif command == 'purge':
+        days = int(sys.argv[2]) if len(sys.argv) > 2 else 7
+        print(f"Purged {purge(days)} processed outbox events.")
+    elif command == 'failed':
+        for event in failed_events():
+            print(f"{event['id']:>10} report {event['report_id']:<10} {event['action']:<7} {event['attempts']} attempts, failed {event['failed_at']}")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
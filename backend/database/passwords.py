@@ -0,0 +1,79 @@
+import base64
+import hashlib
+import hmac
+import os
+import secrets
+from concurrent.futures import ThreadPoolExecutor
+
+
+'''
+Salted scrypt password hashes.
+
+Stored as 'scrypt$N$r$p$salt$hash' so the cost can be raised per deployment
+(PASSWORD_SCRYPT_N / _R / _P) without breaking older hashes: a hash made with
+other parameters, or a legacy plaintext password, still verifies and is
+flagged for rehashing on the next successful login.
+
+scrypt releases the GIL, so verification runs on a small bounded pool of
+PASSWORD_HASH_WORKERS threads. A burst of logins then queues there instead
+of tying up every Flask thread.
+'''
+
+SCRYPT_N = int(os.getenv('PASSWORD_SCRYPT_N', str(1 << 14)))
+SCRYPT_R = int(os.getenv('PASSWORD_SCRYPT_R', '8'))
+SCRYPT_P = int(os.getenv('PASSWORD_SCRYPT_P', '1'))
+HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 2)))
+PREFIX = 'scrypt'
+
+_pool = None
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _scrypt(password, salt, n, r, p):
+    return hashlib.scrypt(password.encode(), salt=salt, n=n, r=r, p=p, maxmem=128 * n * r * (p + 2), dklen=32)
+
+# to hash a password with the deployment's current cost
+def hash_password(password):
+    salt = secrets.token_bytes(16)
+    digest = _scrypt(password, salt, SCRYPT_N, SCRYPT_R, SCRYPT_P)
+    return f"{PREFIX}${SCRYPT_N}${SCRYPT_R}${SCRYPT_P}${_b64(salt)}${_b64(digest)}"
+
+# to check a password, returns (matches, needs_rehash)
+def verify_password(password, stored):
+    if not stored or password is None:
+        return False, False
+    if not stored.startswith(PREFIX + '$'):
+        # legacy row holding the plaintext password
+        return hmac.compare_digest(stored.encode(), password.encode()), True
+    try:
+        _, n, r, p, salt, digest = stored.split('$')
+        n, r, p = int(n), int(r), int(p)
+        matches = hmac.compare_digest(_scrypt(password, _unb64(salt), n, r, p), _unb64(digest))
+    except ValueError:
+        return False, False
+    return matches, (n, r, p) != (SCRYPT_N, SCRYPT_R, SCRYPT_P)
+
+def _get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix='password-hash')
+    return _pool
+
+# to verify on the bounded hashing pool instead of the request thread
+def verify_in_pool(password, stored):
+    return _get_pool().submit(verify_password, password, stored).result()
+
+# to hash on the bounded hashing pool instead of the request thread
+def hash_in_pool(password):
+    return _get_pool().submit(hash_password, password).result()
+
+def _reset_after_fork():
+    global _pool
+    _pool = None
+
+os.register_at_fork(after_in_child=_reset_after_fork)
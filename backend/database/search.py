@@ -0,0 +1,300 @@
+import datetime
+import os
+import queue
+import re
+import sqlite3
+import sys
+from contextlib import contextmanager
+from database.connect import SessionLocal
+from database.db_models import Uploads, SocialPost, Mongo_Uploads
+
+
+'''
+Full-text search over report descriptions and social posts.
+
+The index is an SQLite FTS5 table in a local file (HARBORNET_SEARCH_DB).
+Reports and posts live in different databases, so one embedded index
+ranks both with BM25 in a single query. A MongoDB text index could only
+cover the reports. The write paths keep it in sync: api_report adds a
+report, reject_uploads removes them, and store_posts and the classifier
+backfill (re)index posts. `python -m database.search rebuild` recreates it
+from MySQL and MongoDB, e.g. on a new host or after a restore.
+
+Filters (category, platform, and the days or months of a date range) are
+stored as tokens in an indexed `tags` column and joined to the text query
+with AND, so FTS5 intersects posting lists instead of ranking every match
+and then discarding most of them. Only ranges too long to list by day are
+compared on the stored dates of what is left. Ranking reads only row ids
+and BM25 scores; the stored text is read for the page that is returned.
+
+Row ids are the report id, and POST_ROWID_BASE plus the id for social
+posts, so each kind is a row id range in id (that is, arrival) order. Scoring
+costs about the same for every match, so when more than MAX_CANDIDATES
+documents match (a word like 'flood'), only the newest ones are ranked,
+MAX_CANDIDATES split between the kinds searched. Dates that the day and
+month tags cannot express are compared in the cutoff as well, so the newest
+candidates are ones inside the dates. A broad query then costs
+the same on a million documents as on a hundred thousand.
+
+All workers on a host share the file. Each app host has its own copy and
+only sees the writes made on that host, so with several hosts rebuild the
+index on a schedule.
+'''
+
+SEARCH_DB = os.getenv('HARBORNET_SEARCH_DB', os.path.join(os.getcwd(), 'search.db'))
+MAX_LIMIT = 100
+MAX_OFFSET = 1000  # deeper pages are not useful for a ranked search and get slower
+MAX_DAY_TAGS = 62  # longer date ranges match month tags, then compare days
+MAX_MONTH_TAGS = 24  # even longer ones only compare days
+MAX_CANDIDATES = int(os.getenv('HARBORNET_SEARCH_CANDIDATES', '10000'))
+POST_ROWID_BASE = 1 << 40
+KIND_ROWIDS = {'report': (0, POST_ROWID_BASE), 'post': (POST_ROWID_BASE, 1 << 62)}
+BATCH_SIZE = 2000
+
+SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS docs USING fts5(
+    body, tags,
+    kind UNINDEXED, ref_id UNINDEXED, category UNINDEXED, platform UNINDEXED, day UNINDEXED,
+    tokenize = 'porter unicode61'
+)
+'''
+
+_idle = queue.SimpleQueue()
+
+
+def _open():
+    conn = sqlite3.connect(SEARCH_DB, timeout=5, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode = WAL')  # readers never wait for the writer
+    conn.execute('PRAGMA synchronous = NORMAL')
+    conn.execute(SCHEMA)
+    return conn
+
+# to borrow a connection; connections are pooled, not per thread, so
+# thousands of gevent greenlets do not open thousands of files
+@contextmanager
+def _connection():
+    try:
+        conn = _idle.get_nowait()
+    except queue.Empty:
+        conn = _open()
+    try:
+        yield conn
+    finally:
+        _idle.put(conn)
+
+def _reset_after_fork():
+    global _idle
+    _idle = queue.SimpleQueue()  # sqlite connections must not cross a fork
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+# to turn a filter value into one token, e.g. 'High Waves' -> 'cathighwaves'
+def _tag(prefix, value):
+    return prefix + re.sub(r'\W|_', '', str(value).lower())
+
+def _row(kind, ref_id, body, category, platform, day):
+    tags = []
+    if category:
+        tags.append(_tag('cat', category))
+    if platform:
+        tags.append(_tag('platform', platform))
+    if day:
+        tags += [_tag('day', day), _tag('month', day[:7])]
+    rowid = ref_id if kind == 'report' else POST_ROWID_BASE + ref_id
+    return (rowid, body or '', ' '.join(tags), kind, ref_id, category, platform, day)
+
+def _write(conn, rows):
+    conn.executemany(
+        'INSERT OR REPLACE INTO docs (rowid, body, tags, kind, ref_id, category, platform, day) '
+        'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+        rows,
+    )
+
+# to get the YYYY-MM-DD day of a date or of a platform timestamp string
+def _day(value):
+    if not value:
+        return None
+    if hasattr(value, 'isoformat'):
+        return value.isoformat()[:10]
+    match = re.match(r'\d{4}-\d{2}-\d{2}', str(value))
+    return match.group(0) if match else None
+
+
+# to add or update reports, each {'id', 'description', 'category', 'date'}
+def index_reports(reports):
+    rows = [_row('report', int(r['id']), r.get('description'), r.get('category'), None, _day(r.get('date'))) for r in reports]
+    try:
+        with _connection() as conn:
+            with conn:
+                _write(conn, rows)
+    except Exception as e:
+        print(f"index_reports caused problem: {e}")
+
+def remove_reports(ids):
+    try:
+        with _connection() as conn:
+            with conn:
+                conn.executemany('DELETE FROM docs WHERE rowid = ?', [(int(i),) for i in ids])  # report rowid = id
+    except Exception as e:
+        print(f"remove_reports caused problem: {e}")
+
+# to add or update social posts (SocialPost rows or anything with the same attributes)
+def index_posts(posts):
+    rows = [_row('post', p.id, p.content, p.predicted_category, p.platform, _day(p.timestamp)) for p in posts]
+    try:
+        with _connection() as conn:
+            with conn:
+                _write(conn, rows)
+    except Exception as e:
+        print(f"index_posts caused problem: {e}")
+
+
+# to get the tags that cover a date range, returns (tags, exact)
+# exact is False when the matches still have to be compared by day
+def _date_tags(date_from, date_to):
+    if not date_from or not date_to:
+        return [], False
+    first, last = datetime.date.fromisoformat(date_from), datetime.date.fromisoformat(date_to)
+    if (last - first).days < MAX_DAY_TAGS:
+        days = (first + datetime.timedelta(days=n) for n in range((last - first).days + 1))
+        return [_tag('day', day.isoformat()) for day in days], True
+    year, month = first.year, first.month
+    months = []
+    while (year, month) <= (last.year, last.month):
+        months.append(_tag('month', f"{year:04d}-{month:02d}"))
+        if len(months) > MAX_MONTH_TAGS:
+            return [], False
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+    return months, False
+
+# to build the MATCH expression: every word of the query must appear (in any
+# form the porter stemmer folds together), plus one tag per filter
+def _match(text, category=None, platform=None, date_tags=()):
+    words = re.findall(r'\w+', text.lower())
+    if not words:
+        return None
+    match = 'body : (' + ' '.join(f'"{word}"' for word in words) + ')'
+    for prefix, value in (('cat', category), ('platform', platform)):
+        if value:
+            match += f' AND tags : "{_tag(prefix, value)}"'
+    if date_tags:
+        match += ' AND tags : (' + ' OR '.join(f'"{tag}"' for tag in date_tags) + ')'
+    return match
+
+# to get (rowid, score) of the best `count` matches of one kind, ranking at most
+# the newest `candidates`; date_from and date_to are compared when given, in the
+# cutoff too, so the newest candidates are ones inside the dates
+def _ranked(conn, match, kind, date_from, date_to, count, candidates):
+    low, high = KIND_ROWIDS[kind]
+    where = 'docs MATCH ? AND rowid >= ? AND rowid < ?'
+    bounds = []
+    if date_from:
+        where += ' AND day >= ?'
+        bounds.append(date_from)
+    if date_to:
+        where += ' AND day <= ?'
+        bounds.append(date_to)
+
+    cutoff = conn.execute(
+        f'SELECT rowid FROM docs WHERE {where} ORDER BY rowid DESC LIMIT 1 OFFSET ?',
+        (match, low, high, *bounds, candidates),
+    ).fetchone()
+    if cutoff:
+        low = cutoff[0] + 1  # too many matches, rank the newest ones
+
+    # bm25 with the tags column weighted 0; only row ids are read while ranking
+    return conn.execute(
+        f'SELECT rowid, bm25(docs, 1.0, 0.0) AS score FROM docs WHERE {where} ORDER BY score LIMIT ?',
+        (match, low, high, *bounds, count),
+    ).fetchall()
+
+# to search reports and posts, best match first
+# returns (results, more) where more tells whether another page exists
+def search(text, kind=None, category=None, platform=None, date_from=None, date_to=None, limit=20, offset=0):
+    date_from, date_to = _day(date_from), _day(date_to)
+    date_tags, exact = _date_tags(date_from, date_to)
+    match = _match(text, category, platform, date_tags)
+    if match is None or (date_from and date_to and date_from > date_to):
+        return [], False
+    if exact:
+        date_from = date_to = None  # the day tags already match exactly
+    limit = max(1, min(limit, MAX_LIMIT))
+    offset = max(0, min(offset, MAX_OFFSET))
+
+    kinds = [kind] if kind else ['report', 'post']
+    with _connection() as conn:
+        ranked = []
+        for each in kinds:
+            ranked += _ranked(conn, match, each, date_from, date_to, offset + limit + 1, MAX_CANDIDATES // len(kinds))
+        ranked.sort(key=lambda row: row[1])  # bm25 scores are lower for better matches
+        page = ranked[offset:offset + limit]
+        scores = dict(page)
+        rows = conn.execute(
+            f"SELECT rowid, kind, ref_id, category, platform, day, body FROM docs WHERE rowid IN ({', '.join('?' * len(page))})",
+            list(scores),
+        ).fetchall() if page else []
+
+    results = [
+        {
+            'kind': kind, 'id': ref_id, 'category': category, 'platform': platform,
+            'date': day, 'text': body, 'score': round(-scores[rowid], 4),
+        }
+        for rowid, kind, ref_id, category, platform, day, body in sorted(rows, key=lambda row: scores[row[0]])
+    ]
+    return results, len(ranked) > offset + limit
+
+
+# to recreate the whole index from MySQL and MongoDB, returns (reports, posts) indexed
+def rebuild(batch_size=BATCH_SIZE):
+    with _connection() as conn:
+        with conn:
+            conn.execute('DELETE FROM docs')
+        reports = posts = 0
+        session = SessionLocal()
+        try:
+            cursor = Mongo_Uploads._get_collection().find({}, {'description': 1, 'issue_category': 1}).batch_size(batch_size)
+            while True:
+                docs = [doc for _, doc in zip(range(batch_size), cursor)]
+                if not docs:
+                    break
+                days = dict(session.query(Uploads.id, Uploads.issue_date).filter(Uploads.id.in_([d['_id'] for d in docs])))
+                with conn:
+                    _write(conn, [
+                        _row('report', doc['_id'], doc.get('description'), doc.get('issue_category'), None, _day(days.get(doc['_id'])))
+                        for doc in docs if doc['_id'] in days
+                    ])
+                reports += sum(doc['_id'] in days for doc in docs)
+
+            last_id = 0
+            while True:
+                batch = (
+                    session.query(SocialPost.id, SocialPost.content, SocialPost.predicted_category, SocialPost.platform, SocialPost.timestamp)
+                    .filter(SocialPost.id > last_id).order_by(SocialPost.id).limit(batch_size).all()
+                )
+                if not batch:
+                    break
+                with conn:
+                    _write(conn, [_row('post', p.id, p.content, p.predicted_category, p.platform, _day(p.timestamp)) for p in batch])
+                posts += len(batch)
+                last_id = batch[-1].id
+        finally:
+            session.close()
+        with conn:
+            conn.execute("INSERT INTO docs (docs) VALUES ('optimize')")  # merge segments, queries read fewer b-trees
+    return reports, posts
+
+
+# usage: python -m database.search rebuild | query <words...>
+if __name__ == '__main__':
+    command = sys.argv[1] if len(sys.argv) > 1 else 'rebuild'
+    if command == 'rebuild':
+        reports, posts = rebuild()
+        print(f"Indexed {reports} reports and {posts} social posts into {SEARCH_DB}")
+    elif command == 'query':
+        results, _ = search(' '.join(sys.argv[2:]))
+        for result in results:
+            print(f"{result['score']:>8} {result['kind']:<6} {result['id']:<8} {result['text'][:80]}")
+    else:
+        print(f"Unknown command: {command}")
+        sys.exit(1)
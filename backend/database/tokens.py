@@ -0,0 +1,135 @@
+import base64
+import hashlib
+import hmac
+import json
+import os
+import secrets
+import threading
+import time
+
+
+'''
+Signed session tokens.
+
+A token is an HS256 JWT carrying the account id ('sub'), its role (citizen,
+employee or volunteer), an expiry and a random token id ('jti'). Checking one
+is a pure CPU step: recompute the HMAC, compare, read the claims. No query
+is made, so a report submission no longer has to look its uploader up.
+
+Logged out tokens go into an in-process bloom filter. It answers "maybe
+revoked" or "surely not revoked" in constant time and memory; a false
+positive only means that user has to log in again. The filter keeps two
+generations and drops the older one after TOKEN_TTL, by which time every
+token it held has expired anyway. Revocations are per process, so they do
+not reach other workers.
+
+HARBORNET_TOKEN_SECRET is the signing key and is required in production:
+wsgi.py refuses to start without it, because tokens signed with a random
+per-process key stop working on restart and on every other host. Only the
+development server (python app.py) falls back to a random key.
+'''
+
+ROLES = ('citizen', 'employee', 'volunteer')
+TOKEN_TTL = int(os.getenv('HARBORNET_TOKEN_TTL', str(12 * 3600)))
+SECRET = os.getenv('HARBORNET_TOKEN_SECRET', '').encode() or secrets.token_bytes(32)
+SECRET_FROM_ENV = bool(os.getenv('HARBORNET_TOKEN_SECRET'))
+
+_HEADER = base64.urlsafe_b64encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def _b64(data):
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+def _unb64(text):
+    return base64.urlsafe_b64decode(text + '=' * (-len(text) % 4))
+
+def _sign(signing_input):
+    return hmac.new(SECRET, signing_input.encode(), hashlib.sha256).digest()
+
+# to stop a production server from starting with a random per-process signing key
+def require_secret():
+    if not SECRET_FROM_ENV:
+        raise RuntimeError("HARBORNET_TOKEN_SECRET is not set; set it to the same random value on every server")
+
+
+class BloomFilter:
+    def __init__(self, bits=1 << 20, hashes=7):
+        self.bits = bits
+        self.hashes = hashes
+        self.array = bytearray(bits // 8)
+
+    def _positions(self, key):
+        digest = hashlib.sha256(key.encode()).digest()
+        # double hashing: k positions from two 64-bit halves of one digest
+        a = int.from_bytes(digest[:8], 'big')
+        b = int.from_bytes(digest[8:16], 'big') | 1
+        return [(a + i * b) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.array[position >> 3] |= 1 << (position & 7)
+
+    def __contains__(self, key):
+        return all(self.array[position >> 3] & (1 << (position & 7)) for position in self._positions(key))
+
+
+class RevocationList:
+    def __init__(self, ttl=TOKEN_TTL):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._current = BloomFilter()
+        self._previous = BloomFilter()
+        self._rotated = time.monotonic()
+
+    def _rotate(self):
+        if time.monotonic() - self._rotated >= self.ttl:
+            self._previous, self._current = self._current, BloomFilter()
+            self._rotated = time.monotonic()
+
+    def revoke(self, jti):
+        with self._lock:
+            self._rotate()
+            self._current.add(jti)
+
+    def is_revoked(self, jti):
+        with self._lock:
+            self._rotate()
+            return jti in self._current or jti in self._previous
+
+
+revoked = RevocationList()
+
+
+# to issue a token for an account, role is one of ROLES
+def issue_token(user_id, role='citizen', ttl=TOKEN_TTL):
+    if role not in ROLES:
+        raise ValueError(f"Unknown role: {role}")
+    now = int(time.time())
+    claims = {'sub': int(user_id), 'role': role, 'iat': now, 'exp': now + ttl, 'jti': secrets.token_urlsafe(12)}
+    signing_input = _HEADER + '.' + _b64(json.dumps(claims, separators=(',', ':')).encode())
+    return signing_input + '.' + _b64(_sign(signing_input))
+
+# to check a token, returns its claims or None when it is malformed, forged, expired or revoked
+def verify_token(token):
+    try:
+        header, payload, signature = token.split('.')
+        if header != _HEADER:
+            return None
+        if not hmac.compare_digest(_sign(header + '.' + payload), _unb64(signature)):
+            return None
+        claims = json.loads(_unb64(payload))
+    except (ValueError, AttributeError):
+        return None
+    if claims.get('exp', 0) < time.time() or claims.get('role') not in ROLES:
+        return None
+    if revoked.is_revoked(claims.get('jti', '')):
+        return None
+    return claims
+
+# to log a token out, returns False when it was not valid to begin with
+def revoke_token(token):
+    claims = verify_token(token)
+    if not claims:
+        return False
+    revoked.revoke(claims['jti'])
+    return True
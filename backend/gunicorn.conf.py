@@ -0,0 +1,65 @@
+import multiprocessing
+import os
+
+
+'''
+Production serving with gunicorn: python -m gunicorn -c gunicorn.conf.py
+
+The app is imported once in the master (preload_app) and shared copy-on-write
+by the forked workers. Importing it opens no connections; each worker drops
+any pool inherited from the master on fork and starts its own background
+threads in post_fork. On SIGTERM workers finish their in-flight requests
+within graceful_timeout, then stop the outbox relay and ingestion scheduler.
+Every setting can be overridden from the environment.
+'''
+
+CPUS = multiprocessing.cpu_count()
+
+wsgi_app = 'wsgi:application'
+bind = os.getenv('HARBORNET_BIND', '0.0.0.0:8000')
+
+# requests mostly wait on MySQL and MongoDB, so a few threads per worker and
+# about two workers per core keep every core busy
+worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+workers = int(os.getenv('WEB_CONCURRENCY', str(2 * CPUS + 1)))
+threads = int(os.getenv('GUNICORN_THREADS', '4'))
+# gevent only: every open /api/live stream holds a connection (a thread under
+# gthread), so live dashboards are served by gevent workers, where an idle
+# stream is a parked greenlet
+worker_connections = int(os.getenv('GUNICORN_WORKER_CONNECTIONS', '10000'))
+if worker_class == 'gevent':
+    # patch before the app is preloaded, so the locks and events it makes at
+    # import yield to other greenlets instead of blocking the worker
+    from gevent import monkey
+
+    monkey.patch_all()
+
+# each worker needs a connection per request thread plus its background
+# threads; keep the per-worker pools small so workers x pool fits max_connections
+os.environ.setdefault('DB_POOL_SIZE', str(threads + 2))
+os.environ.setdefault('DB_MAX_OVERFLOW', str(threads))
+os.environ.setdefault('MONGO_MAX_POOL_SIZE', str(threads * 2 + 2))
+
+preload_app = True
+timeout = int(os.getenv('GUNICORN_TIMEOUT', '60'))
+graceful_timeout = int(os.getenv('GUNICORN_GRACEFUL_TIMEOUT', '30'))
+keepalive = 5
+# recycle workers now and then so slow leaks cannot grow without bound
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', '5000'))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+
+def post_fork(server, worker):
+    from app import start_background
+
+    start_background()
+
+def worker_exit(server, worker):
+    from app import stop_background
+    from database.connect import get_engine
+
+    stop_background()
+    get_engine().dispose()
@@ -0,0 +1,135 @@
+import multiprocessing
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from media.storage import MEDIA_ROOT
+
+try:
+    from PIL import Image, ImageOps
+except ImportError:  # pillow is optional, without it only originals are served
+    Image = None
+
+
+'''
+Resized copies of stored media.
+
+Every stored image gets a WebP and a JPEG rendition per entry in SIZES, and
+every video a poster frame (through ffmpeg, when it is installed) that is
+resized the same way. They are written next to the original as
+<sha256>.<size>.<webp|jpg>, so they are as immutable as the original.
+
+The work runs on a process pool so resizing never holds a request thread or
+the GIL: submit() is called when a report is stored, and get() falls back to
+making a missing derivative on demand, e.g. for media stored before this
+existed. The pool uses 'spawn' so its processes never inherit the server's
+threads or connections.
+'''
+
+SIZES = {'thumb': 240, 'medium': 1024}  # longest edge in pixels
+FORMATS = {'webp': ('WEBP', 'webp'), 'jpeg': ('JPEG', 'jpg')}  # name -> (PIL format, extension)
+VIDEO_EXTENSIONS = {'.mp4', '.mov', '.m4v', '.webm', '.mkv', '.avi', '.3gp'}
+QUALITY = 80
+WORKERS = int(os.getenv('HARBORNET_MEDIA_WORKERS', str(max(1, (os.cpu_count() or 2) // 2))))
+FFMPEG = shutil.which('ffmpeg')
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def is_video(relative):
+    return os.path.splitext(relative)[1].lower() in VIDEO_EXTENSIONS
+
+def derivative_path(relative, size, fmt):
+    return f"{os.path.splitext(relative)[0]}.{size}.{FORMATS[fmt][1]}"
+
+def poster_path(relative):
+    return f"{os.path.splitext(relative)[0]}.poster.jpg"
+
+# to write a file under its final name only once it is complete
+def _write_atomically(target, write):
+    partial = f"{target}.{os.getpid()}.part"
+    try:
+        write(partial)
+        os.replace(partial, target)
+    finally:
+        if os.path.exists(partial):
+            os.remove(partial)
+
+def _extract_poster(source, target):
+    _write_atomically(target, lambda partial: subprocess.run(
+        [FFMPEG, '-v', 'error', '-y', '-ss', '1', '-i', source, '-frames:v', '1', '-f', 'image2', partial],
+        check=True, timeout=60,
+    ))
+
+# to make every missing derivative of one stored file, runs in a pool process
+# returns the relative paths that exist afterwards
+def generate(relative, root=MEDIA_ROOT):
+    source = os.path.join(root, relative)
+    made = []
+    if is_video(relative):
+        poster = os.path.join(root, poster_path(relative))
+        if not os.path.exists(poster):
+            if not FFMPEG:
+                return made
+            _extract_poster(source, poster)
+        made.append(poster_path(relative))
+        source = poster
+    if Image is None:
+        return made
+
+    with Image.open(source) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+    for size, edge in SIZES.items():
+        resized = image.copy()
+        resized.thumbnail((edge, edge))
+        for fmt, (pil_format, _) in FORMATS.items():
+            target = os.path.join(root, derivative_path(relative, size, fmt))
+            if not os.path.exists(target):
+                _write_atomically(target, lambda partial: resized.save(partial, pil_format, quality=QUALITY))
+            made.append(derivative_path(relative, size, fmt))
+    return made
+
+
+def _get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=WORKERS, mp_context=multiprocessing.get_context('spawn'))
+        return _pool
+
+def _reset_after_fork():
+    global _pool, _pool_lock
+    _pool = None
+    _pool_lock = threading.Lock()
+
+os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+def _log_failure(future):
+    if future.exception():
+        print(f"media derivatives caused problem: {future.exception()}")
+
+# to queue the derivatives of a stored file without waiting for them
+def submit(relative):
+    if Image is None and not (FFMPEG and is_video(relative)):
+        return None
+    future = _get_pool().submit(generate, relative, MEDIA_ROOT)
+    future.add_done_callback(_log_failure)
+    return future
+
+# to get the path of a derivative, making it now when it is missing
+# returns None when it cannot be made (no pillow, no ffmpeg for a video, unreadable file)
+def get(relative, size, fmt, timeout=30):
+    target = derivative_path(relative, size, fmt)
+    if os.path.exists(os.path.join(MEDIA_ROOT, target)):
+        return target
+    if Image is None or not os.path.exists(os.path.join(MEDIA_ROOT, relative)):
+        return None
+    try:
+        made = _get_pool().submit(generate, relative, MEDIA_ROOT).result(timeout)
+    except Exception as e:
+        print(f"media derivatives caused problem: {e}")
+        return None
+    return target if target in made else None
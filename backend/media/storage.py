@@ -0,0 +1,94 @@
+import hashlib
+import os
+import re
+import tempfile
+from flask import Request
+from werkzeug.utils import secure_filename
+
+
+'''
+Content-addressed media storage.
+
+Uploaded files are streamed by Werkzeug's form parser straight into a temp
+file inside MEDIA_ROOT, and the SHA-256 of the content is computed while the
+chunks are written, so no upload is held in worker memory. store() then
+fsyncs the file and links it to <MEDIA_ROOT>/<first 2 hex>/<sha256><ext>.
+Identical media therefore share one file, and a path is only handed back
+once its bytes are on disk. Requests larger than MAX_CONTENT_LENGTH are
+refused with 413 before anything is read.
+'''
+
+MEDIA_ROOT = os.getenv('HARBORNET_MEDIA_ROOT', os.path.join(os.getcwd(), 'uploads'))
+MAX_CONTENT_LENGTH = int(float(os.getenv('HARBORNET_MAX_UPLOAD_MB', '100')) * 1024 * 1024)
+TMP_DIR = os.path.join(MEDIA_ROOT, '.incoming')
+_CONTENT_ADDRESSED = re.compile(r'^[0-9a-f]{2}/[0-9a-f]{64}(\.[A-Za-z0-9]+)?$')
+
+
+# temp file that hashes what is written to it
+class HashingFile:
+    def __init__(self):
+        os.makedirs(TMP_DIR, exist_ok=True)
+        self.file = tempfile.NamedTemporaryFile(dir=TMP_DIR, prefix='upload-')
+        self.sha256 = hashlib.sha256()
+        self.size = 0
+
+    def write(self, chunk):
+        self.sha256.update(chunk)
+        self.size += len(chunk)
+        return self.file.write(chunk)
+
+    def __getattr__(self, name):
+        return getattr(self.file, name)
+
+
+class StreamingRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return HashingFile()
+
+
+# to make a stored file path relative to MEDIA_ROOT, as served under /uploads/
+def _relative_path(digest, extension):
+    return f"{digest[:2]}/{digest}{extension}"
+
+# to tell stored files (named by their hash, never rewritten) from older uploads
+def is_content_addressed(relative):
+    return bool(_CONTENT_ADDRESSED.match(relative))
+
+def _fsync_dir(path):
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return  # directories cannot be opened on Windows
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+# to store an uploaded FileStorage durably, returns its path relative to MEDIA_ROOT
+# a file with the same content already stored is reused instead of written again
+def store(upload):
+    stream = upload.stream
+    if not isinstance(stream, HashingFile):
+        # not parsed by StreamingRequest (e.g. built in code), hash it by copying
+        hashing = HashingFile()
+        for chunk in iter(lambda: stream.read(1024 * 1024), b''):
+            hashing.write(chunk)
+        stream = hashing
+
+    extension = os.path.splitext(secure_filename(upload.filename or ''))[1].lower()[:10]
+    relative = _relative_path(stream.sha256.hexdigest(), extension)
+    target = os.path.join(MEDIA_ROOT, relative)
+    try:
+        if os.path.exists(target):
+            return relative
+        stream.file.flush()
+        os.fsync(stream.file.fileno())
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        try:
+            os.link(stream.file.name, target)
+        except FileExistsError:
+            return relative  # stored by a concurrent request with the same content
+        _fsync_dir(os.path.dirname(target))
+        return relative
+    finally:
+        stream.file.close()  # removes the temp file, the stored copy is a separate link
@@ -0,0 +1,91 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import pytest
+from AI import fetch_posts
+
+
+'''
+The social fetchers against a local stub of the Twitter and YouTube APIs,
+reached through the TWITTER_API_URL / YOUTUBE_API_URL base URLs.
+'''
+
+
+class StubAPI(BaseHTTPRequestHandler):
+    broken = set()  # paths that answer 200 with a body that is not JSON
+    seen = []
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        StubAPI.seen.append((url.path, query))
+        if url.path in StubAPI.broken:
+            return self._send(200, b'<html>maintenance</html>', 'text/html')
+
+        if url.path == '/2/tweets/search/recent':
+            page = int(query.get('next_token', ['0'])[0])
+            body = {'data': [{'id': f"{page}{i}", 'text': f"flood {page}.{i}", 'author_id': 'a', 'created_at': '2025-01-01T00:00:00Z'} for i in range(2)]}
+            if page < 2:
+                body['meta'] = {'next_token': str(page + 1)}
+        elif url.path == '/youtube/v3/search':
+            body = {'items': [{'id': {'videoId': f"v{i}"}} for i in range(3)]}
+        elif url.path == '/youtube/v3/commentThreads':
+            video = query['videoId'][0]
+            body = {'items': [
+                {'id': f"{video}c{i}", 'snippet': {'topLevelComment': {'snippet': {
+                    'textDisplay': f"waves at {video}", 'authorDisplayName': 'x', 'publishedAt': '2025-01-01T00:00:00Z',
+                }}}}
+                for i in range(2)
+            ]}
+        else:
+            return self._send(404, b'{}', 'application/json')
+        self._send(200, json.dumps(body).encode(), 'application/json')
+
+    def _send(self, status, body, content_type):
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+@pytest.fixture
+def stub_api(monkeypatch):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubAPI)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base = f"http://127.0.0.1:{server.server_port}"
+    monkeypatch.setattr(fetch_posts, 'TWITTER_API_URL', base + '/2')
+    monkeypatch.setattr(fetch_posts, 'YOUTUBE_API_URL', base + '/youtube/v3')
+    for source in fetch_posts._sources.values():
+        monkeypatch.setitem(source, 'limiter', fetch_posts.RateLimiter(1000))
+    StubAPI.broken = set()
+    StubAPI.seen = []
+    yield StubAPI
+    server.shutdown()
+    server.server_close()
+
+
+def test_fetch_all_follows_pages_and_fetches_every_video(stub_api):
+    tweets, comments = fetch_posts.fetch_all(since_id='7')
+
+    assert [t['id'] for t in tweets] == ['00', '01', '10', '11', '20', '21']
+    assert sorted(c['id'] for c in comments) == sorted(f"v{v}c{i}" for v in range(3) for i in range(2))
+    assert comments[0]['text'].startswith('waves at')
+    tweet_queries = [query for path, query in stub_api.seen if path == '/2/tweets/search/recent']
+    assert all(query['since_id'] == ['7'] for query in tweet_queries)
+
+def test_non_json_reply_is_a_failed_source(stub_api):
+    stub_api.broken = {'/2/tweets/search/recent', '/youtube/v3/commentThreads'}
+
+    tweets, comments = fetch_posts.fetch_all()
+
+    assert tweets == []
+    assert comments == []
+    assert fetch_posts._get_json('youtube', fetch_posts.YOUTUBE_API_URL + '/search') is not None
+
+def test_error_status_is_a_failed_source(stub_api):
+    assert fetch_posts._get_json('twitter', fetch_posts.TWITTER_API_URL + '/missing') is None
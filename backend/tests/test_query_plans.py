@@ -0,0 +1,44 @@
+import pytest
+from sqlalchemy import create_engine
+from database import explain
+from database.connect import Base
+
+
+'''
+database.explain on a SQLite copy of the schema: the hot queries must use
+their indexes, and a filter that only walks an index in date order must be
+caught.
+'''
+
+
+@pytest.fixture
+def engine(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'plans.db'}")
+    Base.metadata.create_all(engine)
+    yield engine
+    engine.dispose()
+
+
+def _scans(engine):
+    return {name: scans for name, lines, scans in explain.check(bind=engine, mongo=False)}
+
+def test_hot_queries_use_indexes(engine):
+    scans = _scans(engine)
+
+    assert 'reports by pincode' in scans
+    assert {name: lines for name, lines in scans.items() if lines} == {}
+
+def test_filter_walking_the_date_index_is_a_full_scan(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_uploads_pincode_date")
+
+    scans = _scans(engine)
+
+    assert scans['reports by pincode'] == ['SCAN uploads USING INDEX ix_uploads_date']
+    assert scans['reports page'] == []
+
+def test_filtered_table_scan_is_a_full_scan(engine):
+    with engine.begin() as conn:
+        conn.exec_driver_sql("DROP INDEX ix_outbox_pending")
+
+    assert _scans(engine)['outbox pending']
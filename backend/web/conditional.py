@@ -0,0 +1,71 @@
+import gzip
+import hashlib
+from functools import wraps
+from flask import Response, request
+from database.counters import read_version
+
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+
+
+'''
+Cheap answers for polled read endpoints.
+
+@versioned('reports') tags a response with a weak ETag made from the
+version counter of its data and the request's path and query string. The
+version is read before the view runs, so when a dashboard polls with
+If-None-Match and nothing was written since, it gets a 304 without any
+query being made. Writers bump the counters (see database.counters).
+
+compress() is an after_request hook that gzip- or brotli-encodes JSON and
+text bodies above MIN_SIZE when the client accepts it. Streamed responses
+are left alone.
+'''
+
+MIN_SIZE = 1024
+COMPRESSIBLE = ('application/json', 'text/plain', 'text/html', 'text/csv')
+
+
+def versioned(name):
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            query = hashlib.sha1(request.full_path.encode()).hexdigest()[:16]
+            etag = f"{name}-{read_version(name)}-{query}"
+            if request.if_none_match.contains_weak(etag):
+                response = Response(status=304)
+            else:
+                response = view(*args, **kwargs)
+                if isinstance(response, tuple):
+                    return response  # errors carry their own status and are not cached
+            response.set_etag(etag, weak=True)
+            response.headers['Cache-Control'] = 'no-cache'  # cache, but revalidate on every poll
+            return response
+        return wrapper
+    return decorator
+
+
+def compress(response):
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE
+    ):
+        return response
+    body = response.get_data()
+    if len(body) < MIN_SIZE:
+        return response
+
+    response.vary.add('Accept-Encoding')
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(body, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
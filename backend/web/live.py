@@ -0,0 +1,167 @@
+import json
+import os
+import threading
+import time
+from collections import deque
+from database import events
+
+
+'''
+Server-sent events for dashboards: GET /api/live.
+
+Each server process runs one tailer thread, started when its first
+subscriber connects. The tailer polls Mongo_Events for ids above the last
+one it read (and is woken at once by publishes made in the same process),
+appends new events to a ring buffer and notifies a single Condition. Every
+subscriber is a generator that waits on that Condition, so an idle
+connection costs one parked thread (gthread) or greenlet (gevent) and no
+database work; N subscribers share one poll.
+
+Ids come from a global sequence, but two writers can take ids n and n+1 and
+insert them in the opposite order. When the tailer sees a hole it waits up
+to GAP_WAIT for it to fill before moving past it, so a client that resumes
+from an id is not handed a later event and then miss an earlier one.
+
+A reconnecting EventSource sends Last-Event-ID; events after it come from
+the ring buffer or, for older ids, from Mongo_Events. If the capped
+collection no longer holds them the client gets a 'reset' event and should
+reload everything.
+'''
+
+POLL_INTERVAL = float(os.getenv('HARBORNET_LIVE_POLL', '0.5'))
+HEARTBEAT = 15  # seconds between comment lines, keeps proxies from closing idle streams
+GAP_WAIT = 2.0
+BUFFER_SIZE = 1000
+RETRY_MS = 3000
+
+
+class LiveFeed:
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._events = deque(maxlen=BUFFER_SIZE)  # (id, type, data), ascending ids
+        self._last = None  # highest id handed to subscribers
+        self._thread = None
+        self._wake = threading.Event()
+        self.subscribers = 0
+
+    # to make sure the tailer runs, called before a subscriber's stream is returned
+    def start(self):
+        with self._condition:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            if self._last is None:
+                self._last = events.latest_id()
+            self._thread = threading.Thread(target=self._run, name='live-tailer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        gap_since = None
+        while True:
+            try:
+                fresh, expected = [], self._last + 1
+                for event in events.read_since(self._last):
+                    if event['_id'] != expected:
+                        gap_since = gap_since or time.monotonic()
+                        if time.monotonic() - gap_since < GAP_WAIT:
+                            break  # an earlier id may still be in flight
+                    gap_since = None
+                    fresh.append((event['_id'], event['type'], event.get('data')))
+                    expected = event['_id'] + 1
+                else:
+                    gap_since = None
+                if fresh:
+                    with self._condition:
+                        self._events.extend(fresh)
+                        self._last = fresh[-1][0]
+                        self._condition.notify_all()
+            except Exception as e:
+                print(f"live tailer caused problem: {e}")
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    # to get the buffered events after `cursor`, cheap when there are few new ones
+    def _after(self, cursor):
+        pending = []
+        for event in reversed(self._events):
+            if event[0] <= cursor:
+                break
+            pending.append(event)
+        pending.reverse()
+        return pending
+
+    # to get events after `last_id` that are older than the ring buffer
+    # returns (events, complete); complete is False when some were dropped
+    def _backlog(self, last_id):
+        with self._condition:
+            first_buffered = self._events[0][0] if self._events else self._last + 1
+        if last_id > events.latest_id():
+            return [], False  # an id this database never issued, e.g. after a restore
+        if last_id + 1 >= first_buffered:
+            return [], True
+        oldest = events.oldest_id()
+        if oldest is None or oldest > last_id + 1:
+            return [], False
+        backlog = []
+        while True:
+            batch = [
+                (event['_id'], event['type'], event.get('data'))
+                for event in events.read_since(backlog[-1][0] if backlog else last_id)
+                if event['_id'] < first_buffered
+            ]
+            if not batch:
+                return backlog, True
+            backlog.extend(batch)
+
+    # to stream one subscriber's events as SSE text, runs until the client goes away
+    # types: optional set of type prefixes to keep, e.g. {'report', 'social'}
+    def stream(self, last_id=None, types=None):
+        self.start()
+        with self._condition:
+            self.subscribers += 1
+            cursor = self._last if last_id is None else last_id
+        try:
+            yield f"retry: {RETRY_MS}\n\n"
+            if last_id is not None:
+                backlog, complete = self._backlog(last_id)
+                if not complete:
+                    with self._condition:
+                        cursor = self._last
+                    yield format_event(cursor, 'reset', None)
+                for event in backlog:
+                    cursor = event[0]
+                    if _wanted(event[1], types):
+                        yield format_event(*event)
+
+            while True:
+                with self._condition:
+                    pending = self._after(cursor)
+                    if not pending:
+                        self._condition.wait(HEARTBEAT)
+                        pending = self._after(cursor)
+                if not pending:
+                    yield ": ping\n\n"
+                    continue
+                for event in pending:
+                    cursor = event[0]
+                    if _wanted(event[1], types):
+                        yield format_event(*event)
+        finally:
+            with self._condition:
+                self.subscribers -= 1
+
+
+def _wanted(type, types):
+    return not types or type.split('.', 1)[0] in types
+
+def format_event(id, type, data):
+    return f"id: {id}\nevent: {type}\ndata: {json.dumps(data)}\n\n"
+
+
+feed = LiveFeed()
+events.add_listener(lambda: feed._wake.set())
+
+def _reset_after_fork():
+    global feed
+    feed = LiveFeed()  # the tailer thread does not survive a fork
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,17 @@
+from app import create_app
+from database.tokens import require_secret
+
+
+'''
+WSGI entry point for production servers, e.g.
+
+    gunicorn -c gunicorn.conf.py
+    waitress-serve --threads=8 wsgi:application   (Windows)
+
+Background workers are not started here: gunicorn starts them in each worker
+after the fork (see gunicorn.conf.py), other servers on the first request.
+Startup fails without HARBORNET_TOKEN_SECRET.
+'''
+
+require_secret()
+application = create_app(background=False)
@@ -178,9 +178,22 @@ export default function AdminDashboard() {
     };
     fetchOverview();
     fetchReports();
-    // Poll overview every 10 seconds for live update
-    const interval = setInterval(fetchOverview, 10000);
-    return () => clearInterval(interval);
+    // Refresh when the server pushes a report change; EventSource reconnects
+    // by itself and resumes after the last event it saw
+    const refresh = () => {
+      fetchOverview();
+      fetchReports();
+    };
+    const live = new EventSource('http://127.0.0.1:5000/api/live?types=report');
+    ['report.created', 'report.approved', 'report.rejected', 'reset'].forEach(type =>
+      live.addEventListener(type, refresh)
+    );
+    // Slow poll as a fallback for when the live stream is unavailable
+    const interval = setInterval(fetchOverview, 60000);
+    return () => {
+      live.close();
+      clearInterval(interval);
+    };
   }, []);
 
   const handleApprove = async (id) => {
@@ -302,8 +315,9 @@ export default function AdminDashboard() {
                 }}>
                   <div style={{ background: 'white', padding: 20, borderRadius: 8, maxWidth: 600, maxHeight: '90vh', overflow: 'auto', position: 'relative' }}>
                     <button style={{ position: 'absolute', top: 10, right: 10 }} onClick={() => setMediaPopup({ open: false, image: null, video: null })}>Close</button>
-                    {mediaPopup.image && <img src={BACKEND_URL + mediaPopup.image} alt="Report Media" style={{ maxWidth: '100%', maxHeight: 400 }} />}
-                    {mediaPopup.video && <video src={BACKEND_URL + mediaPopup.video} controls style={{ maxWidth: '100%', maxHeight: 400 }} />}
+                    {/* ?size=medium is a resized copy; the original opens on click */}
+                    {mediaPopup.image && <a href={BACKEND_URL + mediaPopup.image} target="_blank" rel="noreferrer"><img src={BACKEND_URL + mediaPopup.image + '?size=medium'} alt="Report Media" style={{ maxWidth: '100%', maxHeight: 400 }} /></a>}
+                    {mediaPopup.video && <video src={BACKEND_URL + mediaPopup.video} poster={BACKEND_URL + mediaPopup.video + '?size=medium'} preload="none" controls style={{ maxWidth: '100%', maxHeight: 400 }} />}
                     {!mediaPopup.image && !mediaPopup.video && <div>No media available.</div>}
                   </div>
                 </div>
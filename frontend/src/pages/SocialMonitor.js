@@ -19,14 +19,33 @@ export default function SocialMonitor() {
 
   useEffect(() => {
     loadPosts();
+    // Reload when the server reports newly stored posts
+    const live = new EventSource('http://127.0.0.1:5000/api/live?types=social');
+    live.addEventListener('social.stored', loadPosts);
+    live.addEventListener('reset', loadPosts);
+    return () => live.close();
   }, []);
 
   const fetchNewPosts = () => {
     setFetching(true);
     fetch('http://127.0.0.1:5000/api/fetch_socialmedia', { method: 'POST' })
-      .then(() => {
-        loadPosts();
-        setFetching(false);
+      .then(res => res.json())
+      .then(job => {
+        // The fetch runs in the background; poll the job until it finishes
+        const poll = () => {
+          fetch(`http://127.0.0.1:5000/api/fetch_socialmedia/${job.job_id}`)
+            .then(res => res.json())
+            .then(status => {
+              if (status.status === 'queued' || status.status === 'running') {
+                setTimeout(poll, 1000);
+              } else {
+                loadPosts();
+                setFetching(false);
+              }
+            })
+            .catch(() => setFetching(false));
+        };
+        poll();
       })
       .catch(() => setFetching(false));
   };
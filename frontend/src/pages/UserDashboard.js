@@ -120,8 +120,10 @@ export default function UserDashboard() {
       formData.append('media', reportForm.media);
     }
     try {
+      // The signed token identifies the uploader without a lookup on the server
       const res = await fetch('http://127.0.0.1:5000/api/report', {
         method: 'POST',
+        headers: userObj.token ? { Authorization: `Bearer ${userObj.token}` } : {},
         body: formData
       });
       const data = await res.json();